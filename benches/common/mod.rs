@@ -0,0 +1,153 @@
+// Shared by the benchmark binaries; each uses only part of it.
+#![allow(dead_code)]
+
+pub mod synthetic;
+
+use std::collections::BTreeMap;
+use std::fs;
+use std::hint::black_box;
+use std::path::PathBuf;
+use std::process;
+use std::time::{Duration, Instant};
+
+// Allowed slowdown against the saved baseline before a run fails.
+const DEFAULT_THRESHOLD_PERCENT: f64 = 10.0;
+// Timed samples per case; the median is reported.
+const SAMPLES: usize = 25;
+// Each sample runs the routine enough times to take about this long.
+const SAMPLE_TARGET: Duration = Duration::from_millis(20);
+
+pub struct Metric {
+    pub name: String,
+    pub value: f64,
+    pub unit: &'static str,
+    pub higher_is_better: bool,
+}
+
+// A benchmark binary's results, compared against and optionally saved to
+// `benches/baselines/<suite>.json`.
+//
+//     cargo bench --bench kpis -- --save-baseline    record the current numbers
+//     cargo bench --bench kpis                       fail on >10% regressions
+//     cargo bench --bench kpis -- --threshold 25 batch
+//
+// A bare argument only runs the cases whose name contains it.
+pub struct Suite {
+    name: &'static str,
+    filter: Option<String>,
+    save_baseline: bool,
+    threshold_percent: f64,
+    metrics: Vec<Metric>,
+}
+
+impl Suite {
+    pub fn from_args(name: &'static str) -> Self {
+        let mut suite = Suite {
+            name,
+            filter: None,
+            save_baseline: false,
+            threshold_percent: DEFAULT_THRESHOLD_PERCENT,
+            metrics: Vec::new(),
+        };
+        let mut args = std::env::args().skip(1);
+        while let Some(arg) = args.next() {
+            match arg.as_str() {
+                "--save-baseline" => suite.save_baseline = true,
+                "--threshold" => {
+                    suite.threshold_percent =
+                        args.next().and_then(|value| value.parse().ok()).expect("--threshold takes a percentage");
+                }
+                // Flags cargo passes to every bench target.
+                flag if flag.starts_with("--") => {}
+                filter => suite.filter = Some(filter.to_string()),
+            }
+        }
+        suite
+    }
+
+    pub fn enabled(&self, name: &str) -> bool {
+        self.filter.as_deref().map_or(true, |filter| name.contains(filter))
+    }
+
+    // Median time per call of `routine`, in nanoseconds.
+    pub fn time<T>(&mut self, name: &str, mut routine: impl FnMut() -> T) {
+        if !self.enabled(name) {
+            return;
+        }
+        let mut iterations = 1u64;
+        loop {
+            let start = Instant::now();
+            for _ in 0..iterations {
+                black_box(routine());
+            }
+            if start.elapsed() >= SAMPLE_TARGET / 2 {
+                break;
+            }
+            iterations *= 2;
+        }
+
+        let mut samples: Vec<f64> = (0..SAMPLES)
+            .map(|_| {
+                let start = Instant::now();
+                for _ in 0..iterations {
+                    black_box(routine());
+                }
+                start.elapsed().as_nanos() as f64 / iterations as f64
+            })
+            .collect();
+        samples.sort_by(f64::total_cmp);
+        self.record(Metric { name: name.to_string(), value: samples[SAMPLES / 2], unit: "ns", higher_is_better: false });
+    }
+
+    pub fn record(&mut self, metric: Metric) {
+        if self.enabled(&metric.name) {
+            self.metrics.push(metric);
+        }
+    }
+
+    // Prints the results against the baseline, saves them when asked, and
+    // exits with status 1 if any metric regressed past the threshold.
+    pub fn finish(self) {
+        let path = PathBuf::from(env!("CARGO_MANIFEST_DIR")).join("benches/baselines").join(format!("{}.json", self.name));
+        let mut baseline: BTreeMap<String, f64> = fs::read(&path)
+            .ok()
+            .map(|json| serde_json::from_slice(&json).expect("benchmark baseline is valid JSON"))
+            .unwrap_or_default();
+
+        let mut regressions = Vec::new();
+        for metric in &self.metrics {
+            let comparison = match baseline.get(&metric.name) {
+                Some(&saved) if saved > 0.0 => {
+                    let change = (metric.value - saved) / saved * 100.0;
+                    let worse = if metric.higher_is_better { -change } else { change };
+                    if worse > self.threshold_percent {
+                        regressions.push(metric.name.as_str());
+                        format!("{change:+.1}%  REGRESSION")
+                    } else {
+                        format!("{change:+.1}%")
+                    }
+                }
+                _ => "no baseline".to_string(),
+            };
+            println!("{:<48} {:>14.1} {:<6} {}", metric.name, metric.value, metric.unit, comparison);
+        }
+
+        if self.save_baseline {
+            // Merged, so a filtered run only replaces the cases it ran.
+            baseline.extend(self.metrics.iter().map(|metric| (metric.name.clone(), metric.value)));
+            fs::create_dir_all(path.parent().unwrap()).expect("cannot create benches/baselines");
+            let json = serde_json::to_string_pretty(&baseline).expect("baseline serializes to JSON");
+            fs::write(&path, json + "\n").expect("cannot write benchmark baseline");
+            println!("baseline saved to {}", path.display());
+        } else if !regressions.is_empty() {
+            eprintln!(
+                "{} regressed by more than {}% against {}: {}",
+                self.name,
+                self.threshold_percent,
+                path.display(),
+                regressions.join(", ")
+            );
+            process::exit(1);
+        }
+    }
+}
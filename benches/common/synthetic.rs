@@ -0,0 +1,206 @@
+use std::collections::BTreeMap;
+
+use italian_gaap_kpi_analyzer::app_logic::balance_sheet_config::{get_balance_sheet_structure, BalanceSheetStructure};
+use italian_gaap_kpi_analyzer::app_logic::positions::BalanceSheet;
+use rand::{Rng, SeedableRng};
+use rand_chacha::ChaCha8Rng;
+
+// Reproducible balance sheets laid out like `get_balance_sheet_structure`:
+// total assets between 100k and 100M euro, plausible shares per section,
+// only some positions of each section filled in, amounts in whole cents and
+// both sides balancing to the cent.
+pub struct SheetGenerator {
+    rng: ChaCha8Rng,
+    assets: Vec<Section>,
+    equity_and_provisions: Vec<Section>,
+    liabilities: Vec<Section>,
+    profit: Vec<String>,
+}
+
+// Positions sharing one slice of a side, with the range of that slice as a
+// share of the side's total (or of the debts, for `liabilities`).
+struct Section {
+    keys: Vec<String>,
+    share: (f64, f64),
+}
+
+fn section(keys: &[&Vec<String>], share: (f64, f64)) -> Section {
+    Section { keys: keys.iter().flat_map(|keys| keys.iter().cloned()).collect(), share }
+}
+
+impl SheetGenerator {
+    pub fn new(seed: u64) -> Self {
+        let BalanceSheetStructure { assets, equity_liabilities } = get_balance_sheet_structure();
+        let (nca, ca, tr) = (&assets.non_current_assets, &assets.current_assets, &assets.current_assets.trade_and_other_receivables);
+        let (eq, li) = (&equity_liabilities.equity, &equity_liabilities.liabilities);
+        SheetGenerator {
+            rng: ChaCha8Rng::seed_from_u64(seed),
+            assets: vec![
+                section(&[&nca.intangible_assets], (0.0, 0.08)),
+                section(&[&nca.tangible_assets], (0.10, 0.40)),
+                section(&[&nca.financial_investments_non_current], (0.0, 0.10)),
+                section(&[&ca.inventories], (0.05, 0.25)),
+                section(
+                    &[
+                        &tr.due_from_customers_current,
+                        &tr.due_from_subsidiaries_current,
+                        &tr.due_from_associates_current,
+                        &tr.due_from_parent_companies_current,
+                        &tr.tax_receivables_current,
+                        &tr.deferred_tax_assets_current,
+                        &tr.other_receivables_current,
+                    ],
+                    (0.15, 0.35),
+                ),
+                section(
+                    &[
+                        &tr.due_from_customers_non_current,
+                        &tr.due_from_subsidiaries_non_current,
+                        &tr.due_from_associates_non_current,
+                        &tr.due_from_parent_companies_non_current,
+                        &tr.tax_receivables_non_current,
+                        &tr.deferred_tax_assets_non_current,
+                        &tr.other_receivables_non_current,
+                    ],
+                    (0.0, 0.03),
+                ),
+                section(&[&ca.current_financial_assets], (0.0, 0.05)),
+                section(&[&ca.cash_and_cash_equivalents], (0.02, 0.12)),
+                section(&[&assets.prepaid_expenses_and_accrued_income], (0.0, 0.02)),
+            ],
+            equity_and_provisions: vec![
+                section(&[&eq.capital_social, &eq.fondo_di_dotazione], (0.05, 0.20)),
+                section(
+                    &[&eq.share_premium_reserve, &eq.revaluation_reserve, &eq.legal_reserve, &eq.statutory_reserves, &eq.other_reserves],
+                    (0.02, 0.15),
+                ),
+                section(&[&eq.retained_earnings_or_accumulated_loss_bf], (0.0, 0.15)),
+                section(&[&equity_liabilities.provisions_for_risks_and_charges], (0.0, 0.04)),
+                section(&[&equity_liabilities.employee_severance_indemnity_tfr], (0.01, 0.08)),
+                section(&[&equity_liabilities.accrued_expenses_and_deferred_income], (0.0, 0.02)),
+            ],
+            liabilities: vec![
+                section(&[&li.bonds_issued, &li.convertible_bonds_issued], (0.0, 0.02)),
+                section(&[&li.amounts_owed_to_shareholders_for_loans], (0.0, 0.05)),
+                section(&[&li.amounts_owed_to_banks], (0.20, 0.50)),
+                section(&[&li.amounts_owed_to_other_lenders], (0.0, 0.10)),
+                section(&[&li.advances_received_from_customers], (0.0, 0.05)),
+                section(&[&li.trade_payables], (0.30, 0.50)),
+                section(&[&li.debt_represented_by_credit_instruments], (0.0, 0.03)),
+                section(&[&li.amounts_owed_to_group_companies], (0.0, 0.10)),
+                section(&[&li.tax_payables], (0.02, 0.06)),
+                section(&[&li.social_security_payables], (0.01, 0.04)),
+                section(&[&li.other_payables], (0.02, 0.10)),
+            ],
+            profit: eq.profit_or_loss_for_the_year.clone(),
+        }
+    }
+
+    // One sheet as the string-keyed map the form produces ("1", "39.NCA", ...).
+    pub fn sheet(&mut self) -> BTreeMap<String, f64> {
+        let mut cents = BTreeMap::new();
+        let total: i64 = (10f64.powf(self.rng.random_range(5.0..8.0)) * 100.0) as i64;
+
+        let asset_shares = self.shares(&self.assets.iter().map(|s| s.share).collect::<Vec<_>>());
+        for (index, amount) in allocate(total, &asset_shares).into_iter().enumerate() {
+            self.spread(&mut cents, Side::Assets, index, amount);
+        }
+
+        // Equity, provisions, TFR and accruals take their drawn share of the
+        // total; the year's result is a signed slice; debts balance the rest.
+        let mut used = 0;
+        for index in 0..self.equity_and_provisions.len() {
+            let (low, high) = self.equity_and_provisions[index].share;
+            let amount = (total as f64 * self.rng.random_range(low..high)) as i64;
+            self.spread(&mut cents, Side::EquityAndProvisions, index, amount);
+            used += amount;
+        }
+        let profit = (total as f64 * self.rng.random_range(-0.03..0.06)) as i64;
+        cents.insert(self.profit[0].clone(), profit);
+        let debts = total - used - profit;
+        let debt_shares = self.shares(&self.liabilities.iter().map(|s| s.share).collect::<Vec<_>>());
+        for (index, amount) in allocate(debts, &debt_shares).into_iter().enumerate() {
+            self.spread(&mut cents, Side::Liabilities, index, amount);
+        }
+
+        cents.into_iter().filter(|(_, c)| *c != 0).map(|(key, c)| (key, c as f64 / 100.0)).collect()
+    }
+
+    pub fn balance_sheet(&mut self) -> BalanceSheet {
+        BalanceSheet::from_map(&self.sheet())
+    }
+
+    fn shares(&mut self, ranges: &[(f64, f64)]) -> Vec<f64> {
+        ranges.iter().map(|&(low, high)| if high > low { self.rng.random_range(low..high) } else { low }).collect()
+    }
+
+    // Splits `amount` over a random non-empty subset of the section's positions.
+    fn spread(&mut self, cents: &mut BTreeMap<String, i64>, side: Side, index: usize, amount: i64) {
+        let section = match side {
+            Side::Assets => &self.assets[index],
+            Side::EquityAndProvisions => &self.equity_and_provisions[index],
+            Side::Liabilities => &self.liabilities[index],
+        };
+        let mut weights: Vec<f64> =
+            section.keys.iter().map(|_| if self.rng.random_bool(0.6) { self.rng.random::<f64>() } else { 0.0 }).collect();
+        if weights.iter().all(|w| *w == 0.0) {
+            let pick = self.rng.random_range(0..weights.len());
+            weights[pick] = 1.0;
+        }
+        for (key, part) in section.keys.iter().zip(allocate(amount, &weights)) {
+            *cents.entry(key.clone()).or_insert(0) += part;
+        }
+    }
+}
+
+#[derive(Clone, Copy)]
+enum Side {
+    Assets,
+    EquityAndProvisions,
+    Liabilities,
+}
+
+// `total` split proportionally to `weights`; the rounding remainder goes to
+// the largest weight so the parts add up exactly.
+fn allocate(total: i64, weights: &[f64]) -> Vec<i64> {
+    let sum: f64 = weights.iter().sum();
+    let mut parts: Vec<i64> = weights.iter().map(|w| (total as f64 * w / sum) as i64).collect();
+    let largest = (0..weights.len()).max_by(|&a, &b| weights[a].total_cmp(&weights[b])).unwrap_or(0);
+    parts[largest] += total - parts.iter().sum::<i64>();
+    parts
+}
+
+// The input form's fields for `sheet`, amounts written the Italian way
+// ("1.234.567,89").
+pub fn form_fields(sheet: &BTreeMap<String, f64>) -> BTreeMap<String, String> {
+    sheet.iter().map(|(key, value)| (format!("pos_{key}"), italian_amount(*value))).collect()
+}
+
+// A URL-encoded body as posted to /calculate.
+pub fn form_body(kpis: &[String], sheet: &BTreeMap<String, f64>) -> String {
+    let mut body = url::form_urlencoded::Serializer::new(String::new());
+    for kpi in kpis {
+        body.append_pair("kpi_keys[]", kpi);
+    }
+    for (field, value) in form_fields(sheet) {
+        body.append_pair(&field, &value);
+    }
+    body.finish()
+}
+
+pub fn italian_amount(value: f64) -> String {
+    let cents = (value.abs() * 100.0).round() as u64;
+    let digits = (cents / 100).to_string();
+    let mut text = String::with_capacity(digits.len() * 4 / 3 + 4);
+    if value < 0.0 {
+        text.push('-');
+    }
+    for (i, digit) in digits.chars().enumerate() {
+        if i > 0 && (digits.len() - i) % 3 == 0 {
+            text.push('.');
+        }
+        text.push(digit);
+    }
+    text.push_str(&format!(",{:02}", cents % 100));
+    text
+}
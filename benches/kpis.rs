@@ -0,0 +1,148 @@
+mod common;
+
+use common::synthetic::{form_body, form_fields, SheetGenerator};
+use common::Suite;
+use italian_gaap_kpi_analyzer::app_logic::{
+    batch::{calculate_kpis_batch, PositionMatrix},
+    calculator::{calculate_selected_kpis, validate_balance_sheet},
+    columnar::{ArchivedFiling, ColumnStore},
+    constants::AppState,
+    kpi_config::KPI_DEFINITIONS,
+    kpi_requirements_logic::get_required_positions,
+    mappings_config::ChartMapping,
+    peers::{Filing, PeerIndex, SizeClass},
+    positions::BalanceSheet,
+    screening::{screen, Comparison, Predicate, Screen},
+    validators::{validate_financial_data, PositionForm},
+};
+use italian_gaap_kpi_analyzer::render_results_page;
+
+const BATCH_SHEETS: usize = 100_000;
+const PEER_FILINGS: usize = 10_000;
+const LEDGER_LINES: usize = 1_000_000;
+
+fn main() {
+    let mut suite = Suite::from_args("kpis");
+    let mut generator = SheetGenerator::new(42);
+    let all_kpis: Vec<String> = KPI_DEFINITIONS.iter().map(|d| d.key.to_string()).collect();
+    let one_kpi = vec!["current_ratio".to_string()];
+
+    let map = generator.sheet();
+    let sheet = BalanceSheet::from_map(&map);
+    suite.time("calculate_selected_kpis/1 kpi", || calculate_selected_kpis(&sheet, &one_kpi));
+    suite.time("calculate_selected_kpis/19 kpis", || calculate_selected_kpis(&sheet, &all_kpis));
+    suite.time("calculate_selected_kpis/19 kpis, map input", || calculate_selected_kpis(&map, &all_kpis));
+    suite.time("validate_balance_sheet", || validate_balance_sheet(&sheet));
+
+    // Generating 100k sheets takes a while; skip it when filtered out.
+    const PER_SHEET: &str = "batch/100k sheets, one call each";
+    const BATCH: &str = "batch/100k sheets, calculate_kpis_batch";
+    const COLUMNAR: &str = "batch/100k sheets, mapped column store";
+    // current_ratio < 1 and debt_ratio > 0.8, as a screen and as every KPI
+    // computed for every filing and filtered afterwards.
+    const SCREEN: &str = "screening/100k filings, 2 predicates";
+    const SCREEN_AFTER: &str = "screening/100k filings, filter after calculating all kpis";
+    let archived = suite.enabled(COLUMNAR) || suite.enabled(SCREEN) || suite.enabled(SCREEN_AFTER);
+    if suite.enabled(PER_SHEET) || suite.enabled(BATCH) || archived {
+        let sheets: Vec<BalanceSheet> = (0..BATCH_SHEETS).map(|_| generator.balance_sheet()).collect();
+        let matrix = PositionMatrix::from_sheets(&sheets);
+        suite.time(PER_SHEET, || {
+            sheets.iter().map(|sheet| calculate_selected_kpis(sheet, &all_kpis).len()).sum::<usize>()
+        });
+        suite.time(BATCH, || calculate_kpis_batch(&matrix, &all_kpis));
+
+        if archived {
+            let dir = std::env::temp_dir().join(format!("kpi-bench-columns-{}", std::process::id()));
+            let filings: Vec<ArchivedFiling> = sheets
+                .into_iter()
+                .enumerate()
+                .map(|(i, positions)| ArchivedFiling {
+                    company: format!("company {}", i / 10),
+                    fiscal_year: 2015 + (i % 10) as i32,
+                    sector: String::new(),
+                    positions,
+                })
+                .collect();
+            ColumnStore::open(&dir).and_then(|mut store| store.append(&filings)).expect("cannot write the column store");
+            suite.time(COLUMNAR, || ColumnStore::open(&dir).and_then(|store| store.calculate(&all_kpis)).unwrap());
+
+            let store = ColumnStore::open(&dir).unwrap();
+            let query = Screen {
+                predicates: vec![
+                    Predicate { kpi: "current_ratio".to_string(), op: Comparison::Less, value: 1.0 },
+                    Predicate { kpi: "debt_ratio".to_string(), op: Comparison::Greater, value: 0.8 },
+                ],
+                ..Screen::default()
+            };
+            suite.time(SCREEN, || screen(&store, &query, |_| true).unwrap().matches);
+            let [current_ratio, debt_ratio] = ["current_ratio", "debt_ratio"].map(|key| all_kpis.iter().position(|k| k == key).unwrap());
+            suite.time(SCREEN_AFTER, || {
+                let batch = store.calculate(&all_kpis).unwrap();
+                let (current, debt) = (batch.values_column(current_ratio), batch.values_column(debt_ratio));
+                (0..batch.rows).filter(|&row| current[row] < 1.0 && debt[row] > 0.8).count()
+            });
+            let _ = std::fs::remove_dir_all(&dir);
+        }
+    }
+
+    // The form as the input page posts it: every position of the selected
+    // KPIs, amounts with thousands dots and a decimal comma.
+    let required = get_required_positions(&all_kpis);
+    let required_keys: Vec<String> = required.keys().map(str::to_string).collect();
+    let fields = form_fields(&map);
+    suite.time("validate_financial_data/all positions", || validate_financial_data(&fields, &required_keys));
+    let body = form_body(&all_kpis, &map);
+    suite.time("PositionForm/decode and validate form body", || PositionForm::decode(body.as_bytes()).validate(required));
+
+    const PEERS_ADD: &str = "peers/add_filings 10k";
+    const PEERS_RANK: &str = "peers/rank 19 kpis";
+    if suite.enabled(PEERS_ADD) || suite.enabled(PEERS_RANK) {
+        let sectors = ["C", "F", "G", "I"];
+        let filings: Vec<Filing> = (0..PEER_FILINGS)
+            .map(|i| Filing { sector: sectors[i % sectors.len()].to_string(), size_class: None, positions: generator.balance_sheet() })
+            .collect();
+        suite.time(PEERS_ADD, || PeerIndex::new().add_filings(&filings));
+        let mut index = PeerIndex::new();
+        index.add_filings(&filings);
+        // In `KPI_DEFINITIONS` order, as `rank` takes them.
+        let results = calculate_selected_kpis(&sheet, &all_kpis);
+        let values: Vec<f64> = all_kpis.iter().map(|key| results[key].value.unwrap_or(0.0)).collect();
+        suite.time(PEERS_RANK, || {
+            values.iter().enumerate().filter_map(|(kpi, value)| index.rank("C", SizeClass::Small, kpi, *value)).count()
+        });
+    }
+
+    // A chart of 160 range rules over 80 account groups (60..79 being income
+    // statement accounts) and a ledger of dotted account codes.
+    const LEDGER: &str = "ledger/1M lines, aggregate into positions";
+    if suite.enabled(LEDGER) {
+        let positions = ["1", "11", "12", "31", "39", "45", "49", "52", "58", "65", "69", "73", "79", "80", "85", "100"];
+        let rules: Vec<String> = (10..90)
+            .flat_map(|group| {
+                [(0, 49), (50, 99)].map(|(from, to)| match group {
+                    60..=79 => format!(r#"{{"accounts": "{group}{from:02}..{group}{to:02}", "ignore": true}}"#),
+                    _ => {
+                        let position = positions[(group + from) % positions.len()];
+                        format!(r#"{{"accounts": "{group}{from:02}..{group}{to:02}", "position": "{position}"}}"#)
+                    }
+                })
+            })
+            .collect();
+        let mapping = ChartMapping::from_json(format!(r#"{{"rules": [{}]}}"#, rules.join(",")).as_bytes()).unwrap();
+        let mut ledger = String::from("Conto;Descrizione;Dare;Avere\n");
+        for i in 0..LEDGER_LINES {
+            let account = format!("{}.{:02}.{:03}", 10 + i % 80, (i * 7) % 100, (i * 13) % 1000);
+            let amount = format!("{},{:02}", (i * 37) % 100_000, i % 100);
+            let (debit, credit) = if i % 3 == 0 { ("", amount.as_str()) } else { (amount.as_str(), "") };
+            ledger.push_str(&format!("{account};Movimento {i};{debit};{credit}\n"));
+        }
+        suite.time(LEDGER, || mapping.aggregate(ledger.as_bytes(), "ledger.csv").unwrap().mapped_lines);
+    }
+
+    let app = AppState::new();
+    let results = calculate_selected_kpis(&sheet, &all_kpis);
+    let balance_check = validate_balance_sheet(&sheet);
+    suite.time("render results.html/19 kpis", || render_results_page(&app.available_kpis, &results, Some(&balance_check)));
+
+    suite.finish();
+}
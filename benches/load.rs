@@ -0,0 +1,173 @@
+mod common;
+
+use std::io;
+use std::net::SocketAddr;
+use std::sync::Arc;
+use std::time::{Duration, Instant};
+
+use common::synthetic::{form_body, SheetGenerator};
+use common::{Metric, Suite};
+use italian_gaap_kpi_analyzer::app_logic::kpi_config::KPI_DEFINITIONS;
+use italian_gaap_kpi_analyzer::router;
+use tokio::io::{AsyncBufReadExt, AsyncReadExt, AsyncWriteExt, BufReader};
+use tokio::net::{TcpListener, TcpStream};
+
+// Keep-alive connections issuing requests back to back.
+const CONNECTIONS: usize = 32;
+const WARMUP: Duration = Duration::from_secs(1);
+const DURATION: Duration = Duration::from_secs(5);
+// Distinct synthetic sheets cycled through by the POST scenarios.
+const DISTINCT_BODIES: usize = 256;
+
+struct Scenario {
+    name: &'static str,
+    // Complete HTTP/1.1 requests, sent in turn.
+    requests: Vec<Vec<u8>>,
+}
+
+// End-to-end load test: the real router on an ephemeral port, driven over
+// TCP by CONNECTIONS clients per scenario. Reports p50 / p99 latency and
+// throughput; the server has its own runtime so client work does not run on
+// its worker threads.
+fn main() {
+    let mut suite = Suite::from_args("load");
+
+    let server = tokio::runtime::Runtime::new().expect("cannot start the server runtime");
+    let listener = server.block_on(TcpListener::bind("127.0.0.1:0")).expect("cannot bind an ephemeral port");
+    let addr = listener.local_addr().unwrap();
+    server.spawn(async move { axum::serve(listener, router()).await.expect("Server error") });
+
+    let client = tokio::runtime::Runtime::new().expect("cannot start the client runtime");
+    for scenario in scenarios() {
+        let names = [
+            format!("{} p50", scenario.name),
+            format!("{} p99", scenario.name),
+            format!("{} throughput", scenario.name),
+        ];
+        if !names.iter().any(|name| suite.enabled(name)) {
+            continue;
+        }
+        let scenario = Arc::new(scenario);
+        client.block_on(run(addr, scenario.clone(), WARMUP));
+        let (mut latencies, elapsed) = client.block_on(run(addr, scenario, DURATION));
+
+        latencies.sort_unstable();
+        let percentile = |p: usize| latencies[(latencies.len() * p / 100).min(latencies.len() - 1)] as f64;
+        let [p50, p99, throughput] = names;
+        suite.record(Metric { name: p50, value: percentile(50), unit: "us", higher_is_better: false });
+        suite.record(Metric { name: p99, value: percentile(99), unit: "us", higher_is_better: false });
+        let rate = latencies.len() as f64 / elapsed.as_secs_f64();
+        suite.record(Metric { name: throughput, value: rate, unit: "req/s", higher_is_better: true });
+    }
+
+    suite.finish();
+}
+
+fn scenarios() -> Vec<Scenario> {
+    let all_kpis: Vec<String> = KPI_DEFINITIONS.iter().map(|d| d.key.to_string()).collect();
+    let mut generator = SheetGenerator::new(7);
+    let sheets: Vec<_> = (0..DISTINCT_BODIES).map(|_| generator.sheet()).collect();
+
+    vec![
+        Scenario { name: "GET /", requests: vec![get("/")] },
+        Scenario { name: "GET /input", requests: vec![get("/input?kpis=current_ratio,debt_to_equity,quick_ratio")] },
+        Scenario {
+            name: "POST /calculate",
+            requests: sheets
+                .iter()
+                .map(|sheet| post("/calculate", "application/x-www-form-urlencoded", form_body(&all_kpis, sheet).as_bytes()))
+                .collect(),
+        },
+        Scenario {
+            name: "POST /api/v1/kpis",
+            requests: sheets
+                .iter()
+                .map(|sheet| {
+                    let json = serde_json::json!({ "positions": sheet });
+                    post("/api/v1/kpis", "application/json", json.to_string().as_bytes())
+                })
+                .collect(),
+        },
+    ]
+}
+
+fn get(path: &str) -> Vec<u8> {
+    format!("GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n").into_bytes()
+}
+
+fn post(path: &str, content_type: &str, body: &[u8]) -> Vec<u8> {
+    let mut request = format!(
+        "POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: {content_type}\r\nContent-Length: {}\r\n\r\n",
+        body.len()
+    )
+    .into_bytes();
+    request.extend_from_slice(body);
+    request
+}
+
+// Per-request latencies in microseconds from all connections, and the time
+// the run actually took.
+async fn run(addr: SocketAddr, scenario: Arc<Scenario>, duration: Duration) -> (Vec<u64>, Duration) {
+    let start = Instant::now();
+    let deadline = start + duration;
+    let clients: Vec<_> = (0..CONNECTIONS)
+        .map(|connection| {
+            let scenario = scenario.clone();
+            tokio::spawn(async move {
+                let mut stream = BufReader::new(TcpStream::connect(addr).await.expect("cannot connect to the server"));
+                let mut latencies = Vec::new();
+                let mut next = connection;
+                while Instant::now() < deadline {
+                    let request = &scenario.requests[next % scenario.requests.len()];
+                    next += 1;
+                    let sent = Instant::now();
+                    let status = exchange(&mut stream, request).await.expect("request failed");
+                    assert_eq!(status, 200, "{} answered {status}", scenario.name);
+                    latencies.push(sent.elapsed().as_micros() as u64);
+                }
+                latencies
+            })
+        })
+        .collect();
+
+    let mut latencies = Vec::new();
+    for client in clients {
+        latencies.extend(client.await.expect("load client panicked"));
+    }
+    (latencies, start.elapsed())
+}
+
+// Sends one request on a keep-alive connection and reads the whole response;
+// returns its status code. Every route under test answers with Content-Length.
+async fn exchange(stream: &mut BufReader<TcpStream>, request: &[u8]) -> io::Result<u16> {
+    stream.get_mut().write_all(request).await?;
+
+    let mut line = String::new();
+    stream.read_line(&mut line).await?;
+    let status = line
+        .split_whitespace()
+        .nth(1)
+        .and_then(|code| code.parse().ok())
+        .ok_or_else(|| io::Error::new(io::ErrorKind::InvalidData, format!("bad status line: {line:?}")))?;
+
+    let mut content_length = None;
+    loop {
+        line.clear();
+        if stream.read_line(&mut line).await? == 0 {
+            return Err(io::ErrorKind::UnexpectedEof.into());
+        }
+        let header = line.trim_end();
+        if header.is_empty() {
+            break;
+        }
+        if let Some((name, value)) = header.split_once(':') {
+            if name.eq_ignore_ascii_case("content-length") {
+                content_length = value.trim().parse::<usize>().ok();
+            }
+        }
+    }
+    let length = content_length.ok_or_else(|| io::Error::new(io::ErrorKind::InvalidData, "response without Content-Length"))?;
+    let mut body = vec![0; length];
+    stream.read_exact(&mut body).await?;
+    Ok(status)
+}
@@ -0,0 +1,858 @@
+use std::collections::BTreeMap;
+use std::convert::Infallible;
+use std::io::{self, Read};
+use std::sync::RwLock;
+
+use axum::{
+    body::{Body, Bytes},
+    extract::{Query, State},
+    http::{header, StatusCode},
+    response::{IntoResponse, Response},
+};
+use futures_util::StreamExt;
+use serde::{Deserialize, Serialize};
+use tokio::sync::mpsc;
+use tokio_stream::wrappers::ReceiverStream;
+
+use crate::app_logic::{
+    calculator::{validate_balance_sheet, BalanceCheck, KpiResult, KpiStatus},
+    columnar::{ArchivedFiling, ColumnStoreError},
+    importer::{import_bytes, ImportError, RowError},
+    kpi_config::{get_kpi_definition, OptimalRange, KPI_DEFINITIONS},
+    kpi_plan::KpiPlan,
+    mappings_config::{LedgerReport, MappingError},
+    peers::{normalize_sector, Filing, PeerIndex, PeerRank, SizeClass},
+    positions::{position_index, position_key, BalanceSheet},
+    screening::{screen, Screen, ScreenStats},
+    sensitivity::{evaluate_scenarios, optimal_range_breakevens, Breakeven, LinearKpi, ScenarioAxis, ScenarioError, Shift},
+    stress::{run_stress_test, Distribution, Shock, StressConfig},
+};
+use crate::AppState;
+
+// Longest accepted NDJSON record; longer lines are skipped and reported.
+const MAX_RECORD_BYTES: usize = 1 << 20;
+// Results buffered ahead of a slow client before reading of the upload pauses.
+const STREAM_BUFFER_RECORDS: usize = 64;
+const NDJSON: &str = "application/x-ndjson";
+// Largest accepted spreadsheet upload.
+pub const MAX_IMPORT_BYTES: usize = 64 << 20;
+// Largest what-if grid (points x KPIs) computed per request.
+const MAX_SCENARIO_VALUES: usize = 2_000_000;
+// Monte Carlo draws per stress test, by default and at most.
+const DEFAULT_STRESS_SAMPLES: usize = 100_000;
+const MAX_STRESS_SAMPLES: usize = 10_000_000;
+const DEFAULT_STRESS_BINS: usize = 50;
+const MAX_STRESS_BINS: usize = 1_000;
+// Peer quantiles reported by GET /api/v1/peers.
+const PEER_QUANTILES: [(&str, f64); 5] = [("p10", 0.1), ("p25", 0.25), ("p50", 0.5), ("p75", 0.75), ("p90", 0.9)];
+
+#[derive(Debug, Deserialize)]
+pub struct SheetRequest {
+    #[serde(default)]
+    pub id: Option<String>,
+    #[serde(default)]
+    pub kpis: Option<Vec<String>>,
+    pub positions: BalanceSheet,
+    // With a sector, each result is ranked against the peer index.
+    #[serde(default)]
+    pub sector: Option<String>,
+    #[serde(default)]
+    pub size_class: Option<SizeClass>,
+}
+
+#[derive(Serialize)]
+struct SheetResponse<'a> {
+    #[serde(skip_serializing_if = "Option::is_none")]
+    id: Option<&'a str>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    line: Option<u64>,
+    results: BTreeMap<&'a str, KpiResultBody>,
+    balance_check: BalanceCheck,
+}
+
+#[derive(Serialize)]
+pub(crate) struct KpiResultBody {
+    value: Option<f64>,
+    status: KpiStatus,
+    message: &'static str,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    peers: Option<PeerRank>,
+}
+
+impl From<&KpiResult> for KpiResultBody {
+    fn from(result: &KpiResult) -> Self {
+        KpiResultBody { value: result.value, status: result.status, message: result.message(), peers: None }
+    }
+}
+
+#[derive(Serialize)]
+struct ImportResponse<'a> {
+    sheets: Vec<ImportedSheetResponse<'a>>,
+    errors: &'a [RowError],
+}
+
+#[derive(Serialize)]
+struct ImportedSheetResponse<'a> {
+    company: Option<&'a str>,
+    year: Option<&'a str>,
+    results: BTreeMap<&'a str, KpiResultBody>,
+    balance_check: BalanceCheck,
+}
+
+#[derive(Serialize)]
+struct LedgerResponse<'a> {
+    #[serde(flatten)]
+    report: &'a LedgerReport,
+    results: BTreeMap<&'a str, KpiResultBody>,
+    balance_check: BalanceCheck,
+}
+
+#[derive(Debug, Deserialize)]
+pub struct SensitivityRequest {
+    #[serde(default)]
+    pub kpis: Option<Vec<String>>,
+    pub positions: BalanceSheet,
+    #[serde(default)]
+    pub scenarios: Vec<ScenarioRequest>,
+}
+
+// Positions moved together from `from` to `to` in `step` increments, e.g.
+// {"positions": ["73", "80"], "from": -0.3, "to": 0.3, "step": 0.01}.
+#[derive(Debug, Deserialize)]
+pub struct ScenarioRequest {
+    pub positions: Vec<String>,
+    #[serde(default)]
+    pub shift: Shift,
+    pub from: f64,
+    pub to: f64,
+    pub step: f64,
+}
+
+#[derive(Serialize)]
+struct SensitivityResponse<'a> {
+    kpis: BTreeMap<&'a str, KpiSensitivity>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    scenarios: Option<ScenarioResponse<'a>>,
+}
+
+#[derive(Serialize)]
+struct KpiSensitivity {
+    #[serde(flatten)]
+    result: KpiResultBody,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    optimal_range: Option<OptimalRange>,
+    gradient: BTreeMap<&'static str, f64>,
+    breakevens: Vec<Breakeven>,
+}
+
+#[derive(Serialize)]
+struct ScenarioResponse<'a> {
+    shape: &'a [usize],
+    steps: Vec<&'a [f64]>,
+    // Point-major values per KPI, last axis fastest; null where undefined.
+    values: BTreeMap<&'a str, Vec<Option<f64>>>,
+}
+
+#[derive(Debug, Deserialize)]
+pub struct StressRequest {
+    #[serde(default)]
+    pub kpis: Option<Vec<String>>,
+    pub positions: BalanceSheet,
+    #[serde(default)]
+    pub samples: Option<usize>,
+    #[serde(default)]
+    pub seed: u64,
+    #[serde(default)]
+    pub bins: Option<usize>,
+    pub shocks: Vec<ShockRequest>,
+}
+
+// Relative shock shared by a group of positions, e.g. receivables down by a
+// triangular -30%..+5% (mode -10%), moving together:
+// {"positions": ["39", "40"], "distribution": {"type": "triangular",
+//  "min": -0.3, "mode": -0.1, "max": 0.05}, "correlation": 1.0}.
+#[derive(Debug, Deserialize)]
+pub struct ShockRequest {
+    pub positions: Vec<String>,
+    pub distribution: Distribution,
+    #[serde(default)]
+    pub correlation: f64,
+}
+
+#[derive(Serialize)]
+struct PeerIngestResponse {
+    added: usize,
+    filings: u64,
+    errors: Vec<LineError>,
+}
+
+#[derive(Serialize)]
+struct ArchiveIngestResponse {
+    added: usize,
+    rows: usize,
+    errors: Vec<LineError>,
+}
+
+// Last line of a screening stream.
+#[derive(Serialize)]
+struct ScreenSummary {
+    summary: ScreenStats,
+}
+
+#[derive(Serialize)]
+struct LineError {
+    line: usize,
+    error: String,
+}
+
+#[derive(Serialize)]
+struct PeerGroupResponse<'a> {
+    sector: Option<&'a str>,
+    size_class: Option<SizeClass>,
+    filings: u64,
+    kpis: BTreeMap<&'static str, PeerDistribution>,
+}
+
+#[derive(Serialize)]
+struct PeerDistribution {
+    peers: u64,
+    #[serde(flatten)]
+    quantiles: BTreeMap<&'static str, f64>,
+}
+
+#[derive(Serialize)]
+struct ErrorResponse<'a> {
+    #[serde(skip_serializing_if = "Option::is_none")]
+    id: Option<&'a str>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    line: Option<u64>,
+    error: &'a str,
+}
+
+// POST /api/v1/kpis: one balance sheet in, one JSON result out.
+pub async fn calculate_kpis(
+    State(state): State<AppState>,
+    Query(query): Query<BTreeMap<String, String>>,
+    body: Bytes,
+) -> Response {
+    let default_kpis = default_kpis(&query);
+    let mut plans = PlanCache::default();
+
+    match serde_json::from_slice::<SheetRequest>(&body) {
+        Ok(request) => match evaluate(&request, &default_kpis, &mut plans, None, &state.peers) {
+            Ok(json) => json_response(StatusCode::OK, json),
+            Err(json) => json_response(StatusCode::UNPROCESSABLE_ENTITY, json),
+        },
+        Err(err) => json_response(StatusCode::BAD_REQUEST, error_json(None, None, &err.to_string())),
+    }
+}
+
+// POST /api/v1/sensitivity: per-KPI gradient with respect to every position
+// it reads, the position values that reach the bounds of its optimal range,
+// and optionally a what-if grid over the requested scenario axes.
+pub async fn sensitivity(Query(query): Query<BTreeMap<String, String>>, body: Bytes) -> Response {
+    let request = match serde_json::from_slice::<SensitivityRequest>(&body) {
+        Ok(request) => request,
+        Err(err) => return json_response(StatusCode::BAD_REQUEST, error_json(None, None, &err.to_string())),
+    };
+    let kpis = request.kpis.unwrap_or_else(|| default_kpis(&query));
+    if kpis.is_empty() {
+        return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, "Nessun KPI selezionato."));
+    }
+
+    let mut axes = Vec::with_capacity(request.scenarios.len());
+    for scenario in &request.scenarios {
+        let positions: Option<Vec<_>> = scenario.positions.iter().map(|key| position_index(key)).collect();
+        let Some(positions) = positions.filter(|p| !p.is_empty()) else {
+            let message = format!("Posizioni dello scenario non valide: {}", scenario.positions.join(", "));
+            return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, &message));
+        };
+        // No single axis may exceed the grid limit on its own; the product is checked below.
+        let max_steps = MAX_SCENARIO_VALUES / kpis.len();
+        match ScenarioAxis::range(positions, scenario.shift, scenario.from, scenario.to, scenario.step, max_steps) {
+            Ok(axis) => axes.push(axis),
+            Err(ScenarioError::InvalidRange { .. }) => {
+                let message = "Intervallo dello scenario non valido: from e to devono essere numeri finiti e step un numero positivo.";
+                return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, message));
+            }
+            Err(ScenarioError::TooManySteps { .. }) => return scenario_grid_too_large(),
+        }
+    }
+    let points = axes.iter().map(|axis| axis.steps.len()).try_fold(1usize, usize::checked_mul);
+    if points.and_then(|p| p.checked_mul(kpis.len())).map_or(true, |values| values > MAX_SCENARIO_VALUES) {
+        return scenario_grid_too_large();
+    }
+
+    // A grid can still hold millions of values: build it on the blocking pool.
+    let sheet = request.positions;
+    let result = tokio::task::spawn_blocking(move || sensitivity_json(&sheet, &kpis, &axes)).await;
+    match result {
+        Ok(json) => json_response(StatusCode::OK, json),
+        Err(_) => json_response(
+            StatusCode::INTERNAL_SERVER_ERROR,
+            error_json(None, None, "Errore interno durante l'analisi di sensitività."),
+        ),
+    }
+}
+
+fn sensitivity_json(sheet: &BalanceSheet, kpis: &[String], axes: &[ScenarioAxis]) -> Vec<u8> {
+    let results = kpis
+        .iter()
+        .map(|key| {
+            let sensitivity = match LinearKpi::get(key) {
+                Some(kpi) => KpiSensitivity {
+                    result: KpiResultBody::from(&kpi.evaluate(sheet)),
+                    optimal_range: Some(kpi.definition.optimal_range),
+                    gradient: kpi
+                        .gradient(sheet)
+                        .unwrap_or_default()
+                        .into_iter()
+                        .map(|(id, derivative)| (position_key(id), derivative))
+                        .collect(),
+                    breakevens: optimal_range_breakevens(&kpi, sheet),
+                },
+                None => KpiSensitivity {
+                    result: KpiResultBody::from(&KpiResult::failed(KpiStatus::UndefinedKpi)),
+                    optimal_range: None,
+                    gradient: BTreeMap::new(),
+                    breakevens: Vec::new(),
+                },
+            };
+            (key.as_str(), sensitivity)
+        })
+        .collect();
+
+    let grid = (!axes.is_empty()).then(|| evaluate_scenarios(sheet, kpis, axes));
+    let scenarios = grid.as_ref().map(|grid| ScenarioResponse {
+        shape: &grid.shape,
+        steps: axes.iter().map(|axis| axis.steps.as_slice()).collect(),
+        values: grid
+            .kpi_keys
+            .iter()
+            .enumerate()
+            .map(|(k, key)| {
+                let column = grid.values_column(k).iter().map(|v| v.is_finite().then_some(*v)).collect();
+                (key.as_str(), column)
+            })
+            .collect(),
+    });
+
+    let response = SensitivityResponse { kpis: results, scenarios };
+    serde_json::to_vec(&response).expect("sensitivity results serialize to JSON")
+}
+
+fn scenario_grid_too_large() -> Response {
+    let message = format!("Griglia di scenari troppo grande (massimo {MAX_SCENARIO_VALUES} valori).");
+    json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, &message))
+}
+
+// POST /api/v1/stress: Monte Carlo stress test of a balance sheet under
+// random shocks to groups of positions. Without `kpis` (in the body or on the
+// URL) it covers the crisis-law KPIs, reporting for each its distribution and
+// the probability of crossing the alert threshold. Sampling runs on the
+// blocking pool.
+pub async fn stress_test(Query(query): Query<BTreeMap<String, String>>, body: Bytes) -> Response {
+    let request = match serde_json::from_slice::<StressRequest>(&body) {
+        Ok(request) => request,
+        Err(err) => return json_response(StatusCode::BAD_REQUEST, error_json(None, None, &err.to_string())),
+    };
+    let kpis = match request.kpis {
+        Some(kpis) => kpis,
+        None if query.contains_key("kpis") => default_kpis(&query),
+        None => KPI_DEFINITIONS
+            .iter()
+            .filter(|definition| definition.crisis_threshold.is_some())
+            .map(|definition| definition.key.to_string())
+            .collect(),
+    };
+    if kpis.is_empty() {
+        return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, "Nessun KPI selezionato."));
+    }
+    let samples = request.samples.unwrap_or(DEFAULT_STRESS_SAMPLES);
+    if samples == 0 || samples > MAX_STRESS_SAMPLES {
+        let message = format!("Numero di simulazioni non valido (da 1 a {MAX_STRESS_SAMPLES}).");
+        return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, &message));
+    }
+
+    let mut shocks = Vec::with_capacity(request.shocks.len());
+    for shock in request.shocks {
+        let positions: Option<Vec<_>> = shock.positions.iter().map(|key| position_index(key)).collect();
+        let Some(positions) = positions.filter(|p| !p.is_empty()) else {
+            let message = format!("Posizioni dello shock non valide: {}", shock.positions.join(", "));
+            return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, &message));
+        };
+        shocks.push(Shock { positions, distribution: shock.distribution, correlation: shock.correlation });
+    }
+    let config = StressConfig {
+        samples,
+        seed: request.seed,
+        shocks,
+        histogram_bins: request.bins.unwrap_or(DEFAULT_STRESS_BINS).clamp(1, MAX_STRESS_BINS),
+    };
+
+    let sheet = request.positions;
+    let result = tokio::task::spawn_blocking(move || {
+        run_stress_test(&sheet, &kpis, &config)
+            .map(|result| serde_json::to_vec(&result).expect("stress test results serialize to JSON"))
+    })
+    .await;
+
+    match result {
+        Ok(Ok(json)) => json_response(StatusCode::OK, json),
+        Ok(Err(err)) => json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, &err.to_string())),
+        Err(_) => json_response(
+            StatusCode::INTERNAL_SERVER_ERROR,
+            error_json(None, None, "Errore interno durante la simulazione."),
+        ),
+    }
+}
+
+// POST /api/v1/kpis/stream: newline-delimited balance sheets in, one NDJSON
+// result per record out, processed as the upload arrives. The bounded channel
+// provides backpressure: while the client is not reading results, the upload
+// is not read either, so memory stays at one record plus the channel buffer.
+pub async fn calculate_kpis_stream(
+    State(state): State<AppState>,
+    Query(query): Query<BTreeMap<String, String>>,
+    body: Body,
+) -> Response {
+    let (tx, rx) = mpsc::channel(STREAM_BUFFER_RECORDS);
+    tokio::spawn(stream_records(state, body, default_kpis(&query), tx));
+
+    (
+        [(header::CONTENT_TYPE, NDJSON)],
+        Body::from_stream(ReceiverStream::new(rx)),
+    )
+        .into_response()
+}
+
+// POST /api/v1/import: an XLSX or CSV file as the request body. Returns the
+// KPIs of every company / fiscal year found in it plus the rows that could
+// not be imported. Parsing runs on the blocking pool.
+pub async fn import_balance_sheets(
+    State(state): State<AppState>,
+    Query(query): Query<BTreeMap<String, String>>,
+    body: Bytes,
+) -> Response {
+    let kpis = default_kpis(&query);
+    if kpis.is_empty() {
+        return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, "Nessun KPI selezionato."));
+    }
+    let name = query.get("name").cloned().unwrap_or_else(|| "upload".to_string());
+
+    let imported = tokio::task::spawn_blocking(move || {
+        let report = import_bytes(&body, &name, &state.app.position_resolver)?;
+        let plan = KpiPlan::compile(&kpis);
+        let sheets = report
+            .sheets
+            .iter()
+            .map(|imported| {
+                let sheet = BalanceSheet::from_map(&imported.data);
+                ImportedSheetResponse {
+                    company: imported.company.as_deref(),
+                    year: imported.year.as_deref(),
+                    results: kpi_results(&plan, &kpis, &sheet),
+                    balance_check: validate_balance_sheet(&sheet),
+                }
+            })
+            .collect();
+        let response = ImportResponse { sheets, errors: &report.errors };
+        Ok::<_, ImportError>(
+            serde_json::to_vec(&response).expect("import results serialize to JSON"),
+        )
+    })
+    .await;
+
+    match imported {
+        Ok(Ok(json)) => json_response(StatusCode::OK, json),
+        Ok(Err(err)) => json_response(StatusCode::BAD_REQUEST, error_json(None, None, &err.to_string())),
+        Err(_) => json_response(
+            StatusCode::INTERNAL_SERVER_ERROR,
+            error_json(None, None, "Errore interno durante l'importazione."),
+        ),
+    }
+}
+
+// POST /api/v1/ledger: a general-ledger or trial-balance CSV export as the
+// request body, aggregated into CEE positions by the chart of accounts
+// mapping. Returns the positions, their KPIs and the unmapped accounts. The
+// body is mapped on the blocking pool while it uploads, so memory stays at a
+// few chunks whatever the size of the ledger.
+pub async fn import_ledger(
+    State(state): State<AppState>,
+    Query(query): Query<BTreeMap<String, String>>,
+    body: Body,
+) -> Response {
+    if state.chart_mapping.is_none() {
+        return json_response(StatusCode::SERVICE_UNAVAILABLE, error_json(None, None, "Piano dei conti non configurato."));
+    }
+    let kpis = default_kpis(&query);
+    if kpis.is_empty() {
+        return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, "Nessun KPI selezionato."));
+    }
+    let name = query.get("name").cloned().unwrap_or_else(|| "upload".to_string());
+
+    let (tx, rx) = mpsc::channel(STREAM_BUFFER_RECORDS);
+    let mapped = tokio::task::spawn_blocking(move || {
+        let mapping = state.chart_mapping.as_ref().expect("mapping checked above");
+        let report = mapping.aggregate(BodyReader { chunks: rx, current: Bytes::new() }, &name)?;
+        let response = LedgerResponse {
+            results: kpi_results(&KpiPlan::compile(&kpis), &kpis, &report.positions),
+            balance_check: validate_balance_sheet(&report.positions),
+            report: &report,
+        };
+        Ok::<_, MappingError>(serde_json::to_vec(&response).expect("ledger report serializes to JSON"))
+    });
+
+    let mut chunks = body.into_data_stream();
+    while let Some(chunk) = chunks.next().await {
+        let chunk = chunk.map_err(io::Error::other);
+        let failed = chunk.is_err();
+        // The mapping stops reading early on a malformed header.
+        if tx.send(chunk).await.is_err() || failed {
+            break;
+        }
+    }
+    drop(tx);
+
+    match mapped.await {
+        Ok(Ok(json)) => json_response(StatusCode::OK, json),
+        Ok(Err(err)) => json_response(StatusCode::BAD_REQUEST, error_json(None, None, &err.to_string())),
+        Err(_) => json_response(
+            StatusCode::INTERNAL_SERVER_ERROR,
+            error_json(None, None, "Errore interno durante la lettura del libro giornale."),
+        ),
+    }
+}
+
+// Blocking reader over the request body chunks forwarded by the handler.
+struct BodyReader {
+    chunks: mpsc::Receiver<io::Result<Bytes>>,
+    current: Bytes,
+}
+
+impl Read for BodyReader {
+    fn read(&mut self, buf: &mut [u8]) -> io::Result<usize> {
+        while self.current.is_empty() {
+            match self.chunks.blocking_recv() {
+                Some(chunk) => self.current = chunk?,
+                None => return Ok(0),
+            }
+        }
+        let n = buf.len().min(self.current.len());
+        buf[..n].copy_from_slice(&self.current[..n]);
+        self.current = self.current.slice(n..);
+        Ok(n)
+    }
+}
+
+// POST /api/v1/peers/filings: newline-delimited filings
+// ({"sector": "C", "size_class": "small", "positions": {...}}, the size class
+// defaulting to the one of the total assets) added to the peer index. The
+// batch is scored and sketched on the blocking pool and merged into the
+// shared index in one step, so rankings never see half of an upload.
+pub async fn add_peer_filings(State(state): State<AppState>, body: Bytes) -> Response {
+    let result = tokio::task::spawn_blocking(move || {
+        let mut filings = Vec::new();
+        let mut errors = Vec::new();
+        for (line, record) in body.split(|byte| *byte == b'\n').enumerate() {
+            if record.trim_ascii().is_empty() {
+                continue;
+            }
+            let line = line + 1;
+            match serde_json::from_slice::<Filing>(record) {
+                Ok(filing) if normalize_sector(&filing.sector).is_none() => {
+                    errors.push(LineError { line, error: "Settore non valido.".to_string() });
+                }
+                Ok(filing) => filings.push(filing),
+                Err(err) => errors.push(LineError { line, error: err.to_string() }),
+            }
+        }
+
+        let mut batch = PeerIndex::new();
+        let added = batch.add_filings(&filings);
+        let mut peers = state.peers.write().unwrap();
+        peers.merge(&batch);
+        let response = PeerIngestResponse { added, filings: peers.filings(), errors };
+        serde_json::to_vec(&response).expect("peer ingest report serializes to JSON")
+    })
+    .await;
+
+    match result {
+        Ok(json) => json_response(StatusCode::OK, json),
+        Err(_) => json_response(
+            StatusCode::INTERNAL_SERVER_ERROR,
+            error_json(None, None, "Errore interno durante l'aggiornamento dei dati di settore."),
+        ),
+    }
+}
+
+// GET /api/v1/peers?sector=C&size_class=small: the KPI distribution of a
+// peer group as quantiles; either parameter may be left out to span all
+// sectors or sizes.
+pub async fn peer_group(State(state): State<AppState>, Query(query): Query<BTreeMap<String, String>>) -> Response {
+    let sector = query.get("sector").and_then(|sector| normalize_sector(sector));
+    let size_class = match query.get("size_class").map(|size| serde_json::from_value(size.as_str().into())) {
+        Some(Ok(size_class)) => Some(size_class),
+        Some(Err(_)) => {
+            let message = "Classe dimensionale non valida (micro, small, medium, large).";
+            return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, message));
+        }
+        None => None,
+    };
+
+    let peers = state.peers.read().unwrap();
+    let Some(group) = peers.group(sector.as_deref(), size_class) else {
+        return json_response(StatusCode::NOT_FOUND, error_json(None, None, "Nessun dato per il settore richiesto."));
+    };
+    let kpis = KPI_DEFINITIONS
+        .iter()
+        .enumerate()
+        .map(|(kpi, definition)| {
+            let sketch = group.sketch(kpi);
+            let quantiles = PEER_QUANTILES
+                .iter()
+                .filter_map(|(name, q)| Some((*name, sketch.quantile(*q)?)))
+                .collect();
+            (definition.key, PeerDistribution { peers: sketch.count(), quantiles })
+        })
+        .collect();
+    let response = PeerGroupResponse { sector: sector.as_deref(), size_class, filings: group.filings(), kpis };
+    json_response(StatusCode::OK, serde_json::to_vec(&response).expect("peer quantiles serialize to JSON"))
+}
+
+// POST /api/v1/archive/filings: newline-delimited filings ({"company": ...,
+// "fiscal_year": 2023, "sector": "C", "positions": {...}}) appended to the
+// archive in one step.
+pub async fn add_archived_filings(State(state): State<AppState>, body: Bytes) -> Response {
+    if state.archive.is_none() {
+        return json_response(StatusCode::SERVICE_UNAVAILABLE, error_json(None, None, "Archivio non configurato."));
+    }
+    let result = tokio::task::spawn_blocking(move || {
+        let mut filings = Vec::new();
+        let mut errors = Vec::new();
+        for (line, record) in body.split(|byte| *byte == b'\n').enumerate() {
+            if record.trim_ascii().is_empty() {
+                continue;
+            }
+            match serde_json::from_slice::<ArchivedFiling>(record) {
+                Ok(filing) => filings.push(filing),
+                Err(err) => errors.push(LineError { line: line + 1, error: err.to_string() }),
+            }
+        }
+
+        let mut archive = state.archive.as_ref().expect("archive checked above").write().unwrap();
+        archive.append(&filings)?;
+        let response = ArchiveIngestResponse { added: filings.len(), rows: archive.rows(), errors };
+        Ok::<_, ColumnStoreError>(serde_json::to_vec(&response).expect("archive ingest report serializes to JSON"))
+    })
+    .await;
+
+    match result {
+        Ok(Ok(json)) => json_response(StatusCode::OK, json),
+        Ok(Err(err)) => json_response(StatusCode::INTERNAL_SERVER_ERROR, error_json(None, None, &err.to_string())),
+        Err(_) => json_response(
+            StatusCode::INTERNAL_SERVER_ERROR,
+            error_json(None, None, "Errore interno durante l'archiviazione."),
+        ),
+    }
+}
+
+// POST /api/v1/screen: {"where": [{"kpi": "current_ratio", "op": "<",
+// "value": 1}, ...], "kpis": [...], "sector": "C", "from_year": 2021,
+// "to_year": 2023, "limit": 100}. The archived filings matching every
+// condition, one NDJSON line each as the scan finds them, then a summary
+// line with the scan statistics. The scan runs on the blocking pool over a
+// snapshot of the archive and pauses while the client is not reading.
+pub async fn screen_archive(State(state): State<AppState>, body: Bytes) -> Response {
+    let query: Screen = match serde_json::from_slice(&body) {
+        Ok(query) => query,
+        Err(err) => return json_response(StatusCode::BAD_REQUEST, error_json(None, None, &err.to_string())),
+    };
+    if query.predicates.is_empty() {
+        return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, "Nessuna condizione indicata."));
+    }
+    if query.limit == Some(0) {
+        return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, "Il limite deve essere almeno 1."));
+    }
+    let mut keys = query.predicates.iter().map(|predicate| &predicate.kpi).chain(&query.kpis);
+    if let Some(key) = keys.find(|key| get_kpi_definition(key).is_none()) {
+        let message = format!("KPI sconosciuto: {key}");
+        return json_response(StatusCode::UNPROCESSABLE_ENTITY, error_json(None, None, &message));
+    }
+    let Some(archive) = &state.archive else {
+        return json_response(StatusCode::SERVICE_UNAVAILABLE, error_json(None, None, "Archivio non configurato."));
+    };
+    let archive = archive.read().unwrap().clone();
+
+    let (tx, rx) = mpsc::channel(STREAM_BUFFER_RECORDS);
+    tokio::task::spawn_blocking(move || {
+        let result = screen(&archive, &query, |found| {
+            let json = serde_json::to_vec(&found).expect("screening match serializes to JSON");
+            // False once the client went away, which stops the scan.
+            tx.blocking_send(Ok(ndjson_line(json))).is_ok()
+        });
+        let last = match result {
+            Ok(summary) => serde_json::to_vec(&ScreenSummary { summary }).expect("screening summary serializes to JSON"),
+            Err(err) => error_json(None, None, &err.to_string()),
+        };
+        let _ = tx.blocking_send(Ok(ndjson_line(last)));
+    });
+
+    (
+        [(header::CONTENT_TYPE, NDJSON)],
+        Body::from_stream(ReceiverStream::new(rx)),
+    )
+        .into_response()
+}
+
+async fn stream_records(
+    state: AppState,
+    body: Body,
+    default_kpis: Vec<String>,
+    tx: mpsc::Sender<Result<Bytes, Infallible>>,
+) {
+    let mut chunks = body.into_data_stream();
+    let mut plans = PlanCache::default();
+    let mut record = Vec::new();
+    let mut oversized = false;
+    let mut line = 0;
+
+    while let Some(chunk) = chunks.next().await {
+        let chunk = match chunk {
+            Ok(chunk) => chunk,
+            Err(err) => {
+                let message = format!("Errore di lettura del flusso: {err}");
+                let _ = tx.send(Ok(ndjson_line(error_json(None, Some(line + 1), &message)))).await;
+                return;
+            }
+        };
+        for piece in chunk.split_inclusive(|byte| *byte == b'\n') {
+            if record.len() + piece.len() > MAX_RECORD_BYTES {
+                oversized = true;
+            } else if !oversized {
+                record.extend_from_slice(piece);
+            }
+            if piece.last() == Some(&b'\n') {
+                line += 1;
+                let output = process_record(&record, oversized, line, &default_kpis, &mut plans, &state.peers);
+                record.clear();
+                oversized = false;
+                if let Some(output) = output {
+                    if tx.send(Ok(output)).await.is_err() {
+                        // Client went away.
+                        return;
+                    }
+                }
+            }
+        }
+    }
+
+    if !record.is_empty() || oversized {
+        if let Some(output) = process_record(&record, oversized, line + 1, &default_kpis, &mut plans, &state.peers) {
+            let _ = tx.send(Ok(output)).await;
+        }
+    }
+}
+
+fn process_record(
+    record: &[u8],
+    oversized: bool,
+    line: u64,
+    default_kpis: &[String],
+    plans: &mut PlanCache,
+    peers: &RwLock<PeerIndex>,
+) -> Option<Bytes> {
+    if oversized {
+        let message = format!("Record troppo lungo (massimo {MAX_RECORD_BYTES} byte).");
+        return Some(ndjson_line(error_json(None, Some(line), &message)));
+    }
+    if record.trim_ascii().is_empty() {
+        return None;
+    }
+    let json = match serde_json::from_slice::<SheetRequest>(record) {
+        Ok(request) => evaluate(&request, default_kpis, plans, Some(line), peers).unwrap_or_else(|err| err),
+        Err(err) => error_json(None, Some(line), &err.to_string()),
+    };
+    Some(ndjson_line(json))
+}
+
+// Consecutive records usually select the same KPIs: keep the last compiled plan.
+#[derive(Default)]
+struct PlanCache {
+    keys: Vec<String>,
+    plan: KpiPlan,
+}
+
+impl PlanCache {
+    fn plan_for(&mut self, keys: &[String]) -> &KpiPlan {
+        if self.keys != keys {
+            self.keys = keys.to_vec();
+            self.plan = KpiPlan::compile(keys);
+        }
+        &self.plan
+    }
+}
+
+fn evaluate(
+    request: &SheetRequest,
+    default_kpis: &[String],
+    plans: &mut PlanCache,
+    line: Option<u64>,
+    peers: &RwLock<PeerIndex>,
+) -> Result<Vec<u8>, Vec<u8>> {
+    let id = request.id.as_deref();
+    let kpis = request.kpis.as_deref().unwrap_or(default_kpis);
+    if kpis.is_empty() {
+        return Err(error_json(id, line, "Nessun KPI selezionato."));
+    }
+
+    let mut results = kpi_results(plans.plan_for(kpis), kpis, &request.positions);
+    if let Some(sector) = &request.sector {
+        let Some(sector) = normalize_sector(sector) else {
+            return Err(error_json(id, line, "Settore non valido."));
+        };
+        let size_class = request.size_class.unwrap_or_else(|| SizeClass::of(&request.positions));
+        let peers = peers.read().unwrap();
+        for (key, result) in &mut results {
+            let kpi = KPI_DEFINITIONS.iter().position(|definition| definition.key == *key);
+            result.peers = kpi.zip(result.value).and_then(|(kpi, value)| peers.rank(&sector, size_class, kpi, value));
+        }
+    }
+    let response = SheetResponse {
+        id,
+        line,
+        results,
+        balance_check: validate_balance_sheet(&request.positions),
+    };
+    Ok(serde_json::to_vec(&response).expect("KPI results serialize to JSON"))
+}
+
+fn kpi_results<'k>(plan: &KpiPlan, kpis: &'k [String], sheet: &BalanceSheet) -> BTreeMap<&'k str, KpiResultBody> {
+    plan.evaluate(sheet)
+        .into_iter()
+        .zip(kpis)
+        .map(|(result, key)| (key.as_str(), KpiResultBody::from(&result)))
+        .collect()
+}
+
+// `?kpis=a,b` on the URL, otherwise every defined KPI.
+pub(crate) fn default_kpis(query: &BTreeMap<String, String>) -> Vec<String> {
+    match query.get("kpis") {
+        Some(kpis) => kpis.split(',').map(str::trim).filter(|k| !k.is_empty()).map(str::to_string).collect(),
+        None => KPI_DEFINITIONS.iter().map(|definition| definition.key.to_string()).collect(),
+    }
+}
+
+fn error_json(id: Option<&str>, line: Option<u64>, error: &str) -> Vec<u8> {
+    serde_json::to_vec(&ErrorResponse { id, line, error }).expect("error message serializes to JSON")
+}
+
+fn ndjson_line(mut json: Vec<u8>) -> Bytes {
+    json.push(b'\n');
+    Bytes::from(json)
+}
+
+fn json_response(status: StatusCode, json: Vec<u8>) -> Response {
+    (status, [(header::CONTENT_TYPE, "application/json")], json).into_response()
+}
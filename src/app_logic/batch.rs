@@ -0,0 +1,226 @@
+use std::collections::BTreeMap;
+use thiserror::Error;
+
+use crate::app_logic::calculator::{KpiResult, KpiStatus};
+use crate::app_logic::kpi_plan::KpiPlan;
+use crate::app_logic::positions::{BalanceSheet, PositionId, POSITION_COUNT};
+
+#[derive(Debug, Error, PartialEq)]
+pub enum BatchError {
+    #[error("expected {expected} values ({rows} rows x {POSITION_COUNT} positions), got {actual}")]
+    ShapeMismatch { rows: usize, expected: usize, actual: usize },
+}
+
+// Where the batch engine reads position columns from: an in-memory
+// `PositionMatrix` or the mapped columns of an archive.
+pub trait PositionColumns {
+    fn rows(&self) -> usize;
+    // The `rows` values of one position.
+    fn column(&self, id: PositionId) -> &[f64];
+}
+
+// N companies x positions, column-major: each position is one contiguous
+// column of `rows` values, so group sums run over contiguous memory.
+#[derive(Debug, Clone, PartialEq)]
+pub struct PositionMatrix {
+    rows: usize,
+    data: Vec<f64>,
+}
+
+impl PositionMatrix {
+    pub fn zeros(rows: usize) -> Self {
+        PositionMatrix { rows, data: vec![0.0; rows * POSITION_COUNT] }
+    }
+
+    pub fn from_column_major(rows: usize, data: Vec<f64>) -> Result<Self, BatchError> {
+        let expected = rows * POSITION_COUNT;
+        if data.len() != expected {
+            return Err(BatchError::ShapeMismatch { rows, expected, actual: data.len() });
+        }
+        Ok(PositionMatrix { rows, data })
+    }
+
+    pub fn from_sheets<'a, I>(sheets: I) -> Self
+    where
+        I: IntoIterator<Item = &'a BalanceSheet>,
+        I::IntoIter: ExactSizeIterator,
+    {
+        let sheets = sheets.into_iter();
+        let mut matrix = PositionMatrix::zeros(sheets.len());
+        for (row, sheet) in sheets.enumerate() {
+            for (id, value) in sheet.values().iter().enumerate() {
+                matrix.data[id * matrix.rows + row] = *value;
+            }
+        }
+        matrix
+    }
+
+    pub fn rows(&self) -> usize {
+        self.rows
+    }
+
+    pub fn column(&self, id: PositionId) -> &[f64] {
+        &self.data[id * self.rows..(id + 1) * self.rows]
+    }
+
+    pub fn column_mut(&mut self, id: PositionId) -> &mut [f64] {
+        &mut self.data[id * self.rows..(id + 1) * self.rows]
+    }
+
+    pub fn as_slice(&self) -> &[f64] {
+        &self.data
+    }
+}
+
+impl PositionColumns for PositionMatrix {
+    fn rows(&self) -> usize {
+        self.rows
+    }
+
+    fn column(&self, id: PositionId) -> &[f64] {
+        PositionMatrix::column(self, id)
+    }
+}
+
+// Dense rows x KPIs result, column-major like the input. Division by zero
+// leaves NaN in `values` and the reason in the matching `status` cell.
+#[derive(Debug, Clone)]
+pub struct BatchResult {
+    pub rows: usize,
+    pub kpi_keys: Vec<String>,
+    pub values: Vec<f64>,
+    pub status: Vec<KpiStatus>,
+}
+
+impl BatchResult {
+    pub fn values_column(&self, kpi: usize) -> &[f64] {
+        &self.values[kpi * self.rows..(kpi + 1) * self.rows]
+    }
+
+    pub fn status_column(&self, kpi: usize) -> &[KpiStatus] {
+        &self.status[kpi * self.rows..(kpi + 1) * self.rows]
+    }
+
+    // Same shape as the single-sheet `calculate_selected_kpis` result.
+    pub fn row_results(&self, row: usize) -> BTreeMap<String, KpiResult> {
+        self.kpi_keys
+            .iter()
+            .enumerate()
+            .map(|(kpi, key)| {
+                let cell = kpi * self.rows + row;
+                let result = match self.status[cell] {
+                    KpiStatus::Ok => KpiResult::ok(self.values[cell]),
+                    status => KpiResult::failed(status),
+                };
+                (key.clone(), result)
+            })
+            .collect()
+    }
+}
+
+pub fn calculate_kpis_batch<M: PositionColumns + ?Sized>(matrix: &M, kpi_keys: &[String]) -> BatchResult {
+    let rows = matrix.rows();
+    let plan = KpiPlan::compile(kpi_keys);
+
+    // Each group node is summed once over the batch, column by column.
+    let group_columns: Vec<Vec<f64>> = plan
+        .groups()
+        .iter()
+        .map(|group| {
+            let mut total = vec![0.0; rows];
+            for &id in group.positions() {
+                for (acc, value) in total.iter_mut().zip(matrix.column(id)) {
+                    *acc += value;
+                }
+            }
+            total
+        })
+        .collect();
+
+    let expression_columns: Vec<Vec<f64>> = plan
+        .expressions()
+        .iter()
+        .map(|expression| {
+            let mut total = vec![0.0; rows];
+            for &(coefficient, slot) in expression {
+                for (acc, value) in total.iter_mut().zip(&group_columns[slot]) {
+                    *acc += coefficient * value;
+                }
+            }
+            total
+        })
+        .collect();
+
+    let mut values = Vec::with_capacity(rows * kpi_keys.len());
+    let mut status = Vec::with_capacity(rows * kpi_keys.len());
+    for kpi in plan.kpis() {
+        if kpi.definition.is_none() {
+            values.resize(values.len() + rows, f64::NAN);
+            status.resize(status.len() + rows, KpiStatus::UndefinedKpi);
+            continue;
+        }
+        let numerator = &expression_columns[kpi.numerator];
+        match kpi.denominator {
+            None => {
+                values.extend_from_slice(numerator);
+                status.resize(status.len() + rows, KpiStatus::Ok);
+            }
+            Some(slot) => {
+                let zero_status = kpi.zero_status();
+                for (n, d) in numerator.iter().zip(&expression_columns[slot]) {
+                    if *d != 0.0 {
+                        values.push(n / d);
+                        status.push(KpiStatus::Ok);
+                    } else {
+                        values.push(f64::NAN);
+                        status.push(zero_status);
+                    }
+                }
+            }
+        }
+    }
+
+    BatchResult { rows, kpi_keys: kpi_keys.to_vec(), values, status }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::calculator::calculate_selected_kpis;
+    use crate::app_logic::kpi_config::get_available_kpis;
+    use crate::app_logic::positions::pos;
+
+    #[test]
+    fn batch_matches_single_sheet_results() {
+        let mut sheets = vec![BalanceSheet::new(); 3];
+        for (row, sheet) in sheets.iter_mut().enumerate() {
+            for p in 1..=100 {
+                sheet.set(pos(p), ((p * 7 + row * 13) % 23) as f64 * 100.0);
+            }
+        }
+        // Third company: no equity, no current liabilities.
+        for p in [52, 53, 54, 55, 56, 57, 58, 59, 64, 65, 66, 79, 80, 81, 82, 83, 84, 85, 86, 87, 88] {
+            sheets[2].set(pos(p), 0.0);
+        }
+        let kpi_keys: Vec<String> = get_available_kpis().into_keys().collect();
+
+        let batch = calculate_kpis_batch(&PositionMatrix::from_sheets(&sheets), &kpi_keys);
+
+        for (row, sheet) in sheets.iter().enumerate() {
+            let single = calculate_selected_kpis(sheet, &kpi_keys);
+            let batched = batch.row_results(row);
+            for key in &kpi_keys {
+                assert_eq!(single[key].status, batched[key].status, "{key} row {row}");
+                assert_eq!(single[key].value, batched[key].value, "{key} row {row}");
+            }
+        }
+        let current_ratio = kpi_keys.iter().position(|k| k == "current_ratio").unwrap();
+        assert!(batch.values_column(current_ratio)[2].is_nan());
+    }
+
+    #[test]
+    fn rejects_matrix_of_wrong_shape() {
+        let err = PositionMatrix::from_column_major(2, vec![0.0; 3]).unwrap_err();
+        assert_eq!(err, BatchError::ShapeMismatch { rows: 2, expected: 2 * POSITION_COUNT, actual: 3 });
+    }
+}
@@ -1,458 +1,202 @@
 use std::collections::BTreeMap;
 use serde::{Serialize, Deserialize};
 
-pub fn calculate_selected_kpis(
-    data: &BTreeMap<String, f64>,
+use crate::app_logic::kpi_plan::KpiPlan;
+use crate::app_logic::positions::{pos, pos_nca, span, BalanceSheetData, PositionId};
+
+// Both sides of the balance sheet, as used by the balance check.
+pub const ASSET_SIDE: [PositionId; 58] = {
+    let mut ids = [0; 58];
+    let cee: [PositionId; 51] = span(1);
+    let mut i = 0;
+    while i < 51 {
+        ids[i] = cee[i];
+        i += 1;
+    }
+    while i < 58 {
+        ids[i] = pos_nca(39 + i - 51);
+        i += 1;
+    }
+    ids
+};
+pub const LIABILITIES_EQUITY_SIDE: [PositionId; 38] = {
+    let mut ids = [0; 38];
+    let cee: [PositionId; 37] = span(52);
+    let mut i = 0;
+    while i < 37 {
+        ids[i] = cee[i];
+        i += 1;
+    }
+    ids[37] = pos(100);
+    ids
+};
+
+// Largest difference between the two sides still considered balanced (one cent).
+const BALANCE_TOLERANCE: f64 = 0.01;
+
+pub fn calculate_selected_kpis<D: BalanceSheetData + ?Sized>(
+    data: &D,
     selected_kpi_keys: &[String],
 ) -> BTreeMap<String, KpiResult> {
-    let mut results = BTreeMap::new();
+    let sheet = data.as_balance_sheet();
+    let plan = KpiPlan::compile(selected_kpi_keys);
 
-    for kpi_key in selected_kpi_keys {
-        let result = match kpi_key.as_str() {
-            "current_ratio" => calculate_current_ratio(data),
-            "quick_ratio" => calculate_quick_ratio(data),
-            "cash_ratio" => calculate_cash_ratio(data),
-            "debt_to_equity" => calculate_debt_to_equity(data),
-            "debt_ratio" => calculate_debt_ratio(data),
-            "working_capital" => calculate_working_capital(data),
-            "asset_rigidity_index" => calculate_asset_rigidity_index(data),
-            "asset_elasticity_index" => calculate_asset_elasticity_index(data),
-            "fixed_asset_coverage_ratio" => calculate_fixed_asset_coverage_ratio(data),
-            "tax_social_debt_on_assets_ratio" => calculate_tax_social_debt_on_assets_ratio(data),
-            "tangible_net_worth" => calculate_tangible_net_worth(data),
-            "equity_multiplier" => calculate_equity_multiplier(data),
-            "long_term_debt_to_equity" => calculate_long_term_debt_to_equity(data),
-            "intangible_assets_ratio" => calculate_intangible_assets_ratio(data),
-            "financial_assets_ratio" => calculate_financial_assets_ratio(data),
-            "non_current_assets_coverage" => calculate_non_current_assets_coverage(data),
-            "net_working_capital_ratio" => calculate_net_working_capital_ratio(data),
-            "debt_to_equity_excl_tfr" => calculate_debt_to_equity_excl_tfr(data),
-            "debt_ratio_excl_tfr" => calculate_debt_ratio_excl_tfr(data),
-            _ => KpiResult {
-                value: None,
-                status: "error".to_string(),
-                message: "KPI non definito.".to_string(),
-                details: None,
-            },
-        };
-        results.insert(kpi_key.clone(), result);
-    }
-
-    results
+    selected_kpi_keys
+        .iter()
+        .cloned()
+        .zip(plan.evaluate(&sheet))
+        .collect()
 }
 
-fn get_sum(data: &BTreeMap<String, f64>, positions: &[&str]) -> f64 {
-    positions.iter().map(|p| *data.get(*p).unwrap_or(&0.0)).sum()
+// Checks that total assets match total liabilities and equity.
+pub fn validate_balance_sheet<D: BalanceSheetData + ?Sized>(data: &D) -> BalanceCheck {
+    let sheet = data.as_balance_sheet();
+    BalanceCheck::from_totals(sheet.sum(&ASSET_SIDE), sheet.sum(&LIABILITIES_EQUITY_SIDE))
 }
 
-fn calculate_current_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let current_assets = get_sum(data, &["31", "32", "33", "34", "35", "39", "40", "41", "42", "43", "44", "45", "46", "47", "48", "49", "50"]);
-    let current_liabilities = get_sum(data, &["79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
-
-    if current_liabilities != 0.0 {
-        KpiResult {
-            value: Some(current_assets / current_liabilities),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Passività Correnti nulle).".to_string(),
-            details: None,
-        }
-    }
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Serialize, Deserialize)]
+#[serde(rename_all = "snake_case")]
+pub enum KpiStatus {
+    Ok,
+    ZeroCurrentLiabilities,
+    ZeroEquity,
+    ZeroTotalAssets,
+    ZeroNonCurrentAssets,
+    UndefinedKpi,
 }
 
-fn calculate_quick_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let liquid_assets = get_sum(data, &["39", "40", "41", "42", "43", "45"]);
-    let current_liabilities = get_sum(data, &["79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
-
-    if current_liabilities != 0.0 {
-        KpiResult {
-            value: Some(liquid_assets / current_liabilities),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Passività Correnti nulle).".to_string(),
-            details: None,
-        }
+impl KpiStatus {
+    pub fn is_ok(self) -> bool {
+        self == KpiStatus::Ok
     }
-}
-
-fn calculate_cash_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let cash = get_sum(data, &["49", "50"]);
-    let current_liabilities = get_sum(data, &["79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
 
-    if current_liabilities != 0.0 {
-        KpiResult {
-            value: Some(cash / current_liabilities),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Passività Correnti nulle).".to_string(),
-            details: None,
-        }
+    pub fn as_str(self) -> &'static str {
+        if self.is_ok() { "ok" } else { "error" }
     }
-}
 
-fn calculate_debt_to_equity(data: &BTreeMap<String, f64>) -> KpiResult {
-    let total_liabilities = get_sum(data, &["67", "68", "69", "100", "70", "71", "72", "73", "74", "75", "76", "77", "78", "79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
-    let total_equity = get_sum(data, &["52", "53", "54", "55", "56", "57", "58", "59", "64", "65", "66"]);
-
-    if total_equity != 0.0 {
-        KpiResult {
-            value: Some(total_liabilities / total_equity),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Patrimonio Netto nullo).".to_string(),
-            details: None,
+    pub fn message(self) -> &'static str {
+        match self {
+            KpiStatus::Ok => "",
+            KpiStatus::ZeroCurrentLiabilities => "Divisione per zero (Passività Correnti nulle).",
+            KpiStatus::ZeroEquity => "Divisione per zero (Patrimonio Netto nullo).",
+            KpiStatus::ZeroTotalAssets => "Divisione per zero (Totale Attivo nullo).",
+            KpiStatus::ZeroNonCurrentAssets => "Divisione per zero (Attività non correnti nulle).",
+            KpiStatus::UndefinedKpi => "KPI non definito.",
         }
     }
 }
 
-fn calculate_debt_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let total_liabilities = get_sum(data, &["67", "68", "69", "100", "70", "71", "72", "73", "74", "75", "76", "77", "78", "79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
-    let total_assets = get_total_assets(data);
-
-    if total_assets != 0.0 {
-        KpiResult {
-            value: Some(total_liabilities / total_assets),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Totale Attivo nullo).".to_string(),
-            details: None,
-        }
-    }
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct KpiResult {
+    pub value: Option<f64>,
+    pub status: KpiStatus,
+    pub details: Option<String>,
 }
 
-fn calculate_working_capital(data: &BTreeMap<String, f64>) -> KpiResult {
-    let current_assets = get_sum(data, &["31", "32", "33", "34", "35", "39", "40", "41", "42", "43", "44", "45", "46", "47", "48", "49", "50"]);
-    let current_liabilities = get_sum(data, &["79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
+impl KpiResult {
+    pub fn ok(value: f64) -> Self {
+        KpiResult { value: Some(value), status: KpiStatus::Ok, details: None }
+    }
 
-    KpiResult {
-        value: Some(current_assets - current_liabilities),
-        status: "ok".to_string(),
-        message: "".to_string(),
-        details: None,
+    pub fn failed(status: KpiStatus) -> Self {
+        KpiResult { value: None, status, details: None }
     }
-}
 
-// Asset Rigidity Index: Non-current assets / Total assets
-fn calculate_asset_rigidity_index(data: &BTreeMap<String, f64>) -> KpiResult {
-    let total_assets = get_total_assets(data);
-    
-    if total_assets != 0.0 {
-        let non_current_value = get_sum(data, &["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15", "16", "17", "18", "19", "20", "21", "22", "23", "24", "25", "26", "27", "28", "29", "30"]);
-        KpiResult {
-            value: Some(non_current_value / total_assets),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Totale Attivo nullo).".to_string(),
-            details: None,
-        }
+    pub fn message(&self) -> &'static str {
+        self.status.message()
     }
 }
 
-// Asset Elasticity Index: Current assets / Total assets
-fn calculate_asset_elasticity_index(data: &BTreeMap<String, f64>) -> KpiResult {
-    let total_assets = get_total_assets(data);
-    
-    if total_assets != 0.0 {
-        let current_value = get_sum(data, &["31", "32", "33", "34", "35", "39", "40", "41", "42", "43", "44", "45", "46", "47", "48", "49", "50"]);
-        KpiResult {
-            value: Some(current_value / total_assets),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Totale Attivo nullo).".to_string(),
-            details: None,
-        }
-    }
+#[derive(Debug, Clone, Copy, PartialEq, Serialize, Deserialize)]
+pub struct BalanceCheck {
+    pub valid: bool,
+    pub assets: f64,
+    pub liabilities_equity: f64,
 }
 
-// Fixed Asset Coverage Ratio: Equity / Non-current assets
-fn calculate_fixed_asset_coverage_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let equity = get_sum(data, &["52", "53", "54", "55", "56", "57", "58", "59", "64", "65", "66"]);
-    
-    if equity != 0.0 {
-        let non_current_value = get_sum(data, &["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15", "16", "17", "18", "19", "20", "21", "22", "23", "24", "25", "26", "27", "28", "29", "30"]);
-        KpiResult {
-            value: Some(equity / non_current_value),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Patrimonio Netto nullo).".to_string(),
-            details: None,
+impl BalanceCheck {
+    pub fn from_totals(assets: f64, liabilities_equity: f64) -> Self {
+        BalanceCheck {
+            valid: (assets - liabilities_equity).abs() < BALANCE_TOLERANCE,
+            assets,
+            liabilities_equity,
         }
     }
 }
 
-// Tax/Social Debt on Assets Ratio: (TFR + Social Security) / Total Assets
-fn calculate_tax_social_debt_on_assets_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let tfr_and_social = get_sum(data, &["100", "86"]);
-    let total_assets = get_total_assets(data);
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::positions::BalanceSheet;
 
-    if total_assets != 0.0 {
-        KpiResult {
-            value: Some(tfr_and_social / total_assets),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Totale Attivo nullo).".to_string(),
-            details: None,
-        }
+    fn zeroed_data() -> BTreeMap<String, f64> {
+        (1..101).map(|i| (i.to_string(), 0.0)).collect()
     }
-}
 
-// Tangible Net Worth: Equity - Intangible Assets
-fn calculate_tangible_net_worth(data: &BTreeMap<String, f64>) -> KpiResult {
-    let equity = get_sum(data, &["52", "53", "54", "55", "56", "57", "58", "59", "64", "65", "66"]);
-    let intangible_value = get_sum(data, &["1", "2", "3", "4", "5", "6", "7", "8", "9", "10"]);
-    
-    KpiResult {
-        value: Some(equity - intangible_value),
-        status: "ok".to_string(),
-        message: "".to_string(),
-        details: None,
+    fn keys(kpis: &[&str]) -> Vec<String> {
+        kpis.iter().map(|k| k.to_string()).collect()
     }
-}
 
-// Equity Multiplier: Total Assets / Equity
-fn calculate_equity_multiplier(data: &BTreeMap<String, f64>) -> KpiResult {
-    let total_assets = get_total_assets(data);
-    let equity = get_sum(data, &["52", "53", "54", "55", "56", "57", "58", "59", "64", "65", "66"]);
+    #[test]
+    fn current_ratio_matches_on_legacy_and_compact_data() {
+        let mut data = zeroed_data();
+        for p in ["31", "32", "33", "34", "35"] { data.insert(p.to_string(), 10.0); }
+        for p in ["79", "80", "81", "82"] { data.insert(p.to_string(), 5.0); }
 
-    if equity != 0.0 {
-        KpiResult {
-            value: Some(total_assets / equity),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Patrimonio Netto nullo).".to_string(),
-            details: None,
-        }
-    }
-}
-
-// Long-term Debt to Equity: Long-term debt / Equity
-fn calculate_long_term_debt_to_equity(data: &BTreeMap<String, f64>) -> KpiResult {
-    let long_term_debt = get_sum(data, &["70", "71", "72", "73", "74", "75", "76", "77", "78"]);
-    let equity = get_sum(data, &["52", "53", "54", "55", "56", "57", "58", "59", "64", "65", "66"]);
+        let legacy = calculate_selected_kpis(&data, &keys(&["current_ratio"]));
+        let compact = calculate_selected_kpis(&BalanceSheet::from_map(&data), &keys(&["current_ratio"]));
 
-    if equity != 0.0 {
-        KpiResult {
-            value: Some(long_term_debt / equity),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Patrimonio Netto nullo).".to_string(),
-            details: None,
-        }
+        assert_eq!(legacy["current_ratio"].value, Some(50.0 / 20.0));
+        assert_eq!(compact["current_ratio"].value, legacy["current_ratio"].value);
     }
-}
 
-// Intangible Assets Ratio: Intangible Assets / Total Assets
-fn calculate_intangible_assets_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let intangible_value = get_sum(data, &["1", "2", "3", "4", "5", "6", "7", "8", "9", "10"]);
-    let total_assets = get_total_assets(data);
-    
-    if total_assets != 0.0 {
-        KpiResult {
-            value: Some(intangible_value / total_assets),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Totale Attivo nullo).".to_string(),
-            details: None,
-        }
-    }
-}
+    #[test]
+    fn zero_denominator_yields_no_value() {
+        let mut data = zeroed_data();
+        data.insert("31".to_string(), 50.0);
 
-// Financial Assets Ratio: Current financial assets / Total Assets
-fn calculate_financial_assets_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let financial = get_sum(data, &["46", "47", "48"]);
-    let total_assets = get_total_assets(data);
+        let results = calculate_selected_kpis(&data, &keys(&["current_ratio", "asset_rigidity_index"]));
 
-    if total_assets != 0.0 {
-        KpiResult {
-            value: Some(financial / total_assets),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Totale Attivo nullo).".to_string(),
-            details: None,
-        }
+        assert_eq!(results["current_ratio"].value, None);
+        assert_eq!(results["current_ratio"].status, KpiStatus::ZeroCurrentLiabilities);
+        assert_eq!(results["asset_rigidity_index"].value, Some(0.0));
     }
-}
 
-// Non-current Assets Coverage: Equity / Non-current assets (including long-term debt)
-fn calculate_non_current_assets_coverage(data: &BTreeMap<String, f64>) -> KpiResult {
-    let non_current_value = get_sum(data, &["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15", "16", "17", "18", "19", "20", "21", "22", "23", "24", "25", "26", "27", "28", "29", "30"]);
-    let equity = get_sum(data, &["52", "53", "54", "55", "56", "57", "58", "59", "64", "65", "66"]);
-    
-    if non_current_value != 0.0 {
-        KpiResult {
-            value: Some(equity / non_current_value),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Attività non correnti nulle).".to_string(),
-            details: None,
-        }
-    }
-}
+    #[test]
+    fn coverage_ratios_use_the_documented_formulas() {
+        let mut data = zeroed_data();
+        data.insert("52".to_string(), 2000.0);
+        data.insert("70".to_string(), 1000.0);
 
-// Net Working Capital Ratio: Working Capital / Total Assets
-fn calculate_net_working_capital_ratio(data: &BTreeMap<String, f64>) -> KpiResult {
-    let current_assets = get_sum(data, &["31", "32", "33", "34", "35", "39", "40", "41", "42", "43", "44", "45", "46", "47", "48", "49", "50"]);
-    let current_liabilities = get_sum(data, &["79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
-    let working_capital = current_assets - current_liabilities;
-    let total_assets = get_total_assets(data);
+        let results = calculate_selected_kpis(&data, &keys(&["fixed_asset_coverage_ratio", "non_current_assets_coverage"]));
+        assert_eq!(results["fixed_asset_coverage_ratio"].value, None);
+        assert_eq!(results["non_current_assets_coverage"].value, None);
 
-    if total_assets != 0.0 {
-        KpiResult {
-            value: Some(working_capital / total_assets),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Totale Attivo nullo).".to_string(),
-            details: None,
-        }
+        data.insert("11".to_string(), 1500.0);
+        let results = calculate_selected_kpis(&data, &keys(&["fixed_asset_coverage_ratio", "non_current_assets_coverage"]));
+        assert_eq!(results["fixed_asset_coverage_ratio"].value, Some(2000.0 / 1500.0));
+        assert_eq!(results["non_current_assets_coverage"].value, Some(2.0));
     }
-}
-
-// Debt to Equity Excluding TFR: (Total Liabilities - TFR) / Equity
-fn calculate_debt_to_equity_excl_tfr(data: &BTreeMap<String, f64>) -> KpiResult {
-    let total_liabilities = get_sum(data, &["67", "68", "69", "100", "70", "71", "72", "73", "74", "75", "76", "77", "78", "79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
-    let tfr = get_sum(data, &["100"]);
-    let equity = get_sum(data, &["52", "53", "54", "55", "56", "57", "58", "59", "64", "65", "66"]);
 
-    if equity != 0.0 {
-        KpiResult {
-            value: Some((total_liabilities - tfr) / equity),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Patrimonio Netto nullo).".to_string(),
-            details: None,
-        }
+    #[test]
+    fn unknown_kpi_is_reported() {
+        let results = calculate_selected_kpis(&BalanceSheet::new(), &keys(&["not_a_kpi"]));
+        assert_eq!(results["not_a_kpi"].status.as_str(), "error");
+        assert_eq!(results["not_a_kpi"].message(), "KPI non definito.");
     }
-}
 
-// Debt Ratio Excluding TFR: (Total Liabilities - TFR) / Total Assets
-fn calculate_debt_ratio_excl_tfr(data: &BTreeMap<String, f64>) -> KpiResult {
-    let total_liabilities = get_sum(data, &["67", "68", "69", "100", "70", "71", "72", "73", "74", "75", "76", "77", "78", "79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
-    let tfr = get_sum(data, &["100"]);
-    let total_assets = get_total_assets(data);
+    #[test]
+    fn balance_check_compares_both_sides() {
+        let mut data = zeroed_data();
+        data.insert("1".to_string(), 1000.0);
+        data.insert("52".to_string(), 600.0);
+        data.insert("67".to_string(), 400.0);
+        assert!(validate_balance_sheet(&data).valid);
 
-    if total_assets != 0.0 {
-        KpiResult {
-            value: Some((total_liabilities - tfr) / total_assets),
-            status: "ok".to_string(),
-            message: "".to_string(),
-            details: None,
-        }
-    } else {
-        KpiResult {
-            value: None,
-            status: "error".to_string(),
-            message: "Divisione per zero (Totale Attivo nullo).".to_string(),
-            details: None,
-        }
+        data.insert("52".to_string(), 500.0);
+        let check = validate_balance_sheet(&data);
+        assert!(!check.valid);
+        assert_eq!(check.assets, 1000.0);
+        assert_eq!(check.liabilities_equity, 900.0);
     }
 }
-
-fn get_total_assets(data: &BTreeMap<String, f64>) -> f64 {
-    let asset_positions: Vec<String> = (1..51).map(|x| x.to_string()).filter(|s| s != "51").collect();
-    let asset_refs: Vec<&str> = asset_positions.iter().map(|s| s.as_str()).collect();
-    get_sum(data, &asset_refs)
-}
-
-#[derive(Debug, Clone, Serialize, Deserialize)]
-pub struct KpiResult {
-    pub value: Option<f64>,
-    pub status: String,
-    pub message: String,
-    pub details: Option<String>,
-}
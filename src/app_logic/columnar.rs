@@ -0,0 +1,602 @@
+use std::collections::HashMap;
+use std::fs::{self, File, OpenOptions};
+use std::io::{self, BufRead, BufWriter, Read, Seek, SeekFrom, Write};
+use std::marker::PhantomData;
+use std::mem::size_of;
+use std::path::{Path, PathBuf};
+use std::sync::Arc;
+
+use memmap2::{Mmap, MmapOptions};
+use serde::{Deserialize, Serialize};
+use thiserror::Error;
+
+use crate::app_logic::batch::{calculate_kpis_batch, BatchResult, PositionColumns};
+use crate::app_logic::kpi_plan::KpiPlan;
+use crate::app_logic::positions::{position_key, BalanceSheet, PositionId, PositionSet, POSITION_COUNT};
+
+const MANIFEST: &str = "manifest.json";
+const FORMAT_VERSION: u32 = 1;
+// Rows per block of the zone maps.
+pub const BLOCK_ROWS: usize = 4096;
+const FISCAL_YEAR_COLUMN: &str = "fiscal_year.i32";
+const FISCAL_YEAR_ZONES: &str = "fiscal_year.zone";
+const COMPANY_COLUMN: &str = "company.u32";
+const COMPANY_DICTIONARY: &str = "company.dict";
+const SECTOR_COLUMN: &str = "sector.u32";
+const SECTOR_DICTIONARY: &str = "sector.dict";
+
+#[derive(Debug, Error)]
+pub enum ColumnStoreError {
+    #[error("column store I/O error: {0}")]
+    Io(#[from] io::Error),
+    #[error("invalid column store metadata: {0}")]
+    Json(#[from] serde_json::Error),
+    #[error("unsupported column store version {0}")]
+    Version(u32),
+    #[error("{file} is shorter than the manifest says")]
+    Truncated { file: String },
+    #[error("column stores are little-endian and cannot be mapped on this platform")]
+    BigEndian,
+}
+
+// One archived filing: a company's balance sheet for one fiscal year.
+#[derive(Debug, Clone, PartialEq, Deserialize)]
+pub struct ArchivedFiling {
+    pub company: String,
+    pub fiscal_year: i32,
+    #[serde(default)]
+    pub sector: String,
+    pub positions: BalanceSheet,
+}
+
+// What has been committed. Files may hold more (an append cut short by a
+// crash); readers ignore it and the next append cuts it off.
+#[derive(Debug, Clone, Default, Serialize, Deserialize)]
+struct Manifest {
+    version: u32,
+    rows: usize,
+    company_dictionary_bytes: u64,
+    sector_dictionary_bytes: u64,
+}
+
+fn position_column(id: PositionId) -> String {
+    format!("pos_{}.f64", position_key(id))
+}
+
+fn position_zones(id: PositionId) -> String {
+    format!("pos_{}.zone", position_key(id))
+}
+
+// Smallest and largest value of one block of a column.
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub struct Zone {
+    pub min: f64,
+    pub max: f64,
+}
+
+impl Zone {
+    // For a block whose zone was lost: could hold anything.
+    pub const UNKNOWN: Zone = Zone { min: f64::NEG_INFINITY, max: f64::INFINITY };
+    const EMPTY: Zone = Zone { min: f64::INFINITY, max: f64::NEG_INFINITY };
+
+    fn of(values: impl IntoIterator<Item = f64>) -> Zone {
+        values.into_iter().fold(Zone::EMPTY, |zone, value| Zone { min: zone.min.min(value), max: zone.max.max(value) })
+    }
+}
+
+// Distinct strings of a dictionary-encoded column, one JSON string per line
+// of the `.dict` file; a row stores the line number.
+#[derive(Debug, Clone, Default)]
+struct Dictionary {
+    values: Vec<String>,
+    codes: HashMap<String, u32>,
+    // Entries already in the file; the rest are written by the next append.
+    committed: usize,
+}
+
+impl Dictionary {
+    fn load(path: &Path, bytes: u64) -> Result<Self, ColumnStoreError> {
+        let mut dictionary = Dictionary::default();
+        if bytes == 0 {
+            return Ok(dictionary);
+        }
+        let file = File::open(path)?;
+        if file.metadata()?.len() < bytes {
+            return Err(ColumnStoreError::Truncated { file: path.display().to_string() });
+        }
+        for line in io::BufReader::new(file.take(bytes)).lines() {
+            let value: String = serde_json::from_str(&line?)?;
+            dictionary.code(&value);
+        }
+        dictionary.committed = dictionary.values.len();
+        Ok(dictionary)
+    }
+
+    fn code(&mut self, value: &str) -> u32 {
+        if let Some(code) = self.codes.get(value) {
+            return *code;
+        }
+        let code = self.values.len() as u32;
+        self.values.push(value.to_string());
+        self.codes.insert(value.to_string(), code);
+        code
+    }
+
+    // Appends the uncommitted entries after the first `committed_bytes`;
+    // returns the new committed length of the file.
+    fn write(&self, path: &Path, committed_bytes: u64) -> io::Result<u64> {
+        let file = open_for_append(path, committed_bytes)?;
+        let mut out = BufWriter::new(&file);
+        for value in &self.values[self.committed..] {
+            serde_json::to_writer(&mut out, value)?;
+            out.write_all(b"\n")?;
+        }
+        out.flush()?;
+        file.sync_data()?;
+        file.metadata().map(|metadata| metadata.len())
+    }
+}
+
+// Opens `path` for writing past its first `committed_bytes`, cutting off
+// whatever an interrupted append left behind.
+fn open_for_append(path: &Path, committed_bytes: u64) -> io::Result<File> {
+    let file = OpenOptions::new().create(true).append(true).open(path)?;
+    file.set_len(committed_bytes)?;
+    Ok(file)
+}
+
+// Column value types: plain numbers, valid for any bit pattern.
+//
+// SAFETY: implementors must be plain-old-data with no invalid bit patterns.
+unsafe trait Scalar: Copy {
+    fn extend_le_bytes(self, out: &mut Vec<u8>);
+    fn from_le_slice(bytes: &[u8]) -> Self;
+}
+
+unsafe impl Scalar for f64 {
+    fn extend_le_bytes(self, out: &mut Vec<u8>) {
+        out.extend_from_slice(&self.to_le_bytes());
+    }
+
+    fn from_le_slice(bytes: &[u8]) -> Self {
+        f64::from_le_bytes(bytes.try_into().expect("8-byte value"))
+    }
+}
+
+unsafe impl Scalar for i32 {
+    fn extend_le_bytes(self, out: &mut Vec<u8>) {
+        out.extend_from_slice(&self.to_le_bytes());
+    }
+
+    fn from_le_slice(bytes: &[u8]) -> Self {
+        i32::from_le_bytes(bytes.try_into().expect("4-byte value"))
+    }
+}
+
+unsafe impl Scalar for u32 {
+    fn extend_le_bytes(self, out: &mut Vec<u8>) {
+        out.extend_from_slice(&self.to_le_bytes());
+    }
+
+    fn from_le_slice(bytes: &[u8]) -> Self {
+        u32::from_le_bytes(bytes.try_into().expect("4-byte value"))
+    }
+}
+
+// The committed rows of one column file, mapped read-only.
+struct Mapped<T> {
+    map: Option<Mmap>,
+    rows: usize,
+    values: PhantomData<T>,
+}
+
+impl<T: Scalar> Mapped<T> {
+    fn open(path: &Path, rows: usize) -> Result<Self, ColumnStoreError> {
+        // An empty mapping is an error on most platforms.
+        if rows == 0 {
+            return Ok(Mapped { map: None, rows, values: PhantomData });
+        }
+        let file = File::open(path)?;
+        let bytes = rows * size_of::<T>();
+        if file.metadata()?.len() < bytes as u64 {
+            return Err(ColumnStoreError::Truncated { file: path.display().to_string() });
+        }
+        // SAFETY: the store only ever appends past the committed rows, so
+        // the mapped range is never rewritten or truncated while mapped.
+        let map = unsafe { MmapOptions::new().len(bytes).map(&file)? };
+        Ok(Mapped { map: Some(map), rows, values: PhantomData })
+    }
+
+    fn values(&self) -> &[T] {
+        match &self.map {
+            // SAFETY: mappings are page-aligned, hold exactly `rows` values
+            // and T accepts any bit pattern; the files are little-endian,
+            // which `ColumnStore::open` checks the platform is.
+            Some(map) => unsafe { std::slice::from_raw_parts(map.as_ptr().cast::<T>(), self.rows) },
+            None => &[],
+        }
+    }
+}
+
+fn append_column<T: Scalar>(path: &Path, committed_rows: usize, values: &[T]) -> io::Result<()> {
+    let file = open_for_append(path, (committed_rows * size_of::<T>()) as u64)?;
+    let mut bytes = Vec::with_capacity(values.len() * size_of::<T>());
+    for value in values {
+        value.extend_le_bytes(&mut bytes);
+    }
+    (&file).write_all(&bytes)?;
+    file.sync_data()
+}
+
+// Rewrites the zones from the block holding row `committed_rows` on. The
+// rows of that block already in the column are read back first.
+fn append_zones<T: Scalar + Into<f64>>(
+    zones_path: &Path,
+    column_path: &Path,
+    committed_rows: usize,
+    values: &[T],
+) -> io::Result<()> {
+    let block = committed_rows / BLOCK_ROWS;
+    let stored = committed_rows - block * BLOCK_ROWS;
+    let mut tail = vec![0; stored * size_of::<T>()];
+    if stored > 0 {
+        let mut column = File::open(column_path)?;
+        column.seek(SeekFrom::Start((block * BLOCK_ROWS * size_of::<T>()) as u64))?;
+        column.read_exact(&mut tail)?;
+    }
+    let tail: Vec<f64> = tail.chunks_exact(size_of::<T>()).map(|bytes| T::from_le_slice(bytes).into()).collect();
+    let values: Vec<f64> = tail.into_iter().chain(values.iter().map(|value| (*value).into())).collect();
+
+    // Earlier blocks whose zones are missing (a lost or short zone file) are
+    // written as UNKNOWN; zero-filling them would prune blocks wrongly.
+    const ZONE_BYTES: u64 = 2 * size_of::<f64>() as u64;
+    let stored_zones = match fs::metadata(zones_path) {
+        Ok(metadata) => (metadata.len() / ZONE_BYTES).min(block as u64),
+        Err(error) if error.kind() == io::ErrorKind::NotFound => 0,
+        Err(error) => return Err(error),
+    };
+    let file = open_for_append(zones_path, stored_zones * ZONE_BYTES)?;
+    let missing = block - stored_zones as usize;
+    let mut bytes = Vec::with_capacity((missing + values.len().div_ceil(BLOCK_ROWS)) * ZONE_BYTES as usize);
+    for zone in std::iter::repeat(Zone::UNKNOWN).take(missing) {
+        zone.min.extend_le_bytes(&mut bytes);
+        zone.max.extend_le_bytes(&mut bytes);
+    }
+    for chunk in values.chunks(BLOCK_ROWS) {
+        let zone = Zone::of(chunk.iter().copied());
+        zone.min.extend_le_bytes(&mut bytes);
+        zone.max.extend_le_bytes(&mut bytes);
+    }
+    (&file).write_all(&bytes)?;
+    file.sync_data()
+}
+
+// Zones of the first `blocks` blocks. They only ever bound the committed
+// rows loosely (an interrupted append may have widened one), and blocks
+// whose zone is missing are UNKNOWN.
+fn load_zones(path: &Path, blocks: usize) -> io::Result<Vec<Zone>> {
+    let bytes = match fs::read(path) {
+        Ok(bytes) => bytes,
+        Err(error) if error.kind() == io::ErrorKind::NotFound => Vec::new(),
+        Err(error) => return Err(error),
+    };
+    let mut zones: Vec<Zone> = bytes
+        .chunks_exact(2 * size_of::<f64>())
+        .take(blocks)
+        .map(|pair| Zone { min: f64::from_le_slice(&pair[..8]), max: f64::from_le_slice(&pair[8..]) })
+        .collect();
+    zones.resize(blocks, Zone::UNKNOWN);
+    Ok(zones)
+}
+
+// Archive of filings on disk, one file per column: a little-endian f64 file
+// per CEE position, the fiscal year as i32, company and sector as u32 codes
+// into their dictionaries, plus a JSON manifest with the committed row
+// count. Views map the column files read-only, so the KPI engine reads the
+// page cache directly and a view of any size opens instantly; only the
+// positions a KPI selection needs are mapped. Appends write every column
+// first and then replace the manifest, so readers never see a partial row.
+// One writer at a time; a clone is a cheap snapshot that later appends to
+// the original do not change.
+#[derive(Clone)]
+pub struct ColumnStore {
+    dir: PathBuf,
+    manifest: Manifest,
+    companies: Arc<Dictionary>,
+    sectors: Arc<Dictionary>,
+}
+
+impl ColumnStore {
+    // Opens the store in `dir`, creating an empty one if there is none.
+    pub fn open(dir: impl AsRef<Path>) -> Result<Self, ColumnStoreError> {
+        if cfg!(target_endian = "big") {
+            return Err(ColumnStoreError::BigEndian);
+        }
+        let dir = dir.as_ref().to_path_buf();
+        let manifest = match fs::read(dir.join(MANIFEST)) {
+            Ok(json) => serde_json::from_slice::<Manifest>(&json)?,
+            Err(error) if error.kind() == io::ErrorKind::NotFound => {
+                fs::create_dir_all(&dir)?;
+                Manifest { version: FORMAT_VERSION, ..Manifest::default() }
+            }
+            Err(error) => return Err(error.into()),
+        };
+        if manifest.version != FORMAT_VERSION {
+            return Err(ColumnStoreError::Version(manifest.version));
+        }
+        let companies = Dictionary::load(&dir.join(COMPANY_DICTIONARY), manifest.company_dictionary_bytes)?;
+        let sectors = Dictionary::load(&dir.join(SECTOR_DICTIONARY), manifest.sector_dictionary_bytes)?;
+        Ok(ColumnStore { dir, manifest, companies: Arc::new(companies), sectors: Arc::new(sectors) })
+    }
+
+    pub fn rows(&self) -> usize {
+        self.manifest.rows
+    }
+
+    pub fn append(&mut self, filings: &[ArchivedFiling]) -> Result<(), ColumnStoreError> {
+        if filings.is_empty() {
+            return Ok(());
+        }
+        let rows = self.manifest.rows;
+        let companies = Arc::make_mut(&mut self.companies);
+        let company_codes: Vec<u32> = filings.iter().map(|filing| companies.code(&filing.company)).collect();
+        let sectors = Arc::make_mut(&mut self.sectors);
+        let sector_codes: Vec<u32> = filings.iter().map(|filing| sectors.code(&filing.sector)).collect();
+
+        for id in 0..POSITION_COUNT {
+            let path = self.dir.join(position_column(id));
+            let values: Vec<f64> = filings.iter().map(|filing| filing.positions.get(id)).collect();
+            append_column(&path, rows, &values)?;
+            append_zones(&self.dir.join(position_zones(id)), &path, rows, &values)?;
+        }
+        let fiscal_years: Vec<i32> = filings.iter().map(|filing| filing.fiscal_year).collect();
+        append_column(&self.dir.join(FISCAL_YEAR_COLUMN), rows, &fiscal_years)?;
+        append_zones(&self.dir.join(FISCAL_YEAR_ZONES), &self.dir.join(FISCAL_YEAR_COLUMN), rows, &fiscal_years)?;
+        append_column(&self.dir.join(COMPANY_COLUMN), rows, &company_codes)?;
+        append_column(&self.dir.join(SECTOR_COLUMN), rows, &sector_codes)?;
+        let manifest = Manifest {
+            version: FORMAT_VERSION,
+            rows: rows + filings.len(),
+            company_dictionary_bytes: companies
+                .write(&self.dir.join(COMPANY_DICTIONARY), self.manifest.company_dictionary_bytes)?,
+            sector_dictionary_bytes: sectors.write(&self.dir.join(SECTOR_DICTIONARY), self.manifest.sector_dictionary_bytes)?,
+        };
+
+        let staged = self.dir.join(format!("{MANIFEST}.tmp"));
+        let mut file = File::create(&staged)?;
+        file.write_all(&serde_json::to_vec(&manifest)?)?;
+        file.sync_all()?;
+        fs::rename(&staged, self.dir.join(MANIFEST))?;
+
+        companies.committed = companies.values.len();
+        sectors.committed = sectors.values.len();
+        self.manifest = manifest;
+        Ok(())
+    }
+
+    // Maps the metadata columns and the given positions, as of now; later
+    // appends are not visible through the view.
+    pub fn view(&self, positions: PositionSet) -> Result<ColumnView, ColumnStoreError> {
+        let rows = self.manifest.rows;
+        let blocks = rows.div_ceil(BLOCK_ROWS);
+        let mut columns: Vec<Option<PositionColumn>> = (0..POSITION_COUNT).map(|_| None).collect();
+        for id in positions.iter() {
+            columns[id] = Some(PositionColumn {
+                values: Mapped::open(&self.dir.join(position_column(id)), rows)?,
+                zones: load_zones(&self.dir.join(position_zones(id)), blocks)?,
+            });
+        }
+        Ok(ColumnView {
+            rows,
+            positions: columns,
+            fiscal_years: Mapped::open(&self.dir.join(FISCAL_YEAR_COLUMN), rows)?,
+            fiscal_year_zones: load_zones(&self.dir.join(FISCAL_YEAR_ZONES), blocks)?,
+            companies: Mapped::open(&self.dir.join(COMPANY_COLUMN), rows)?,
+            sectors: Mapped::open(&self.dir.join(SECTOR_COLUMN), rows)?,
+            company_names: Arc::clone(&self.companies),
+            sector_names: Arc::clone(&self.sectors),
+        })
+    }
+
+    // The KPIs of every archived filing, reading only the positions they need.
+    pub fn calculate(&self, kpi_keys: &[String]) -> Result<BatchResult, ColumnStoreError> {
+        let view = self.view(KpiPlan::compile(kpi_keys).required_positions())?;
+        Ok(calculate_kpis_batch(&view, kpi_keys))
+    }
+}
+
+struct PositionColumn {
+    values: Mapped<f64>,
+    zones: Vec<Zone>,
+}
+
+// Mapped columns of a `ColumnStore`, with the zone maps of the numeric
+// ones: rows are grouped in blocks of BLOCK_ROWS, and the min / max of each
+// block lets a scan skip it without touching its pages. Positions left out
+// of the view read as absent.
+pub struct ColumnView {
+    rows: usize,
+    positions: Vec<Option<PositionColumn>>,
+    fiscal_years: Mapped<i32>,
+    fiscal_year_zones: Vec<Zone>,
+    companies: Mapped<u32>,
+    sectors: Mapped<u32>,
+    company_names: Arc<Dictionary>,
+    sector_names: Arc<Dictionary>,
+}
+
+impl ColumnView {
+    pub fn rows(&self) -> usize {
+        self.rows
+    }
+
+    pub fn blocks(&self) -> usize {
+        self.rows.div_ceil(BLOCK_ROWS)
+    }
+
+    pub fn position(&self, id: PositionId) -> Option<&[f64]> {
+        self.positions[id].as_ref().map(|column| column.values.values())
+    }
+
+    pub fn position_zone(&self, id: PositionId, block: usize) -> Option<Zone> {
+        self.positions[id].as_ref().map(|column| column.zones[block])
+    }
+
+    pub fn fiscal_years(&self) -> &[i32] {
+        self.fiscal_years.values()
+    }
+
+    pub fn fiscal_year_zone(&self, block: usize) -> Zone {
+        self.fiscal_year_zones[block]
+    }
+
+    pub fn company(&self, row: usize) -> &str {
+        &self.company_names.values[self.companies.values()[row] as usize]
+    }
+
+    pub fn sector(&self, row: usize) -> &str {
+        &self.sector_names.values[self.sectors.values()[row] as usize]
+    }
+
+    // Sector codes per row, and the code of a sector, for filtering
+    // without comparing strings.
+    pub fn sector_codes(&self) -> &[u32] {
+        self.sectors.values()
+    }
+
+    pub fn sector_code(&self, sector: &str) -> Option<u32> {
+        self.sector_names.codes.get(sector).copied()
+    }
+
+    // One row as a balance sheet; positions left out of the view are zero.
+    pub fn sheet(&self, row: usize) -> BalanceSheet {
+        let mut sheet = BalanceSheet::new();
+        for (id, column) in self.positions.iter().enumerate() {
+            if let Some(column) = column {
+                sheet.set(id, column.values.values()[row]);
+            }
+        }
+        sheet
+    }
+}
+
+impl PositionColumns for ColumnView {
+    fn rows(&self) -> usize {
+        self.rows
+    }
+
+    fn column(&self, id: PositionId) -> &[f64] {
+        self.position(id).unwrap_or_else(|| panic!("position {} is not mapped in this view", position_key(id)))
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::calculator::calculate_selected_kpis;
+    use crate::app_logic::kpi_config::KPI_DEFINITIONS;
+    use crate::app_logic::positions::pos;
+
+    fn filing(company: &str, fiscal_year: i32, sector: &str, scale: f64) -> ArchivedFiling {
+        let mut positions = BalanceSheet::new();
+        for p in 1..=100 {
+            positions.set(pos(p), ((p * 7) % 23) as f64 * scale);
+        }
+        ArchivedFiling { company: company.to_string(), fiscal_year, sector: sector.to_string(), positions }
+    }
+
+    fn temp_store() -> PathBuf {
+        std::env::temp_dir().join(format!("kpi-columns-{}-{:?}", std::process::id(), std::thread::current().id()))
+    }
+
+    #[test]
+    fn appended_filings_are_read_back_through_the_mapped_columns() {
+        let dir = temp_store();
+        let _ = fs::remove_dir_all(&dir);
+        let filings =
+            [filing("Alfa S.p.A.", 2022, "C", 100.0), filing("Alfa S.p.A.", 2023, "C", 110.0), filing("Beta S.r.l.", 2023, "I", 50.0)];
+        {
+            let mut store = ColumnStore::open(&dir).unwrap();
+            assert_eq!(store.calculate(&["current_ratio".to_string()]).unwrap().rows, 0);
+            store.append(&filings[..2]).unwrap();
+            store.append(&filings[2..]).unwrap();
+        }
+
+        let store = ColumnStore::open(&dir).unwrap();
+        assert_eq!(store.rows(), 3);
+        let keys: Vec<String> = KPI_DEFINITIONS.iter().map(|definition| definition.key.to_string()).collect();
+        let batch = store.calculate(&keys).unwrap();
+        for (row, filing) in filings.iter().enumerate() {
+            let single = calculate_selected_kpis(&filing.positions, &keys);
+            for (key, result) in batch.row_results(row) {
+                assert_eq!(result.value, single[&key].value, "{key} row {row}");
+            }
+        }
+
+        let view = store.view(PositionSet::default()).unwrap();
+        assert_eq!(view.fiscal_years(), &[2022, 2023, 2023]);
+        assert_eq!((view.company(2), view.sector(2)), ("Beta S.r.l.", "I"));
+        assert_eq!(view.sector_codes(), &[0, 0, 1]);
+        assert!(view.position(pos(1)).is_none());
+        fs::remove_dir_all(&dir).unwrap();
+    }
+
+    #[test]
+    fn an_interrupted_append_is_ignored_and_overwritten() {
+        let dir = temp_store().with_extension("torn");
+        let _ = fs::remove_dir_all(&dir);
+        let mut store = ColumnStore::open(&dir).unwrap();
+        store.append(&[filing("Alfa S.p.A.", 2022, "C", 100.0)]).unwrap();
+
+        // A crash after some columns and a dictionary entry were written.
+        let mut column = OpenOptions::new().append(true).open(dir.join(position_column(pos(1)))).unwrap();
+        column.write_all(&9.0f64.to_le_bytes()[..5]).unwrap();
+        let mut dictionary = OpenOptions::new().append(true).open(dir.join(COMPANY_DICTIONARY)).unwrap();
+        dictionary.write_all(b"\"Gam").unwrap();
+
+        let mut store = ColumnStore::open(&dir).unwrap();
+        assert_eq!(store.rows(), 1);
+        store.append(&[filing("Gamma S.p.A.", 2023, "F", 10.0)]).unwrap();
+        let store = ColumnStore::open(&dir).unwrap();
+        let view = store.view(PositionSet::all()).unwrap();
+        assert_eq!(view.rows(), 2);
+        assert_eq!(view.company(1), "Gamma S.p.A.");
+        assert_eq!(view.sheet(1), filing("Gamma S.p.A.", 2023, "F", 10.0).positions);
+        assert_eq!(view.position(pos(1)).unwrap(), &[700.0, 70.0]);
+        assert_eq!(view.position_zone(pos(1), 0), Some(Zone { min: 70.0, max: 700.0 }));
+        fs::remove_dir_all(&dir).unwrap();
+    }
+
+    #[test]
+    fn zone_maps_bound_each_block() {
+        let dir = temp_store().with_extension("zones");
+        let _ = fs::remove_dir_all(&dir);
+        let mut store = ColumnStore::open(&dir).unwrap();
+        let filings: Vec<ArchivedFiling> =
+            (0..BLOCK_ROWS + 10).map(|i| filing("Alfa S.p.A.", 2000 + (i / 1000) as i32, "C", i as f64)).collect();
+        // The second append extends the partially filled second block.
+        store.append(&filings[..BLOCK_ROWS + 4]).unwrap();
+        store.append(&filings[BLOCK_ROWS + 4..]).unwrap();
+
+        let view = store.view(PositionSet::all()).unwrap();
+        assert_eq!(view.blocks(), 2);
+        // Position 1 holds 7 x the row number.
+        assert_eq!(view.position_zone(pos(1), 0), Some(Zone { min: 0.0, max: 7.0 * (BLOCK_ROWS - 1) as f64 }));
+        let last = (BLOCK_ROWS + 9) as f64;
+        assert_eq!(view.position_zone(pos(1), 1), Some(Zone { min: 7.0 * BLOCK_ROWS as f64, max: 7.0 * last }));
+        assert_eq!(view.fiscal_year_zone(0), Zone { min: 2000.0, max: 2004.0 });
+
+        // A lost zone file only makes its blocks unknown, also after the
+        // next append rebuilds the zone of the block it extends.
+        fs::remove_file(dir.join(FISCAL_YEAR_ZONES)).unwrap();
+        fs::remove_file(dir.join(position_zones(pos(1)))).unwrap();
+        assert_eq!(store.view(PositionSet::default()).unwrap().fiscal_year_zone(1), Zone::UNKNOWN);
+        store.append(&[filing("Beta S.r.l.", 2010, "C", 1.0)]).unwrap();
+        let view = store.view(PositionSet::all()).unwrap();
+        assert_eq!(view.fiscal_year_zone(0), Zone::UNKNOWN);
+        assert_eq!(view.fiscal_year_zone(1), Zone { min: 2004.0, max: 2010.0 });
+        assert_eq!(view.position_zone(pos(1), 0), Some(Zone::UNKNOWN));
+        assert_eq!(view.position_zone(pos(1), 1), Some(Zone { min: 7.0, max: 7.0 * last }));
+        fs::remove_dir_all(&dir).unwrap();
+    }
+}
@@ -2,21 +2,58 @@ use std::collections::BTreeMap;
 
 use crate::app_logic::{
     balance_sheet_config::get_position_names,
+    calculator::{ASSET_SIDE, LIABILITIES_EQUITY_SIDE},
+    importer::PositionResolver,
     kpi_config::get_available_kpis,
+    kpi_requirements_logic::{get_kpi_requirements, get_required_positions},
+    positions::{position_key, PositionId, PositionSet},
 };
 
 pub struct AppState {
     pub balance_sheet_structure: BTreeMap<String, String>, // Simplified for now
     pub position_names: BTreeMap<String, String>,
     pub available_kpis: BTreeMap<String, crate::app_logic::kpi_config::KpiDetails>,
+    pub kpi_requirements: BTreeMap<String, Vec<String>>,
+    pub position_resolver: PositionResolver,
+    // Positions of both sides that have an input field (every named one);
+    // the balance check runs once all of them were submitted.
+    pub balance_inputs: PositionSet,
+}
+
+// Fields of the input page per side of the balance sheet, in CEE order:
+// (position, whether the selected KPIs read it).
+pub struct InputFields {
+    pub assets: Vec<(PositionId, bool)>,
+    pub liabilities_equity: Vec<(PositionId, bool)>,
 }
 
 impl AppState {
     pub fn new() -> Self {
+        let position_names = get_position_names();
+        let balance_inputs = ASSET_SIDE
+            .iter()
+            .chain(&LIABILITIES_EQUITY_SIDE)
+            .copied()
+            .filter(|id| position_names.contains_key(position_key(*id)))
+            .collect();
         AppState {
             balance_sheet_structure: BTreeMap::new(),
-            position_names: get_position_names(),
+            position_resolver: PositionResolver::new(&position_names),
+            position_names,
             available_kpis: get_available_kpis(),
+            kpi_requirements: get_kpi_requirements(),
+            balance_inputs,
         }
     }
+
+    // The input page shows every field of both sides, so the balance check
+    // can run; the ones the selected KPIs read (all of them when nothing is
+    // selected) come first.
+    pub fn input_fields<K: AsRef<str>>(&self, selected_kpis: &[K]) -> InputFields {
+        let read = if selected_kpis.is_empty() { PositionSet::all() } else { get_required_positions(selected_kpis) };
+        let side = |ids: &[PositionId]| {
+            ids.iter().filter(|id| self.balance_inputs.contains(**id)).map(|&id| (id, read.contains(id))).collect()
+        };
+        InputFields { assets: side(&ASSET_SIDE), liabilities_equity: side(&LIABILITIES_EQUITY_SIDE) }
+    }
 }
@@ -0,0 +1,813 @@
+use std::collections::{BTreeMap, HashMap};
+use std::io::{self, BufRead, BufReader, Read, Seek};
+use std::mem::size_of;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
+use std::thread;
+
+use quick_xml::events::{BytesStart, Event};
+use quick_xml::Reader;
+use serde::Serialize;
+use thiserror::Error;
+use zip::ZipArchive;
+
+use crate::app_logic::balance_sheet_config::get_position_names;
+use crate::app_logic::positions::{position_index, position_key};
+use crate::app_logic::validators::validate_financial_data;
+use crate::app_logic::workers::Workers;
+
+#[derive(Debug, Error)]
+pub enum ImportError {
+    #[error("invalid XLSX archive: {0}")]
+    Zip(#[from] zip::result::ZipError),
+    #[error("invalid XML in {part}: {source}")]
+    Xml { part: String, source: quick_xml::Error },
+    #[error("missing workbook part {0}")]
+    MissingPart(String),
+    #[error("read error: {0}")]
+    Io(#[from] io::Error),
+    #[error("shared string table larger than {0} bytes")]
+    SharedStringsTooLarge(usize),
+}
+
+// Excel's sheet width (columns A..XFD); cells referenced beyond it are skipped.
+const MAX_COLUMNS: usize = 16_384;
+// Bound on the decompressed shared string table, the one part held in memory.
+const MAX_SHARED_STRING_BYTES: usize = 64 * 1024 * 1024;
+
+// A problem with one row of the imported file; the rest of the file is still imported.
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct RowError {
+    pub sheet: String,
+    pub row: usize,
+    pub message: String,
+}
+
+// One company / fiscal year found in the file, ready for the calculator.
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct ImportedSheet {
+    pub company: Option<String>,
+    pub year: Option<String>,
+    // Raw amounts as `pos_<key>` form fields, the shape `validate_financial_data` reads.
+    pub form_data: BTreeMap<String, String>,
+    // Validated amounts, ready for `calculate_selected_kpis`.
+    pub data: BTreeMap<String, f64>,
+}
+
+#[derive(Debug, Clone, Default, PartialEq, Serialize)]
+pub struct ImportReport {
+    pub sheets: Vec<ImportedSheet>,
+    pub errors: Vec<RowError>,
+}
+
+// Maps the labels found in a spreadsheet to CEE position keys: the key itself
+// ("31", "39.NCA", "pos_31") or the position name from `get_position_names`,
+// compared case- and punctuation-insensitively. A name whose trailing
+// parenthetical is left out ("Debiti verso banche") also matches when only one
+// position carries it.
+#[derive(Debug, Clone)]
+pub struct PositionResolver {
+    by_name: HashMap<String, &'static str>,
+}
+
+impl PositionResolver {
+    pub fn new(position_names: &BTreeMap<String, String>) -> Self {
+        let mut by_name = HashMap::new();
+        let mut short_names: HashMap<String, Option<&'static str>> = HashMap::new();
+        for (key, name) in position_names {
+            let Some(id) = position_index(key) else { continue };
+            let key = position_key(id);
+            by_name.insert(normalize_label(name), key);
+            if let Some((short, _)) = name.split_once('(') {
+                short_names
+                    .entry(normalize_label(short))
+                    .and_modify(|existing| *existing = None)
+                    .or_insert(Some(key));
+            }
+        }
+        for (short, key) in short_names {
+            if let Some(key) = key {
+                by_name.entry(short).or_insert(key);
+            }
+        }
+        PositionResolver { by_name }
+    }
+
+    pub fn resolve(&self, label: &str) -> Option<&'static str> {
+        let label = label.trim();
+        let code = label.strip_prefix("pos_").unwrap_or(label);
+        if let Some(id) = position_index(code) {
+            return Some(position_key(id));
+        }
+        self.by_name.get(&normalize_label(label)).copied()
+    }
+}
+
+impl Default for PositionResolver {
+    fn default() -> Self {
+        PositionResolver::new(&get_position_names())
+    }
+}
+
+pub(crate) fn normalize_label(label: &str) -> String {
+    let mut normalized = String::with_capacity(label.len());
+    for word in label.split(|c: char| !c.is_alphanumeric()).filter(|w| !w.is_empty()) {
+        if !normalized.is_empty() {
+            normalized.push(' ');
+        }
+        normalized.extend(word.chars().flat_map(char::to_lowercase));
+    }
+    normalized
+}
+
+// XLSX (zip signature) or CSV, told apart by content.
+pub fn import_bytes(bytes: &[u8], name: &str, resolver: &PositionResolver) -> Result<ImportReport, ImportError> {
+    if bytes.starts_with(b"PK\x03\x04") {
+        import_xlsx(io::Cursor::new(bytes), resolver)
+    } else {
+        import_csv(bytes, name, resolver)
+    }
+}
+
+pub fn import_csv<R: Read>(reader: R, name: &str, resolver: &PositionResolver) -> Result<ImportReport, ImportError> {
+    let mut table = TableReader::new(0, name, resolver);
+    let mut csv = CsvReader::new(BufReader::new(reader));
+    let mut record = Vec::new();
+    while let Some(row) = csv.read_record(&mut record)? {
+        table.push_row(row, &record);
+    }
+    Ok(merge_sheets(vec![table.finish()], &[name]))
+}
+
+// Worksheets are decompressed and parsed as streams, one row at a time, on up
+// to `available_parallelism` threads shared with the other parallel jobs (`workers.rs`); only the shared string table
+// is held in memory.
+pub fn import_xlsx<R: Read + Seek + Clone + Send>(
+    reader: R,
+    resolver: &PositionResolver,
+) -> Result<ImportReport, ImportError> {
+    let mut archive = ZipArchive::new(reader)?;
+    let worksheets = read_workbook(&mut archive)?;
+    let shared_strings = match archive.by_name("xl/sharedStrings.xml") {
+        Ok(part) => read_shared_strings(BufReader::new(part), MAX_SHARED_STRING_BYTES)?,
+        Err(zip::result::ZipError::FileNotFound) => Vec::new(),
+        Err(err) => return Err(err.into()),
+    };
+
+    let next = AtomicUsize::new(0);
+    let parsed = Mutex::new(Vec::with_capacity(worksheets.len()));
+    let workers = Workers::acquire(worksheets.len());
+    thread::scope(|scope| {
+        for _ in 0..workers.count() {
+            let mut archive = archive.clone();
+            let (next, parsed, worksheets, shared_strings) = (&next, &parsed, &worksheets, &shared_strings);
+            scope.spawn(move || loop {
+                let index = next.fetch_add(1, Ordering::Relaxed);
+                let Some(worksheet) = worksheets.get(index) else { break };
+                let result = archive
+                    .by_name(&worksheet.path)
+                    .map_err(ImportError::from)
+                    .and_then(|part| {
+                        let mut table = TableReader::new(index, &worksheet.name, resolver);
+                        read_worksheet(BufReader::new(part), &worksheet.path, shared_strings, &mut table)?;
+                        Ok(table.finish())
+                    });
+                parsed.lock().unwrap().push((index, result));
+            });
+        }
+    });
+
+    let mut parsed = parsed.into_inner().unwrap();
+    parsed.sort_by_key(|(index, _)| *index);
+    let tables = parsed.into_iter().map(|(_, result)| result).collect::<Result<Vec<_>, _>>()?;
+    let names: Vec<&str> = worksheets.iter().map(|w| w.name.as_str()).collect();
+    Ok(merge_sheets(tables, &names))
+}
+
+// Identifies one balance sheet inside the file.
+#[derive(Debug, Clone, Default, PartialEq, Eq, PartialOrd, Ord)]
+struct SheetKey {
+    company: Option<String>,
+    year: Option<String>,
+}
+
+impl SheetKey {
+    // Values from the row's own company/year columns win over the column header.
+    fn or(&self, fallback: &SheetKey) -> SheetKey {
+        SheetKey {
+            company: self.company.clone().or_else(|| fallback.company.clone()),
+            year: self.year.clone().or_else(|| fallback.year.clone()),
+        }
+    }
+}
+
+#[derive(Debug, Clone, Copy, PartialEq)]
+enum ColumnRole {
+    Company,
+    Year,
+    Position,
+    Description,
+    Other,
+}
+
+const COMPANY_HEADERS: [&str; 6] = ["azienda", "societa", "società", "ragione sociale", "impresa", "company"];
+const YEAR_HEADERS: [&str; 5] = ["anno", "esercizio", "periodo", "year", "fiscal year"];
+const POSITION_HEADERS: [&str; 5] = ["voce", "posizione", "codice", "pos", "position"];
+const DESCRIPTION_HEADERS: [&str; 3] = ["descrizione", "nome", "description"];
+const AMOUNT_HEADERS: [&str; 5] = ["importo", "valore", "saldo", "amount", "value"];
+
+fn column_role(header: &str) -> ColumnRole {
+    let header = normalize_label(header);
+    if COMPANY_HEADERS.contains(&header.as_str()) {
+        ColumnRole::Company
+    } else if YEAR_HEADERS.contains(&header.as_str()) {
+        ColumnRole::Year
+    } else if POSITION_HEADERS.contains(&header.as_str()) {
+        ColumnRole::Position
+    } else if DESCRIPTION_HEADERS.contains(&header.as_str()) {
+        ColumnRole::Description
+    } else {
+        ColumnRole::Other
+    }
+}
+
+// Amount column header in the long layout: "2023" / "Esercizio 2023" name a
+// fiscal year, "Importo (€)" names nothing, anything else names a company.
+fn amount_column_key(header: &str) -> SheetKey {
+    let normalized = normalize_label(header);
+    let year = normalized
+        .split(' ')
+        .find(|word| word.len() == 4 && word.bytes().all(|b| b.is_ascii_digit()));
+    let rest: Vec<&str> = normalized
+        .split(' ')
+        .filter(|word| Some(*word) != year && !YEAR_HEADERS.contains(word) && !AMOUNT_HEADERS.contains(word))
+        .filter(|word| !matches!(*word, "eur" | "euro"))
+        .collect();
+    match year {
+        Some(year) => SheetKey { company: None, year: Some(year.to_string()) },
+        None if rest.is_empty() => SheetKey::default(),
+        None => SheetKey { company: Some(header.trim().to_string()), year: None },
+    }
+}
+
+#[derive(Debug)]
+enum Layout {
+    // One row per position, one amount column per balance sheet (the layout
+    // of the demo workbook: Voce | Descrizione | Importo).
+    Long {
+        position: Option<usize>,
+        description: Option<usize>,
+        amounts: Vec<(usize, SheetKey)>,
+        company: Option<usize>,
+        year: Option<usize>,
+    },
+    // One row per balance sheet, one column per position.
+    Wide {
+        positions: Vec<(usize, &'static str)>,
+        company: Option<usize>,
+        year: Option<usize>,
+    },
+}
+
+#[derive(Debug)]
+struct Entry {
+    key: SheetKey,
+    position: &'static str,
+    raw: String,
+    row: usize,
+}
+
+#[derive(Debug)]
+struct ParsedTable {
+    sheet: usize,
+    entries: Vec<Entry>,
+    errors: Vec<RowError>,
+}
+
+// Turns the rows of one sheet into position entries; the first non-empty row is the header.
+struct TableReader<'a> {
+    sheet: usize,
+    name: &'a str,
+    resolver: &'a PositionResolver,
+    layout: Option<Layout>,
+    entries: Vec<Entry>,
+    errors: Vec<RowError>,
+}
+
+impl<'a> TableReader<'a> {
+    fn new(sheet: usize, name: &'a str, resolver: &'a PositionResolver) -> Self {
+        TableReader { sheet, name, resolver, layout: None, entries: Vec::new(), errors: Vec::new() }
+    }
+
+    fn push_row(&mut self, row: usize, cells: &[String]) {
+        if cells.iter().all(|cell| cell.trim().is_empty()) {
+            return;
+        }
+        match &self.layout {
+            None => self.layout = Some(self.read_header(cells)),
+            Some(Layout::Long { position, description, amounts, company, year }) => {
+                let row_key = SheetKey { company: cell_text(cells, *company), year: cell_text(cells, *year) };
+                let label = cell_text(cells, *position);
+                let name = cell_text(cells, *description);
+                let values: Vec<(&SheetKey, String)> = amounts
+                    .iter()
+                    .filter_map(|(column, key)| cell_text(cells, Some(*column)).map(|raw| (key, raw)))
+                    .collect();
+                if values.is_empty() {
+                    // Section titles and blank amounts.
+                    return;
+                }
+                let resolved = label
+                    .as_deref()
+                    .and_then(|l| self.resolver.resolve(l))
+                    .or_else(|| name.as_deref().and_then(|n| self.resolver.resolve(n)));
+                let Some(position) = resolved else {
+                    let shown = label.or(name).unwrap_or_default();
+                    let message = format!("Voce di bilancio non riconosciuta: \"{}\".", shown);
+                    self.errors.push(RowError { sheet: self.name.to_string(), row, message });
+                    return;
+                };
+                for (key, raw) in values {
+                    self.entries.push(Entry { key: row_key.or(key), position, raw, row });
+                }
+            }
+            Some(Layout::Wide { positions, company, year }) => {
+                let mut key = SheetKey { company: cell_text(cells, *company), year: cell_text(cells, *year) };
+                if key == SheetKey::default() {
+                    key.company = Some(format!("{} riga {}", self.name, row));
+                }
+                for (column, position) in positions {
+                    if let Some(raw) = cell_text(cells, Some(*column)) {
+                        self.entries.push(Entry { key: key.clone(), position: *position, raw, row });
+                    }
+                }
+            }
+        }
+    }
+
+    fn read_header(&self, cells: &[String]) -> Layout {
+        let roles: Vec<ColumnRole> = cells.iter().map(|cell| column_role(cell)).collect();
+        let find = |role| roles.iter().position(|r| *r == role);
+        let (company, year) = (find(ColumnRole::Company), find(ColumnRole::Year));
+        let (position, description) = (find(ColumnRole::Position), find(ColumnRole::Description));
+
+        let others: Vec<usize> =
+            roles.iter().enumerate().filter(|(_, role)| **role == ColumnRole::Other).map(|(i, _)| i).collect();
+        if position.is_none() && description.is_none() {
+            let positions: Vec<(usize, &'static str)> = others
+                .iter()
+                .filter_map(|&i| self.resolver.resolve(&cells[i]).map(|position| (i, position)))
+                .collect();
+            if !positions.is_empty() {
+                return Layout::Wide { positions, company, year };
+            }
+        }
+        let amounts = others
+            .into_iter()
+            .filter(|i| !cells[*i].trim().is_empty())
+            .map(|i| (i, amount_column_key(&cells[i])))
+            .collect();
+        Layout::Long { position, description, amounts, company, year }
+    }
+
+    fn finish(mut self) -> ParsedTable {
+        if let Some(Layout::Long { position: None, description: None, .. }) = self.layout {
+            self.errors.push(RowError {
+                sheet: self.name.to_string(),
+                row: 1,
+                message: "Intestazione non riconosciuta: manca la colonna \"Voce\" o le colonne delle posizioni.".to_string(),
+            });
+            self.entries.clear();
+        }
+        ParsedTable { sheet: self.sheet, entries: self.entries, errors: self.errors }
+    }
+}
+
+fn cell_text(cells: &[String], column: Option<usize>) -> Option<String> {
+    let text = cells.get(column?)?.trim();
+    (!text.is_empty()).then(|| text.to_string())
+}
+
+// Groups entries of every sheet by company / year and validates each balance
+// sheet through `validate_financial_data`, mapping field errors back to rows.
+fn merge_sheets(tables: Vec<ParsedTable>, sheet_names: &[&str]) -> ImportReport {
+    let mut report = ImportReport::default();
+    let mut pending: BTreeMap<SheetKey, BTreeMap<&'static str, (String, usize, usize)>> = BTreeMap::new();
+
+    for table in tables {
+        report.errors.extend(table.errors);
+        for entry in table.entries {
+            let positions = pending.entry(entry.key).or_default();
+            if let Some((_, sheet, row)) = positions.get(entry.position) {
+                report.errors.push(RowError {
+                    sheet: sheet_names[table.sheet].to_string(),
+                    row: entry.row,
+                    message: format!(
+                        "Posizione {} già presente (foglio \"{}\", riga {}).",
+                        entry.position, sheet_names[*sheet], row
+                    ),
+                });
+                continue;
+            }
+            positions.insert(entry.position, (entry.raw, table.sheet, entry.row));
+        }
+    }
+
+    for (key, positions) in pending {
+        let form_data: BTreeMap<String, String> =
+            positions.iter().map(|(position, (raw, _, _))| (format!("pos_{}", position), raw.clone())).collect();
+        let required: Vec<String> = positions.keys().map(|position| position.to_string()).collect();
+        let (data, field_errors) = validate_financial_data(&form_data, &required);
+        for (field, message) in field_errors {
+            if let Some((_, sheet, row)) = field.strip_prefix("pos_").and_then(|p| positions.get(p)) {
+                let message = format!("Posizione {}: {}", &field[4..], message);
+                report.errors.push(RowError { sheet: sheet_names[*sheet].to_string(), row: *row, message });
+            }
+        }
+        report.sheets.push(ImportedSheet { company: key.company, year: key.year, form_data, data });
+    }
+    report.errors.sort_by(|a, b| (&a.sheet, a.row).cmp(&(&b.sheet, b.row)));
+    report
+}
+
+struct Worksheet {
+    name: String,
+    path: String,
+}
+
+fn xml_error(part: &str) -> impl Fn(quick_xml::Error) -> ImportError + '_ {
+    move |source| ImportError::Xml { part: part.to_string(), source }
+}
+
+fn attribute(element: &BytesStart, name: &[u8]) -> Option<String> {
+    element
+        .attributes()
+        .flatten()
+        .find(|a| a.key.as_ref() == name)
+        .and_then(|a| a.unescape_value().ok().map(|v| v.into_owned()))
+}
+
+// Sheet names in workbook order with their part paths, via the relationships file.
+fn read_workbook<R: Read + Seek>(archive: &mut ZipArchive<R>) -> Result<Vec<Worksheet>, ImportError> {
+    let mut targets = HashMap::new();
+    {
+        let part = "xl/_rels/workbook.xml.rels";
+        let file = archive.by_name(part).map_err(|_| ImportError::MissingPart(part.to_string()))?;
+        let mut reader = Reader::from_reader(BufReader::new(file));
+        let mut buf = Vec::new();
+        loop {
+            match reader.read_event_into(&mut buf).map_err(xml_error(part))? {
+                Event::Start(e) | Event::Empty(e) if e.local_name().as_ref() == b"Relationship" => {
+                    if let (Some(id), Some(target)) = (attribute(&e, b"Id"), attribute(&e, b"Target")) {
+                        let path = match target.strip_prefix('/') {
+                            Some(absolute) => absolute.to_string(),
+                            None => format!("xl/{}", target),
+                        };
+                        targets.insert(id, path);
+                    }
+                }
+                Event::Eof => break,
+                _ => {}
+            }
+            buf.clear();
+        }
+    }
+
+    let part = "xl/workbook.xml";
+    let file = archive.by_name(part).map_err(|_| ImportError::MissingPart(part.to_string()))?;
+    let mut reader = Reader::from_reader(BufReader::new(file));
+    let mut buf = Vec::new();
+    let mut worksheets = Vec::new();
+    loop {
+        match reader.read_event_into(&mut buf).map_err(xml_error(part))? {
+            Event::Start(e) | Event::Empty(e) if e.local_name().as_ref() == b"sheet" => {
+                let name = attribute(&e, b"name").unwrap_or_default();
+                if let Some(path) = attribute(&e, b"r:id").and_then(|id| targets.get(&id)) {
+                    worksheets.push(Worksheet { name, path: path.clone() });
+                }
+            }
+            Event::Eof => break,
+            _ => {}
+        }
+        buf.clear();
+    }
+    Ok(worksheets)
+}
+
+// Concatenated text of every `<si>`, skipping phonetic runs. Fails once the
+// strings (counted with their `String` headers) exceed `limit` bytes.
+fn read_shared_strings<R: BufRead>(input: R, limit: usize) -> Result<Vec<String>, ImportError> {
+    let part = "xl/sharedStrings.xml";
+    let mut reader = Reader::from_reader(input);
+    let mut buf = Vec::new();
+    let mut strings = Vec::new();
+    let mut current = String::new();
+    let (mut in_text, mut in_phonetic) = (false, false);
+    let mut bytes = 0;
+    loop {
+        if bytes + current.len() > limit {
+            return Err(ImportError::SharedStringsTooLarge(limit));
+        }
+        match reader.read_event_into(&mut buf).map_err(xml_error(part))? {
+            Event::Start(e) => match e.local_name().as_ref() {
+                b"si" => current.clear(),
+                b"t" => in_text = !in_phonetic,
+                b"rPh" => in_phonetic = true,
+                _ => {}
+            },
+            Event::Empty(e) if e.local_name().as_ref() == b"si" => {
+                bytes += size_of::<String>();
+                strings.push(String::new());
+            }
+            Event::Text(text) if in_text => current.push_str(&text.unescape().map_err(xml_error(part))?),
+            Event::CData(text) if in_text => current.push_str(&String::from_utf8_lossy(&text)),
+            Event::End(e) => match e.local_name().as_ref() {
+                b"si" => {
+                    bytes += size_of::<String>() + current.len();
+                    strings.push(std::mem::take(&mut current));
+                }
+                b"t" => in_text = false,
+                b"rPh" => in_phonetic = false,
+                _ => {}
+            },
+            Event::Eof => break,
+            _ => {}
+        }
+        buf.clear();
+    }
+    Ok(strings)
+}
+
+// Zero-based column of an "AB12"-style cell reference; references past
+// `MAX_COLUMNS` all give `MAX_COLUMNS`, however many letters they have.
+fn column_index(reference: &str) -> Option<usize> {
+    let letters = reference.bytes().take_while(u8::is_ascii_alphabetic);
+    let mut column = 0usize;
+    let mut any = false;
+    for letter in letters {
+        column = (column * 26 + usize::from(letter.to_ascii_uppercase() - b'A' + 1)).min(MAX_COLUMNS + 1);
+        any = true;
+    }
+    any.then(|| column - 1)
+}
+
+// Streams `<sheetData>`, handing each complete row to the table reader.
+fn read_worksheet<R: BufRead>(
+    input: R,
+    part: &str,
+    shared_strings: &[String],
+    table: &mut TableReader,
+) -> Result<(), ImportError> {
+    let mut reader = Reader::from_reader(input);
+    let mut buf = Vec::new();
+    let mut cells: Vec<String> = Vec::new();
+    let mut row = 0;
+    let mut column = 0;
+    let mut cell_type: Option<String> = None;
+    let mut value = String::new();
+    let mut in_value = false;
+
+    loop {
+        match reader.read_event_into(&mut buf).map_err(xml_error(part))? {
+            Event::Start(e) if e.local_name().as_ref() == b"row" => {
+                row = attribute(&e, b"r").and_then(|r| r.parse().ok()).unwrap_or(row + 1);
+                cells.clear();
+                column = 0;
+            }
+            Event::Empty(e) if e.local_name().as_ref() == b"row" => {
+                row = attribute(&e, b"r").and_then(|r| r.parse().ok()).unwrap_or(row + 1);
+            }
+            Event::Start(e) if e.local_name().as_ref() == b"c" => {
+                column = attribute(&e, b"r").as_deref().and_then(column_index).unwrap_or(column);
+                cell_type = attribute(&e, b"t");
+                value.clear();
+            }
+            Event::Empty(e) if e.local_name().as_ref() == b"c" => {
+                column = (attribute(&e, b"r").as_deref().and_then(column_index).unwrap_or(column) + 1).min(MAX_COLUMNS);
+            }
+            Event::Start(e) if matches!(e.local_name().as_ref(), b"v" | b"t") => in_value = true,
+            Event::Text(text) if in_value => value.push_str(&text.unescape().map_err(xml_error(part))?),
+            Event::CData(text) if in_value => value.push_str(&String::from_utf8_lossy(&text)),
+            Event::End(e) => match e.local_name().as_ref() {
+                b"v" | b"t" => in_value = false,
+                b"c" => {
+                    let text = match cell_type.as_deref() {
+                        Some("s") => value
+                            .trim()
+                            .parse::<usize>()
+                            .ok()
+                            .and_then(|index| shared_strings.get(index))
+                            .cloned()
+                            .unwrap_or_default(),
+                        // Numbers are stored as "1234.5"; written with a decimal
+                        // comma they cannot be misread as thousands by the
+                        // Italian amount parser.
+                        None | Some("n") => match value.trim().parse::<f64>() {
+                            Ok(number) => number.to_string().replace('.', ","),
+                            Err(_) => std::mem::take(&mut value),
+                        },
+                        _ => std::mem::take(&mut value),
+                    };
+                    if column < MAX_COLUMNS {
+                        if cells.len() <= column {
+                            cells.resize(column + 1, String::new());
+                        }
+                        cells[column] = text;
+                    }
+                    column = (column + 1).min(MAX_COLUMNS);
+                }
+                b"row" => table.push_row(row, &cells),
+                _ => {}
+            },
+            Event::Eof => break,
+            _ => {}
+        }
+        buf.clear();
+    }
+    Ok(())
+}
+
+// Minimal RFC 4180 reader: quoted fields (with "" escapes and embedded
+// newlines), separator detected on the first line among ';', ',' and tab.
+struct CsvReader<R> {
+    input: R,
+    separator: Option<char>,
+    line: usize,
+    buffer: String,
+}
+
+impl<R: BufRead> CsvReader<R> {
+    fn new(input: R) -> Self {
+        CsvReader { input, separator: None, line: 0, buffer: String::new() }
+    }
+
+    fn read_line(&mut self) -> io::Result<bool> {
+        let mut bytes = Vec::new();
+        if self.input.read_until(b'\n', &mut bytes)? == 0 {
+            return Ok(false);
+        }
+        self.line += 1;
+        let text = String::from_utf8_lossy(&bytes);
+        let text = if self.line == 1 { text.trim_start_matches('\u{feff}') } else { &text };
+        self.buffer = text.trim_end_matches(['\n', '\r']).to_string();
+        Ok(true)
+    }
+
+    // Fills `record` with the next record's fields; returns its first line number.
+    fn read_record(&mut self, record: &mut Vec<String>) -> io::Result<Option<usize>> {
+        if !self.read_line()? {
+            return Ok(None);
+        }
+        let first_line = self.line;
+        let separator = *self.separator.get_or_insert_with(|| detect_separator(&self.buffer));
+
+        record.clear();
+        let mut field = String::new();
+        let mut quoted = false;
+        loop {
+            let mut chars = self.buffer.chars().peekable();
+            while let Some(c) = chars.next() {
+                match c {
+                    '"' if quoted && chars.peek() == Some(&'"') => {
+                        field.push('"');
+                        chars.next();
+                    }
+                    '"' if quoted => quoted = false,
+                    '"' if field.trim().is_empty() => {
+                        field.clear();
+                        quoted = true;
+                    }
+                    c if c == separator && !quoted => record.push(std::mem::take(&mut field)),
+                    c => field.push(c),
+                }
+            }
+            if !quoted || !self.read_line()? {
+                break;
+            }
+            field.push('\n');
+        }
+        record.push(field);
+        Ok(Some(first_line))
+    }
+}
+
+pub(crate) fn detect_separator(line: &str) -> char {
+    [';', '\t', ',']
+        .into_iter()
+        .max_by_key(|separator| line.matches(*separator).count())
+        .filter(|separator| line.contains(*separator))
+        .unwrap_or(',')
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    const DEMO_SHEET: &str = r#"<worksheet><sheetData>
+        <row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>2</v></c></row>
+        <row r="2"><c r="A2"><v>31</v></c><c r="B2" t="s"><v>3</v></c><c r="C2"><v>120000</v></c></row>
+        <row r="3"><c r="A3"><v>80</v></c><c r="C3"><v>4500.5</v></c></row>
+        <row r="4"><c r="B4" t="inlineStr"><is><t>Totale</t></is></c><c r="C4"><v>1</v></c></row>
+    </sheetData></worksheet>"#;
+
+    fn import_table(sheet: &str, rows: &[&[&str]]) -> ImportReport {
+        let resolver = PositionResolver::default();
+        let mut table = TableReader::new(0, sheet, &resolver);
+        for (i, row) in rows.iter().enumerate() {
+            let cells: Vec<String> = row.iter().map(|c| c.to_string()).collect();
+            table.push_row(i + 1, &cells);
+        }
+        merge_sheets(vec![table.finish()], &[sheet])
+    }
+
+    #[test]
+    fn resolves_keys_and_names() {
+        let resolver = PositionResolver::default();
+        assert_eq!(resolver.resolve("31"), Some("31"));
+        assert_eq!(resolver.resolve("pos_39.NCA"), Some("39.NCA"));
+        assert_eq!(resolver.resolve("debiti TRIBUTARI"), Some("85"));
+        assert_eq!(resolver.resolve("Crediti verso clienti (oltre 12 mesi)"), Some("39.NCA"));
+        // "Debiti verso banche" is both 73 and 80: ambiguous without the parenthetical.
+        assert_eq!(resolver.resolve("Debiti verso banche"), None);
+        assert_eq!(resolver.resolve("Capitale"), None);
+    }
+
+    #[test]
+    fn streams_worksheet_in_demo_layout() {
+        let shared: Vec<String> = ["Voce", "Descrizione", "Importo (€)", "Materie prime"].map(String::from).to_vec();
+        let resolver = PositionResolver::default();
+        let mut table = TableReader::new(0, "Rimanenze", &resolver);
+        read_worksheet(DEMO_SHEET.as_bytes(), "sheet1.xml", &shared, &mut table).unwrap();
+        let report = merge_sheets(vec![table.finish()], &["Rimanenze"]);
+
+        assert_eq!(report.sheets.len(), 1);
+        let sheet = &report.sheets[0];
+        assert_eq!((sheet.company.as_deref(), sheet.year.as_deref()), (None, None));
+        assert_eq!(sheet.data.get("31"), Some(&120000.0));
+        assert_eq!(sheet.data.get("80"), Some(&4500.5));
+        assert_eq!(report.errors.len(), 1);
+        assert_eq!((report.errors[0].sheet.as_str(), report.errors[0].row), ("Rimanenze", 4));
+    }
+
+    #[test]
+    fn bounds_columns_and_shared_strings() {
+        assert_eq!(column_index("A1"), Some(0));
+        assert_eq!(column_index("XFD7"), Some(MAX_COLUMNS - 1));
+        assert_eq!(column_index("ZZZZZZZZZZ1"), Some(MAX_COLUMNS));
+        assert_eq!(column_index(&format!("{}1", "Z".repeat(40))), Some(MAX_COLUMNS));
+
+        let sheet = r#"<worksheet><sheetData>
+            <row r="1"><c r="A1" t="inlineStr"><is><t>Voce</t></is></c><c r="B1" t="inlineStr"><is><t>Importo</t></is></c></row>
+            <row r="2"><c r="A2"><v>49</v></c><c r="B2"><v>100</v></c><c r="ZZZZZZZZZZ2"><v>1</v></c><c><v>2</v></c></row>
+        </sheetData></worksheet>"#;
+        let resolver = PositionResolver::default();
+        let mut table = TableReader::new(0, "Foglio1", &resolver);
+        read_worksheet(sheet.as_bytes(), "sheet1.xml", &[], &mut table).unwrap();
+        let report = merge_sheets(vec![table.finish()], &["Foglio1"]);
+        assert_eq!(report.sheets[0].data.get("49"), Some(&100.0));
+
+        let strings = "<sst><si><t>Voce</t></si><si><t>Importo</t></si></sst>";
+        assert_eq!(read_shared_strings(strings.as_bytes(), 1024).unwrap(), ["Voce", "Importo"]);
+        assert!(matches!(read_shared_strings(strings.as_bytes(), 40), Err(ImportError::SharedStringsTooLarge(40))));
+    }
+
+    #[test]
+    fn long_layout_with_one_column_per_year() {
+        let report = import_table(
+            "Bilancio",
+            &[
+                &["Azienda", "Voce", "2022", "2023"],
+                &["Alfa", "49", "100", "150"],
+                &["Alfa", "Debiti tributari", "10", "abc"],
+                &["Beta", "49", "", "70"],
+            ],
+        );
+        let keys: Vec<(Option<&str>, Option<&str>)> =
+            report.sheets.iter().map(|s| (s.company.as_deref(), s.year.as_deref())).collect();
+        assert_eq!(keys, [(Some("Alfa"), Some("2022")), (Some("Alfa"), Some("2023")), (Some("Beta"), Some("2023"))]);
+        assert_eq!(report.sheets[1].data.get("49"), Some(&150.0));
+        assert_eq!(report.errors.len(), 1);
+        assert_eq!(report.errors[0].row, 3);
+        assert!(report.errors[0].message.starts_with("Posizione 85:"));
+    }
+
+    #[test]
+    fn wide_layout_with_one_row_per_company() {
+        let csv = "Società;Anno;pos_49;Debiti tributari\nAlfa;2023;100;20\n\"Beta; S.p.A.\";2023;50;\n";
+        let report = import_csv(csv.as_bytes(), "export.csv", &PositionResolver::default()).unwrap();
+        assert_eq!(report.errors, []);
+        assert_eq!(report.sheets.len(), 2);
+        assert_eq!(report.sheets[1].company.as_deref(), Some("Beta; S.p.A."));
+        assert_eq!(report.sheets[0].data.get("85"), Some(&20.0));
+        assert_eq!(report.sheets[1].form_data.get("pos_49").map(String::as_str), Some("50"));
+    }
+
+    #[test]
+    fn csv_quoted_fields_span_lines() {
+        let mut csv = CsvReader::new("a,\"b \"\"x\"\"\nc\",d\n".as_bytes());
+        let mut record = Vec::new();
+        assert_eq!(csv.read_record(&mut record).unwrap(), Some(1));
+        assert_eq!(record, ["a", "b \"x\"\nc", "d"]);
+        assert_eq!(csv.read_record(&mut record).unwrap(), None);
+    }
+}
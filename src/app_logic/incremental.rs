@@ -0,0 +1,206 @@
+use crate::app_logic::calculator::{BalanceCheck, KpiResult, ASSET_SIDE, LIABILITIES_EQUITY_SIDE};
+use crate::app_logic::kpi_plan::{expression_value, KpiPlan};
+use crate::app_logic::positions::{BalanceSheet, PositionId, PositionSet, POSITION_COUNT};
+
+// Sum kept up to date by deltas. Counting the non-zero addends lets a sum
+// whose inputs are all back to zero be exactly zero again, so rounding left
+// over from earlier deltas never turns a "zero denominator" into a huge ratio.
+#[derive(Debug, Clone, Copy, Default)]
+struct RunningSum {
+    value: f64,
+    non_zero: u32,
+}
+
+impl RunningSum {
+    fn replace(&mut self, old: f64, new: f64) {
+        self.non_zero = self.non_zero + u32::from(new != 0.0) - u32::from(old != 0.0);
+        self.value = if self.non_zero == 0 { 0.0 } else { self.value + (new - old) };
+    }
+}
+
+// A balance sheet edited one field at a time. Group subtotals, expressions
+// and KPI results are kept in memory; an inverted index (position -> groups
+// -> expressions -> KPIs) built from the compiled plan limits each edit to
+// the subtotals and KPIs that actually read the changed position.
+pub struct LiveSheet {
+    plan: KpiPlan,
+    sheet: BalanceSheet,
+    groups: Vec<RunningSum>,
+    expressions: Vec<f64>,
+    results: Vec<KpiResult>,
+    position_groups: Vec<Vec<usize>>,
+    group_expressions: Vec<Vec<usize>>,
+    expression_kpis: Vec<Vec<usize>>,
+    asset_side: PositionSet,
+    liabilities_equity_side: PositionSet,
+    assets: RunningSum,
+    liabilities_equity: RunningSum,
+    // Positions given a value so far, even an unchanged one.
+    submitted: PositionSet,
+}
+
+impl LiveSheet {
+    pub fn new<K: AsRef<str>>(kpi_keys: &[K]) -> Self {
+        let plan = KpiPlan::compile(kpi_keys);
+
+        let mut position_groups = vec![Vec::new(); POSITION_COUNT];
+        for (slot, group) in plan.groups().iter().enumerate() {
+            for id in group.positions() {
+                position_groups[*id].push(slot);
+            }
+        }
+        let mut group_expressions = vec![Vec::new(); plan.groups().len()];
+        for (slot, expression) in plan.expressions().iter().enumerate() {
+            for (_, group) in expression {
+                if !group_expressions[*group].contains(&slot) {
+                    group_expressions[*group].push(slot);
+                }
+            }
+        }
+        let mut expression_kpis = vec![Vec::new(); plan.expressions().len()];
+        for (index, kpi) in plan.kpis().iter().enumerate() {
+            if kpi.definition.is_none() {
+                continue;
+            }
+            expression_kpis[kpi.numerator].push(index);
+            if let Some(denominator) = kpi.denominator.filter(|d| *d != kpi.numerator) {
+                expression_kpis[denominator].push(index);
+            }
+        }
+
+        let sheet = BalanceSheet::new();
+        let results = plan.evaluate(&sheet);
+        LiveSheet {
+            groups: vec![RunningSum::default(); plan.groups().len()],
+            expressions: vec![0.0; plan.expressions().len()],
+            results,
+            position_groups,
+            group_expressions,
+            expression_kpis,
+            asset_side: ASSET_SIDE.iter().copied().collect(),
+            liabilities_equity_side: LIABILITIES_EQUITY_SIDE.iter().copied().collect(),
+            assets: RunningSum::default(),
+            liabilities_equity: RunningSum::default(),
+            submitted: PositionSet::default(),
+            plan,
+            sheet,
+        }
+    }
+
+    // Sets one position and returns the indices (in the order the KPI keys
+    // were given) of the KPIs whose result changed.
+    pub fn set(&mut self, id: PositionId, value: f64) -> Vec<usize> {
+        self.submitted.insert(id);
+        let old = self.sheet.get(id);
+        if old == value {
+            return Vec::new();
+        }
+        self.sheet.set(id, value);
+        if self.asset_side.contains(id) {
+            self.assets.replace(old, value);
+        } else if self.liabilities_equity_side.contains(id) {
+            self.liabilities_equity.replace(old, value);
+        }
+
+        let mut touched_expressions = Vec::new();
+        for &group in &self.position_groups[id] {
+            self.groups[group].replace(old, value);
+            for &expression in &self.group_expressions[group] {
+                if !touched_expressions.contains(&expression) {
+                    touched_expressions.push(expression);
+                }
+            }
+        }
+
+        let group_values: Vec<f64> = self.groups.iter().map(|sum| sum.value).collect();
+        let mut touched_kpis = Vec::new();
+        for &expression in &touched_expressions {
+            self.expressions[expression] = expression_value(&self.plan.expressions()[expression], &group_values);
+            for &kpi in &self.expression_kpis[expression] {
+                if !touched_kpis.contains(&kpi) {
+                    touched_kpis.push(kpi);
+                }
+            }
+        }
+
+        touched_kpis.sort_unstable();
+        touched_kpis.retain(|&index| {
+            let result = self.plan.kpis()[index].evaluate(&self.expressions);
+            let changed = result.value != self.results[index].value || result.status != self.results[index].status;
+            self.results[index] = result;
+            changed
+        });
+        touched_kpis
+    }
+
+    pub fn results(&self) -> &[KpiResult] {
+        &self.results
+    }
+
+    pub fn sheet(&self) -> &BalanceSheet {
+        &self.sheet
+    }
+
+    // Same rule as `PositionForm::balance_check`: None until each of `inputs`
+    // has been set, since a partial sheet would always look unbalanced.
+    pub fn balance_check(&self, inputs: PositionSet) -> Option<BalanceCheck> {
+        inputs
+            .difference(self.submitted)
+            .is_empty()
+            .then(|| BalanceCheck::from_totals(self.assets.value, self.liabilities_equity.value))
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::calculator::{validate_balance_sheet, KpiStatus};
+    use crate::app_logic::kpi_config::KPI_DEFINITIONS;
+    use crate::app_logic::positions::pos;
+
+    #[test]
+    fn edits_match_full_recalculation() {
+        let keys: Vec<&str> = KPI_DEFINITIONS.iter().map(|d| d.key).collect();
+        let mut live = LiveSheet::new(&keys);
+        let edits = [(31, 1200.5), (49, 300.0), (80, 700.25), (52, 900.0), (31, 0.0), (100, 45.0), (5, 60.0)];
+        for (number, value) in edits {
+            live.set(pos(number), value);
+        }
+
+        let expected = KpiPlan::compile(&keys).evaluate(live.sheet());
+        for (actual, expected) in live.results().iter().zip(&expected) {
+            assert_eq!(actual.status, expected.status);
+            match (actual.value, expected.value) {
+                (Some(a), Some(e)) => assert!((a - e).abs() <= 1e-9 * e.abs().max(1.0)),
+                (a, e) => assert_eq!(a, e),
+            }
+        }
+        let inputs: PositionSet = edits.iter().map(|(number, _)| pos(*number)).collect();
+        assert_eq!(live.balance_check(inputs), Some(validate_balance_sheet(live.sheet())));
+        let mut missing = inputs;
+        missing.insert(pos(1));
+        assert_eq!(live.balance_check(missing), None);
+        live.set(pos(1), 0.0);
+        assert_eq!(live.balance_check(missing), Some(validate_balance_sheet(live.sheet())));
+    }
+
+    #[test]
+    fn only_dependent_kpis_are_reported() {
+        let mut live = LiveSheet::new(&["current_ratio", "debt_to_equity", "cash_ratio"]);
+        live.set(pos(79), 100.0);
+        // Cash feeds current and cash ratio, not debt_to_equity.
+        assert_eq!(live.set(pos(50), 25.0), [0, 2]);
+        assert_eq!(live.set(pos(50), 25.0), Vec::<usize>::new());
+    }
+
+    #[test]
+    fn zero_denominator_survives_rounding() {
+        let mut live = LiveSheet::new(&["current_ratio"]);
+        live.set(pos(31), 1.0);
+        live.set(pos(79), 0.1);
+        live.set(pos(80), 0.2);
+        live.set(pos(79), 0.0);
+        live.set(pos(80), 0.0);
+        assert_eq!(live.results()[0].status, KpiStatus::ZeroCurrentLiabilities);
+    }
+}
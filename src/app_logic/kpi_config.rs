@@ -1,6 +1,9 @@
 use std::collections::BTreeMap;
 use serde::{Serialize, Deserialize};
 
+use crate::app_logic::calculator::KpiStatus;
+use crate::app_logic::positions::{pos, span, PositionId};
+
 #[derive(Debug, Clone, Serialize, Deserialize)]
 pub struct KpiTooltipInfo {
     pub full_explanation: String,
@@ -323,3 +326,165 @@ pub fn get_available_kpis() -> BTreeMap<String, KpiDetails> {
 
     kpis
 }
+
+// Position groups the KPI formulas are written in.
+#[derive(Debug, Clone, Copy, PartialEq, Eq, PartialOrd, Ord, Hash)]
+pub enum PositionGroup {
+    CurrentAssets,
+    LiquidAssets,
+    Cash,
+    CurrentLiabilities,
+    TotalLiabilities,
+    TotalEquity,
+    NonCurrentAssets,
+    IntangibleAssets,
+    LongTermDebt,
+    CurrentFinancialAssets,
+    Tfr,
+    SocialSecurityDebt,
+    TotalAssets,
+}
+
+const CURRENT_ASSETS: [PositionId; 17] = [
+    pos(31), pos(32), pos(33), pos(34), pos(35), pos(39), pos(40), pos(41), pos(42),
+    pos(43), pos(44), pos(45), pos(46), pos(47), pos(48), pos(49), pos(50),
+];
+const LIQUID_ASSETS: [PositionId; 6] = [pos(39), pos(40), pos(41), pos(42), pos(43), pos(45)];
+const CASH: [PositionId; 2] = span(49);
+const CURRENT_LIABILITIES: [PositionId; 10] = span(79);
+const TOTAL_LIABILITIES: [PositionId; 23] = [
+    pos(67), pos(68), pos(69), pos(100), pos(70), pos(71), pos(72), pos(73), pos(74), pos(75),
+    pos(76), pos(77), pos(78), pos(79), pos(80), pos(81), pos(82), pos(83), pos(84), pos(85),
+    pos(86), pos(87), pos(88),
+];
+const TOTAL_EQUITY: [PositionId; 11] = [
+    pos(52), pos(53), pos(54), pos(55), pos(56), pos(57), pos(58), pos(59), pos(64), pos(65), pos(66),
+];
+const NON_CURRENT_ASSETS: [PositionId; 30] = span(1);
+const INTANGIBLE_ASSETS: [PositionId; 10] = span(1);
+const LONG_TERM_DEBT: [PositionId; 9] = span(70);
+const CURRENT_FINANCIAL_ASSETS: [PositionId; 3] = span(46);
+const TFR: [PositionId; 1] = [pos(100)];
+const SOCIAL_SECURITY_DEBT: [PositionId; 1] = [pos(86)];
+const TOTAL_ASSETS: [PositionId; 50] = span(1);
+
+impl PositionGroup {
+    pub fn positions(self) -> &'static [PositionId] {
+        match self {
+            PositionGroup::CurrentAssets => &CURRENT_ASSETS,
+            PositionGroup::LiquidAssets => &LIQUID_ASSETS,
+            PositionGroup::Cash => &CASH,
+            PositionGroup::CurrentLiabilities => &CURRENT_LIABILITIES,
+            PositionGroup::TotalLiabilities => &TOTAL_LIABILITIES,
+            PositionGroup::TotalEquity => &TOTAL_EQUITY,
+            PositionGroup::NonCurrentAssets => &NON_CURRENT_ASSETS,
+            PositionGroup::IntangibleAssets => &INTANGIBLE_ASSETS,
+            PositionGroup::LongTermDebt => &LONG_TERM_DEBT,
+            PositionGroup::CurrentFinancialAssets => &CURRENT_FINANCIAL_ASSETS,
+            PositionGroup::Tfr => &TFR,
+            PositionGroup::SocialSecurityDebt => &SOCIAL_SECURITY_DEBT,
+            PositionGroup::TotalAssets => &TOTAL_ASSETS,
+        }
+    }
+}
+
+// One signed group inside a numerator or denominator expression.
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub struct Term {
+    pub coefficient: f64,
+    pub group: PositionGroup,
+}
+
+const fn plus(group: PositionGroup) -> Term {
+    Term { coefficient: 1.0, group }
+}
+
+const fn minus(group: PositionGroup) -> Term {
+    Term { coefficient: -1.0, group }
+}
+
+// A KPI is `numerator / denominator`, or just `numerator` for absolute values.
+// `zero_status` is reported when the denominator sums to zero.
+#[derive(Debug, Clone, Copy)]
+pub struct KpiDefinition {
+    pub key: &'static str,
+    pub numerator: &'static [Term],
+    pub denominator: Option<&'static [Term]>,
+    pub zero_status: KpiStatus,
+    pub optimal_range: OptimalRange,
+    pub crisis_threshold: Option<CrisisThreshold>,
+}
+
+// Numeric reading of `optimal_range_cee`: the general (or "accettabile") band.
+#[derive(Debug, Clone, Copy, PartialEq, Serialize)]
+pub struct OptimalRange {
+    pub min: Option<f64>,
+    pub max: Option<f64>,
+}
+
+impl OptimalRange {
+    pub fn contains(&self, value: f64) -> bool {
+        self.min.map_or(true, |min| value >= min) && self.max.map_or(true, |max| value <= max)
+    }
+
+    pub fn bounds(&self) -> impl Iterator<Item = f64> {
+        self.min.into_iter().chain(self.max)
+    }
+}
+
+// Level past which a crisis-law KPI signals distress (`is_crisis_law_kpi`).
+#[derive(Debug, Clone, Copy, PartialEq, Serialize)]
+#[serde(rename_all = "snake_case")]
+pub enum CrisisThreshold {
+    Above(f64),
+    Below(f64),
+}
+
+impl CrisisThreshold {
+    pub fn is_breached(&self, value: f64) -> bool {
+        match *self {
+            CrisisThreshold::Above(limit) => value > limit,
+            CrisisThreshold::Below(limit) => value < limit,
+        }
+    }
+}
+
+const fn between(min: f64, max: f64) -> OptimalRange {
+    OptimalRange { min: Some(min), max: Some(max) }
+}
+
+const fn at_least(min: f64) -> OptimalRange {
+    OptimalRange { min: Some(min), max: None }
+}
+
+const fn at_most(max: f64) -> OptimalRange {
+    OptimalRange { min: None, max: Some(max) }
+}
+
+use PositionGroup::*;
+
+pub static KPI_DEFINITIONS: [KpiDefinition; 19] = [
+    KpiDefinition { key: "current_ratio", numerator: &[plus(CurrentAssets)], denominator: Some(&[plus(CurrentLiabilities)]), zero_status: KpiStatus::ZeroCurrentLiabilities, optimal_range: between(1.2, 2.0), crisis_threshold: None },
+    KpiDefinition { key: "quick_ratio", numerator: &[plus(LiquidAssets)], denominator: Some(&[plus(CurrentLiabilities)]), zero_status: KpiStatus::ZeroCurrentLiabilities, optimal_range: between(0.8, 1.2), crisis_threshold: None },
+    KpiDefinition { key: "cash_ratio", numerator: &[plus(Cash)], denominator: Some(&[plus(CurrentLiabilities)]), zero_status: KpiStatus::ZeroCurrentLiabilities, optimal_range: between(0.2, 0.5), crisis_threshold: None },
+    KpiDefinition { key: "debt_to_equity", numerator: &[plus(TotalLiabilities)], denominator: Some(&[plus(TotalEquity)]), zero_status: KpiStatus::ZeroEquity, optimal_range: at_most(2.0), crisis_threshold: Some(CrisisThreshold::Above(2.0)) },
+    KpiDefinition { key: "debt_ratio", numerator: &[plus(TotalLiabilities)], denominator: Some(&[plus(TotalAssets)]), zero_status: KpiStatus::ZeroTotalAssets, optimal_range: at_most(0.7), crisis_threshold: None },
+    KpiDefinition { key: "working_capital", numerator: &[plus(CurrentAssets), minus(CurrentLiabilities)], denominator: None, zero_status: KpiStatus::Ok, optimal_range: at_least(0.0), crisis_threshold: None },
+    KpiDefinition { key: "asset_rigidity_index", numerator: &[plus(NonCurrentAssets)], denominator: Some(&[plus(TotalAssets)]), zero_status: KpiStatus::ZeroTotalAssets, optimal_range: between(0.3, 0.6), crisis_threshold: None },
+    KpiDefinition { key: "asset_elasticity_index", numerator: &[plus(CurrentAssets)], denominator: Some(&[plus(TotalAssets)]), zero_status: KpiStatus::ZeroTotalAssets, optimal_range: between(0.4, 0.7), crisis_threshold: None },
+    KpiDefinition { key: "fixed_asset_coverage_ratio", numerator: &[plus(TotalEquity)], denominator: Some(&[plus(NonCurrentAssets)]), zero_status: KpiStatus::ZeroNonCurrentAssets, optimal_range: at_least(0.5), crisis_threshold: None },
+    KpiDefinition { key: "tax_social_debt_on_assets_ratio", numerator: &[plus(Tfr), plus(SocialSecurityDebt)], denominator: Some(&[plus(TotalAssets)]), zero_status: KpiStatus::ZeroTotalAssets, optimal_range: at_most(0.1), crisis_threshold: Some(CrisisThreshold::Above(0.2)) },
+    KpiDefinition { key: "tangible_net_worth", numerator: &[plus(TotalEquity), minus(IntangibleAssets)], denominator: None, zero_status: KpiStatus::Ok, optimal_range: at_least(0.0), crisis_threshold: None },
+    KpiDefinition { key: "equity_multiplier", numerator: &[plus(TotalAssets)], denominator: Some(&[plus(TotalEquity)]), zero_status: KpiStatus::ZeroEquity, optimal_range: between(1.5, 3.0), crisis_threshold: None },
+    KpiDefinition { key: "long_term_debt_to_equity", numerator: &[plus(LongTermDebt)], denominator: Some(&[plus(TotalEquity)]), zero_status: KpiStatus::ZeroEquity, optimal_range: at_most(2.0), crisis_threshold: None },
+    KpiDefinition { key: "intangible_assets_ratio", numerator: &[plus(IntangibleAssets)], denominator: Some(&[plus(TotalAssets)]), zero_status: KpiStatus::ZeroTotalAssets, optimal_range: at_most(0.2), crisis_threshold: None },
+    KpiDefinition { key: "financial_assets_ratio", numerator: &[plus(CurrentFinancialAssets)], denominator: Some(&[plus(TotalAssets)]), zero_status: KpiStatus::ZeroTotalAssets, optimal_range: at_most(0.3), crisis_threshold: None },
+    KpiDefinition { key: "non_current_assets_coverage", numerator: &[plus(TotalEquity), plus(LongTermDebt)], denominator: Some(&[plus(NonCurrentAssets)]), zero_status: KpiStatus::ZeroNonCurrentAssets, optimal_range: at_least(1.0), crisis_threshold: None },
+    KpiDefinition { key: "net_working_capital_ratio", numerator: &[plus(CurrentAssets), minus(CurrentLiabilities)], denominator: Some(&[plus(TotalAssets)]), zero_status: KpiStatus::ZeroTotalAssets, optimal_range: between(0.1, 0.3), crisis_threshold: None },
+    KpiDefinition { key: "debt_to_equity_excl_tfr", numerator: &[plus(TotalLiabilities), minus(Tfr)], denominator: Some(&[plus(TotalEquity)]), zero_status: KpiStatus::ZeroEquity, optimal_range: at_most(2.0), crisis_threshold: Some(CrisisThreshold::Above(2.0)) },
+    KpiDefinition { key: "debt_ratio_excl_tfr", numerator: &[plus(TotalLiabilities), minus(Tfr)], denominator: Some(&[plus(TotalAssets)]), zero_status: KpiStatus::ZeroTotalAssets, optimal_range: at_most(0.7), crisis_threshold: Some(CrisisThreshold::Above(0.7)) },
+];
+
+pub fn get_kpi_definition(key: &str) -> Option<&'static KpiDefinition> {
+    KPI_DEFINITIONS.iter().find(|definition| definition.key == key)
+}
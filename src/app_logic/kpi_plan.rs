@@ -0,0 +1,147 @@
+use crate::app_logic::calculator::{KpiResult, KpiStatus};
+use crate::app_logic::kpi_config::{get_kpi_definition, KpiDefinition, PositionGroup, Term};
+use crate::app_logic::positions::{BalanceSheet, PositionSet};
+
+// Evaluation DAG compiled from the declarative KPI definitions:
+// positions -> group sums -> numerator/denominator expressions -> KPIs.
+// Each group and each distinct expression is a single node, so it is
+// evaluated once per request whatever subset of KPIs is selected.
+#[derive(Debug, Clone, Default)]
+pub struct KpiPlan {
+    groups: Vec<PositionGroup>,
+    expressions: Vec<Expression>,
+    kpis: Vec<PlannedKpi>,
+}
+
+// Linear combination of group nodes: (coefficient, group slot).
+pub type Expression = Vec<(f64, usize)>;
+
+#[derive(Debug, Clone, Copy)]
+pub struct PlannedKpi {
+    pub definition: Option<&'static KpiDefinition>,
+    pub numerator: usize,
+    pub denominator: Option<usize>,
+}
+
+impl PlannedKpi {
+    pub fn zero_status(&self) -> KpiStatus {
+        self.definition.map_or(KpiStatus::UndefinedKpi, |definition| definition.zero_status)
+    }
+}
+
+impl KpiPlan {
+    pub fn compile<K: AsRef<str>>(kpi_keys: &[K]) -> Self {
+        let mut plan = KpiPlan::default();
+        for key in kpi_keys {
+            let planned = match get_kpi_definition(key.as_ref()) {
+                Some(definition) => PlannedKpi {
+                    definition: Some(definition),
+                    numerator: plan.expression_node(definition.numerator),
+                    denominator: definition.denominator.map(|terms| plan.expression_node(terms)),
+                },
+                None => PlannedKpi { definition: None, numerator: usize::MAX, denominator: None },
+            };
+            plan.kpis.push(planned);
+        }
+        plan
+    }
+
+    fn group_node(&mut self, group: PositionGroup) -> usize {
+        match self.groups.iter().position(|g| *g == group) {
+            Some(slot) => slot,
+            None => {
+                self.groups.push(group);
+                self.groups.len() - 1
+            }
+        }
+    }
+
+    fn expression_node(&mut self, terms: &[Term]) -> usize {
+        let expression: Expression = terms
+            .iter()
+            .map(|term| (term.coefficient, self.group_node(term.group)))
+            .collect();
+        match self.expressions.iter().position(|e| *e == expression) {
+            Some(slot) => slot,
+            None => {
+                self.expressions.push(expression);
+                self.expressions.len() - 1
+            }
+        }
+    }
+
+    pub fn groups(&self) -> &[PositionGroup] {
+        &self.groups
+    }
+
+    pub fn expressions(&self) -> &[Expression] {
+        &self.expressions
+    }
+
+    pub fn kpis(&self) -> &[PlannedKpi] {
+        &self.kpis
+    }
+
+    // Every position read by at least one selected KPI.
+    pub fn required_positions(&self) -> PositionSet {
+        self.groups
+            .iter()
+            .flat_map(|group| group.positions().iter().copied())
+            .collect()
+    }
+
+    // One result per compiled KPI, in the order the keys were given.
+    pub fn evaluate(&self, sheet: &BalanceSheet) -> Vec<KpiResult> {
+        let group_values: Vec<f64> = self.groups.iter().map(|group| sheet.sum(group.positions())).collect();
+        let expression_values: Vec<f64> = self
+            .expressions
+            .iter()
+            .map(|expression| expression_value(expression, &group_values))
+            .collect();
+
+        self.kpis.iter().map(|kpi| kpi.evaluate(&expression_values)).collect()
+    }
+}
+
+pub fn expression_value(expression: &Expression, group_values: &[f64]) -> f64 {
+    expression.iter().map(|(coefficient, slot)| coefficient * group_values[*slot]).sum()
+}
+
+impl PlannedKpi {
+    pub fn evaluate(&self, expression_values: &[f64]) -> KpiResult {
+        if self.definition.is_none() {
+            return KpiResult::failed(KpiStatus::UndefinedKpi);
+        }
+        let numerator = expression_values[self.numerator];
+        match self.denominator {
+            None => KpiResult::ok(numerator),
+            Some(slot) if expression_values[slot] != 0.0 => KpiResult::ok(numerator / expression_values[slot]),
+            Some(_) => KpiResult::failed(self.zero_status()),
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::kpi_config::KPI_DEFINITIONS;
+
+    #[test]
+    fn shared_aggregates_are_single_nodes() {
+        let all: Vec<&str> = KPI_DEFINITIONS.iter().map(|d| d.key).collect();
+        let plan = KpiPlan::compile(&all);
+
+        let total_assets = plan.groups().iter().filter(|g| **g == PositionGroup::TotalAssets).count();
+        assert_eq!(total_assets, 1);
+        assert_eq!(plan.groups().len(), 13);
+        // working_capital and net_working_capital_ratio share CA - CL.
+        assert_eq!(plan.kpis()[5].numerator, plan.kpis()[16].numerator);
+    }
+
+    #[test]
+    fn requirements_follow_the_formulas() {
+        let plan = KpiPlan::compile(&["cash_ratio"]);
+        let keys: Vec<&str> = plan.required_positions().keys().collect();
+        assert_eq!(keys, ["49", "50", "79", "80", "81", "82", "83", "84", "85", "86", "87", "88"]);
+    }
+}
@@ -1,2 +1,670 @@
-// Placeholder for future mapping configurations
-// This module will handle mappings between different accounting standards
+use std::collections::{BTreeMap, HashMap};
+use std::io::{self, Read};
+use std::sync::{mpsc, Mutex};
+use std::thread;
+
+use serde::{Deserialize, Serialize};
+use thiserror::Error;
+
+use crate::app_logic::importer::{detect_separator, normalize_label, RowError};
+use crate::app_logic::positions::{pos, pos_nca, position_index, BalanceSheet, PositionId, NCA_FIRST, NCA_LAST, POSITION_COUNT};
+use crate::app_logic::validators::parse_italian_amount;
+use crate::app_logic::workers::Workers;
+
+// Ledger bytes handed to a worker at a time.
+const CHUNK_BYTES: usize = 1 << 20;
+// Row errors kept in a report; the rest are only counted.
+const MAX_REPORTED_ERRORS: usize = 1000;
+// Account codes are read as digits and letters; anything else ('.', '/',
+// spaces) is formatting.
+const ALPHABET: usize = 36;
+const NONE: u32 = u32::MAX;
+
+#[derive(Debug, Error)]
+pub enum MappingError {
+    #[error("invalid mapping file: {0}")]
+    Json(#[from] serde_json::Error),
+    #[error("rule {rule}: invalid account pattern {pattern:?}")]
+    InvalidPattern { rule: usize, pattern: String },
+    #[error("rule {rule}: unknown position {position:?}")]
+    UnknownPosition { rule: usize, position: String },
+    #[error("rule {rule}: needs either a position or \"ignore\": true")]
+    MissingPosition { rule: usize },
+    #[error("rules {first} and {second} both map the accounts starting with {prefix:?}")]
+    Overlap { first: usize, second: usize, prefix: String },
+    #[error("the ledger has no account column")]
+    MissingAccountColumn,
+    #[error("the ledger has no debit / credit or balance column")]
+    MissingAmountColumn,
+    #[error("read error: {0}")]
+    Io(#[from] io::Error),
+}
+
+// One line of the mapping file. `accounts` is a prefix of the account code
+// ("15" is every account starting with 15) or an inclusive range of
+// equally long numeric prefixes ("1510..1529"). The longest matching rule
+// wins, so a specific rule can carve accounts out of a general one. With
+// `ignore` the accounts are left out of the balance sheet (e.g. income
+// statement accounts) without being reported as unmapped.
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct AccountRule {
+    pub accounts: String,
+    #[serde(default)]
+    pub position: Option<String>,
+    #[serde(default)]
+    pub ignore: bool,
+}
+
+#[derive(Debug, Clone, Default, Serialize, Deserialize)]
+pub struct MappingConfig {
+    pub rules: Vec<AccountRule>,
+}
+
+#[derive(Debug, Clone, Copy, PartialEq)]
+enum Target {
+    Position {
+        id: PositionId,
+        // +1 for debit balances, -1 for credit ones.
+        sign: f64,
+        // Where the part due beyond 12 months goes, if the item is split.
+        non_current: Option<PositionId>,
+    },
+    Ignored,
+}
+
+// Positions on the assets side (including the non-current receivables) take
+// debit minus credit, equity and liabilities credit minus debit, so contra
+// accounts such as accumulated depreciation, treasury shares or a loss for
+// the year reduce the position they are mapped to.
+fn natural_sign(id: PositionId) -> f64 {
+    if id < pos(52) || id >= pos_nca(NCA_FIRST) {
+        1.0
+    } else {
+        -1.0
+    }
+}
+
+// CEE items split by maturity in `get_balance_sheet_structure`: receivables
+// 39..45 and their ".NCA" part, and the debts due within 12 months (79..84)
+// and their counterparts beyond (73..78).
+fn non_current_counterpart(id: PositionId) -> Option<PositionId> {
+    const DEBTS: [(usize, usize); 6] = [(79, 76), (80, 73), (81, 74), (82, 75), (83, 77), (84, 78)];
+    if (pos(NCA_FIRST)..=pos(NCA_LAST)).contains(&id) {
+        return Some(pos_nca(id + 1));
+    }
+    DEBTS.iter().find(|(within, _)| pos(*within) == id).map(|(_, beyond)| pos(*beyond))
+}
+
+fn symbol(byte: u8) -> Option<usize> {
+    match byte {
+        b'0'..=b'9' => Some((byte - b'0') as usize),
+        b'a'..=b'z' => Some((byte - b'a') as usize + 10),
+        b'A'..=b'Z' => Some((byte - b'A') as usize + 10),
+        _ => None,
+    }
+}
+
+fn normalize_code(code: &str) -> String {
+    code.chars().filter(char::is_ascii_alphanumeric).map(|c| c.to_ascii_uppercase()).collect()
+}
+
+// Smallest set of prefixes covering the equally long numeric prefixes
+// `low..=high`: 1510..1529 is 151 and 152, 1234..1301 is 1234..1239, 124..129
+// and 1300, 1301.
+fn range_prefixes(low: &[u8], high: &[u8], prefix: &mut Vec<u8>, out: &mut Vec<String>) {
+    if low.iter().all(|b| *b == b'0') && high.iter().all(|b| *b == b'9') {
+        out.push(String::from_utf8(prefix.clone()).expect("ASCII digits"));
+        return;
+    }
+    let (first, last) = (low[0], high[0]);
+    prefix.push(first);
+    if first == last {
+        range_prefixes(&low[1..], &high[1..], prefix, out);
+    } else {
+        let nines = vec![b'9'; low.len() - 1];
+        let zeros = vec![b'0'; low.len() - 1];
+        range_prefixes(&low[1..], &nines, prefix, out);
+        for digit in first + 1..last {
+            *prefix.last_mut().expect("pushed above") = digit;
+            out.push(String::from_utf8(prefix.clone()).expect("ASCII digits"));
+        }
+        *prefix.last_mut().expect("pushed above") = last;
+        range_prefixes(&zeros, &high[1..], prefix, out);
+    }
+    prefix.pop();
+}
+
+fn rule_prefixes(rule: usize, accounts: &str) -> Result<Vec<String>, MappingError> {
+    let invalid = || MappingError::InvalidPattern { rule, pattern: accounts.to_string() };
+    let Some((low, high)) = accounts.split_once("..") else {
+        let prefix = normalize_code(accounts);
+        return if prefix.is_empty() { Err(invalid()) } else { Ok(vec![prefix]) };
+    };
+    let (low, high) = (normalize_code(low), normalize_code(high));
+    let numeric = low.bytes().chain(high.bytes()).all(|b| b.is_ascii_digit());
+    if low.is_empty() || low.len() != high.len() || !numeric || low > high {
+        return Err(invalid());
+    }
+    let mut prefixes = Vec::new();
+    range_prefixes(low.as_bytes(), high.as_bytes(), &mut Vec::new(), &mut prefixes);
+    Ok(prefixes)
+}
+
+#[derive(Debug, Clone)]
+struct Node {
+    children: [u32; ALPHABET],
+    // Index into `targets`, or NONE.
+    target: u32,
+}
+
+impl Node {
+    const EMPTY: Node = Node { children: [NONE; ALPHABET], target: NONE };
+}
+
+// Mapping rules compiled into a trie over account code symbols: an account
+// is resolved by walking its code once, whatever the number of rules, and
+// ranges are decomposed into the prefixes that cover them.
+#[derive(Debug, Clone)]
+pub struct ChartMapping {
+    nodes: Vec<Node>,
+    // (1-based rule number, target) per rule.
+    targets: Vec<(usize, Target)>,
+}
+
+impl ChartMapping {
+    pub fn from_json(json: &[u8]) -> Result<Self, MappingError> {
+        ChartMapping::compile(&serde_json::from_slice(json)?)
+    }
+
+    pub fn compile(config: &MappingConfig) -> Result<Self, MappingError> {
+        let mut mapping = ChartMapping { nodes: vec![Node::EMPTY], targets: Vec::with_capacity(config.rules.len()) };
+        for (index, rule) in config.rules.iter().enumerate() {
+            let number = index + 1;
+            let target = match (&rule.position, rule.ignore) {
+                (_, true) => Target::Ignored,
+                (Some(position), false) => {
+                    let id = position_index(position.trim())
+                        .ok_or_else(|| MappingError::UnknownPosition { rule: number, position: position.clone() })?;
+                    Target::Position { id, sign: natural_sign(id), non_current: non_current_counterpart(id) }
+                }
+                (None, false) => return Err(MappingError::MissingPosition { rule: number }),
+            };
+            mapping.targets.push((number, target));
+            for prefix in rule_prefixes(number, &rule.accounts)? {
+                mapping.insert(&prefix, mapping.targets.len() - 1)?;
+            }
+        }
+        Ok(mapping)
+    }
+
+    fn insert(&mut self, prefix: &str, target: usize) -> Result<(), MappingError> {
+        let mut node = 0;
+        for byte in prefix.bytes() {
+            let symbol = symbol(byte).expect("prefixes are normalized");
+            if self.nodes[node].children[symbol] == NONE {
+                self.nodes[node].children[symbol] = self.nodes.len() as u32;
+                self.nodes.push(Node::EMPTY);
+            }
+            node = self.nodes[node].children[symbol] as usize;
+        }
+        let existing = self.nodes[node].target;
+        if existing != NONE {
+            let (first, second) = (self.targets[existing as usize].0, self.targets[target].0);
+            return Err(MappingError::Overlap { first, second, prefix: prefix.to_string() });
+        }
+        self.nodes[node].target = target as u32;
+        Ok(())
+    }
+
+    // Longest rule prefix of the account code. A full-level range such as
+    // "0..9" compiles to the empty prefix, so the root's target is the
+    // fallback for every code.
+    fn resolve(&self, code: &[u8]) -> Option<Target> {
+        let mut node = 0;
+        let mut found = self.nodes[0].target;
+        for symbol in code.iter().filter_map(|byte| symbol(*byte)) {
+            let child = self.nodes[node].children[symbol];
+            if child == NONE {
+                break;
+            }
+            node = child as usize;
+            if self.nodes[node].target != NONE {
+                found = self.nodes[node].target;
+            }
+        }
+        (found != NONE).then(|| self.targets[found as usize].1)
+    }
+
+    // The CEE position of an account, if a rule maps it to one.
+    pub fn position_of(&self, account: &str) -> Option<PositionId> {
+        match self.resolve(account.as_bytes())? {
+            Target::Position { id, .. } => Some(id),
+            Target::Ignored => None,
+        }
+    }
+
+    // Aggregates a general-ledger or trial-balance export (CSV, one record
+    // per line, separator detected on the header) into CEE positions. The
+    // header names the account column ("Conto", "Codice conto", "Account")
+    // and either "Dare" / "Avere" columns or a "Saldo" column, signed
+    // debit-positive or absolute with a "Segno" (D / A) column next to it.
+    // An optional "Oltre 12 mesi" column holds the part of the line's amount
+    // (signed like the position) due beyond 12 months; it goes to the
+    // ".NCA" part of a receivable, or to the matching long-term debt. The
+    // input is read as a stream and cut into chunks of whole lines that
+    // worker threads map in parallel; the partial results are merged in file
+    // order, so the totals do not depend on the number of threads.
+    pub fn aggregate<R: Read>(&self, input: R, name: &str) -> Result<LedgerReport, MappingError> {
+        self.aggregate_chunks(input, name, CHUNK_BYTES)
+    }
+
+    fn aggregate_chunks<R: Read>(&self, mut input: R, name: &str, chunk_bytes: usize) -> Result<LedgerReport, MappingError> {
+        let mut carry = Vec::new();
+        let Some(mut first) = read_chunk(&mut input, &mut carry, chunk_bytes)? else {
+            return Err(MappingError::MissingAccountColumn);
+        };
+        let header_end = first.iter().position(|b| *b == b'\n').map_or(first.len(), |end| end + 1);
+        let columns = LedgerColumns::from_header(&String::from_utf8_lossy(&first[..header_end]))?;
+        first.drain(..header_end);
+
+        // One worker to start with; another joins for each further chunk,
+        // while the shared budget has a thread free, so a small file does not
+        // take a thread per core.
+        let mut workers = Workers::acquire(1);
+        let capacity = thread::available_parallelism().map_or(1, |n| n.get());
+        let (sender, receiver) = mpsc::sync_channel::<(usize, usize, Vec<u8>)>(capacity);
+        let receiver = Mutex::new(receiver);
+        let partials = Mutex::new(Vec::new());
+        thread::scope(|scope| {
+            let (receiver, partials, columns) = (&receiver, &partials, &columns);
+            let work = move || loop {
+                let Ok((index, first_line, chunk)) = receiver.lock().unwrap().recv() else { break };
+                let partial = self.aggregate_lines(columns, &chunk, first_line, name);
+                partials.lock().unwrap().push((index, partial));
+            };
+            scope.spawn(work);
+
+            let mut next = Some(first);
+            let mut line = 2;
+            let mut index = 0;
+            while let Some(chunk) = next {
+                if index >= workers.count() && workers.try_grow() {
+                    scope.spawn(work);
+                }
+                let lines = chunk.iter().filter(|b| **b == b'\n').count();
+                if sender.send((index, line, chunk)).is_err() {
+                    break;
+                }
+                line += lines;
+                index += 1;
+                next = read_chunk(&mut input, &mut carry, chunk_bytes)?;
+            }
+            drop(sender);
+            Ok::<_, MappingError>(())
+        })?;
+
+        let mut partials = partials.into_inner().unwrap();
+        partials.sort_by_key(|(index, _)| *index);
+        let mut values = [0.0; POSITION_COUNT];
+        let mut report = LedgerReport::default();
+        let mut unmapped: BTreeMap<String, UnmappedAccount> = BTreeMap::new();
+        for (_, partial) in partials {
+            for (total, value) in values.iter_mut().zip(partial.values) {
+                *total += value;
+            }
+            report.lines += partial.lines;
+            report.mapped_lines += partial.mapped_lines;
+            report.ignored_lines += partial.ignored_lines;
+            report.error_lines += partial.error_lines;
+            let room = MAX_REPORTED_ERRORS - report.errors.len();
+            report.errors.extend(partial.errors.into_iter().take(room));
+            for (account, found) in partial.unmapped {
+                let entry = unmapped
+                    .entry(account)
+                    .or_insert_with_key(|account| UnmappedAccount { account: account.clone(), lines: 0, balance: 0.0 });
+                entry.lines += found.lines;
+                entry.balance += found.balance;
+            }
+        }
+        for (id, value) in values.into_iter().enumerate() {
+            report.positions.set(id, value);
+        }
+        report.unmapped = unmapped.into_values().collect();
+        Ok(report)
+    }
+
+    fn aggregate_lines(&self, columns: &LedgerColumns, chunk: &[u8], first_line: usize, name: &str) -> Partial {
+        let mut partial = Partial::default();
+        let mut fields: Vec<&[u8]> = Vec::with_capacity(columns.width);
+        for (offset, line) in chunk.split(|b| *b == b'\n').enumerate() {
+            let line = line.strip_suffix(b"\r").unwrap_or(line);
+            if line.iter().all(u8::is_ascii_whitespace) {
+                continue;
+            }
+            split_fields(line, columns.separator, &mut fields);
+            let account = field(&fields, Some(columns.account)).trim_ascii();
+            if !account.iter().any(u8::is_ascii_alphanumeric) {
+                continue;
+            }
+            partial.lines += 1;
+            let (balance, non_current) = match columns.amounts(&fields) {
+                Ok(amounts) => amounts,
+                Err(message) => {
+                    partial.error_lines += 1;
+                    if partial.errors.len() < MAX_REPORTED_ERRORS {
+                        partial.errors.push(RowError { sheet: name.to_string(), row: first_line + offset, message });
+                    }
+                    continue;
+                }
+            };
+            match self.resolve(account) {
+                Some(Target::Position { id, sign, non_current: counterpart }) => {
+                    partial.mapped_lines += 1;
+                    let value = sign * balance;
+                    match counterpart {
+                        Some(counterpart) if non_current != 0.0 => {
+                            partial.values[counterpart] += non_current;
+                            partial.values[id] += value - non_current;
+                        }
+                        _ => partial.values[id] += value,
+                    }
+                }
+                Some(Target::Ignored) => partial.ignored_lines += 1,
+                None => {
+                    let found = partial
+                        .unmapped
+                        .entry(String::from_utf8_lossy(account).into_owned())
+                        .or_insert(Found { lines: 0, balance: 0.0 });
+                    found.lines += 1;
+                    found.balance += balance;
+                }
+            }
+        }
+        partial
+    }
+}
+
+// An account no rule maps; `balance` is debit minus credit.
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct UnmappedAccount {
+    pub account: String,
+    pub lines: usize,
+    pub balance: f64,
+}
+
+#[derive(Debug, Clone, Default, PartialEq, Serialize)]
+pub struct LedgerReport {
+    pub positions: BalanceSheet,
+    // Lines with an account, mapped to a position, and matched by an ignore rule.
+    pub lines: usize,
+    pub mapped_lines: usize,
+    pub ignored_lines: usize,
+    // By account code.
+    pub unmapped: Vec<UnmappedAccount>,
+    // The first MAX_REPORTED_ERRORS lines that could not be read, and how
+    // many there were.
+    pub errors: Vec<RowError>,
+    pub error_lines: usize,
+}
+
+#[derive(Debug, Clone, Copy)]
+struct Found {
+    lines: usize,
+    balance: f64,
+}
+
+// What one chunk of the ledger adds up to.
+struct Partial {
+    values: [f64; POSITION_COUNT],
+    lines: usize,
+    mapped_lines: usize,
+    ignored_lines: usize,
+    unmapped: HashMap<String, Found>,
+    errors: Vec<RowError>,
+    error_lines: usize,
+}
+
+impl Default for Partial {
+    fn default() -> Self {
+        Partial {
+            values: [0.0; POSITION_COUNT],
+            lines: 0,
+            mapped_lines: 0,
+            ignored_lines: 0,
+            unmapped: HashMap::new(),
+            errors: Vec::new(),
+            error_lines: 0,
+        }
+    }
+}
+
+const ACCOUNT_HEADERS: [&str; 6] = ["conto", "codice conto", "cod conto", "sottoconto", "account", "account code"];
+const DEBIT_HEADERS: [&str; 4] = ["dare", "totale dare", "debit", "debits"];
+const CREDIT_HEADERS: [&str; 4] = ["avere", "totale avere", "credit", "credits"];
+const BALANCE_HEADERS: [&str; 4] = ["saldo", "importo", "balance", "amount"];
+const SIDE_HEADERS: [&str; 4] = ["segno", "d a", "dare avere", "side"];
+const NON_CURRENT_HEADERS: [&str; 4] = ["oltre 12 mesi", "quota oltre 12 mesi", "oltre l esercizio successivo", "non current"];
+
+#[derive(Debug)]
+struct LedgerColumns {
+    separator: u8,
+    width: usize,
+    account: usize,
+    debit: Option<usize>,
+    credit: Option<usize>,
+    balance: Option<usize>,
+    side: Option<usize>,
+    non_current: Option<usize>,
+}
+
+impl LedgerColumns {
+    fn from_header(header: &str) -> Result<Self, MappingError> {
+        let header = header.trim_start_matches('\u{feff}').trim_end_matches(['\n', '\r']);
+        let separator = detect_separator(header) as u8;
+        let mut fields = Vec::new();
+        split_fields(header.as_bytes(), separator, &mut fields);
+        let labels: Vec<String> = fields.iter().map(|label| normalize_label(&String::from_utf8_lossy(label))).collect();
+        let find = |names: &[&str]| labels.iter().position(|label| names.contains(&label.as_str()));
+
+        let columns = LedgerColumns {
+            separator,
+            width: labels.len(),
+            account: find(&ACCOUNT_HEADERS).ok_or(MappingError::MissingAccountColumn)?,
+            debit: find(&DEBIT_HEADERS),
+            credit: find(&CREDIT_HEADERS),
+            balance: find(&BALANCE_HEADERS),
+            side: find(&SIDE_HEADERS),
+            non_current: find(&NON_CURRENT_HEADERS),
+        };
+        if columns.debit.is_none() && columns.credit.is_none() && columns.balance.is_none() {
+            return Err(MappingError::MissingAmountColumn);
+        }
+        Ok(columns)
+    }
+
+    // Debit minus credit, and the part due beyond 12 months, of one line.
+    fn amounts(&self, fields: &[&[u8]]) -> Result<(f64, f64), String> {
+        let non_current = amount(fields, self.non_current, "Oltre 12 mesi")?;
+        if self.debit.is_some() || self.credit.is_some() {
+            let balance = amount(fields, self.debit, "Dare")? - amount(fields, self.credit, "Avere")?;
+            return Ok((balance, non_current));
+        }
+        let balance = amount(fields, self.balance, "Saldo")?;
+        let side = field(fields, self.side).trim_ascii();
+        let balance = match side.first().map(u8::to_ascii_uppercase) {
+            None => balance,
+            Some(b'D') => balance.abs(),
+            Some(b'A' | b'C') => -balance.abs(),
+            Some(_) => return Err(format!("Segno non valido: \"{}\" (D o A).", String::from_utf8_lossy(side))),
+        };
+        Ok((balance, non_current))
+    }
+}
+
+fn field<'a>(fields: &[&'a [u8]], column: Option<usize>) -> &'a [u8] {
+    column.and_then(|column| fields.get(column).copied()).unwrap_or_default()
+}
+
+// Blank cells are zero.
+fn amount(fields: &[&[u8]], column: Option<usize>, label: &str) -> Result<f64, String> {
+    let raw = field(fields, column);
+    if raw.iter().all(u8::is_ascii_whitespace) {
+        return Ok(0.0);
+    }
+    std::str::from_utf8(raw)
+        .ok()
+        .and_then(parse_italian_amount)
+        .ok_or_else(|| format!("Importo non valido nella colonna {label}: \"{}\".", String::from_utf8_lossy(raw).trim()))
+}
+
+// Fields of one CSV line with their surrounding quotes removed. Quoted
+// separators are honoured; "" escapes are left as they are, as the columns
+// read here (codes and amounts) never contain quotes.
+fn split_fields<'a>(line: &'a [u8], separator: u8, fields: &mut Vec<&'a [u8]>) {
+    fields.clear();
+    let mut rest = line;
+    loop {
+        let trimmed = rest.trim_ascii_start();
+        if let Some(quoted) = trimmed.strip_prefix(b"\"") {
+            let mut end = 0;
+            while end < quoted.len() {
+                match (quoted[end], quoted.get(end + 1)) {
+                    (b'"', Some(b'"')) => end += 2,
+                    (b'"', _) => break,
+                    _ => end += 1,
+                }
+            }
+            fields.push(&quoted[..end]);
+            let after = quoted.get(end + 1..).unwrap_or_default();
+            match after.iter().position(|b| *b == separator) {
+                Some(next) => rest = &after[next + 1..],
+                None => return,
+            }
+        } else {
+            match rest.iter().position(|b| *b == separator) {
+                Some(next) => {
+                    fields.push(&rest[..next]);
+                    rest = &rest[next + 1..];
+                }
+                None => {
+                    fields.push(rest);
+                    return;
+                }
+            }
+        }
+    }
+}
+
+// The next run of whole lines, of at least `chunk_bytes` unless the input
+// ends first; the partial line after it is kept in `carry` for the next call.
+fn read_chunk<R: Read>(input: &mut R, carry: &mut Vec<u8>, chunk_bytes: usize) -> io::Result<Option<Vec<u8>>> {
+    let mut chunk = std::mem::take(carry);
+    loop {
+        let read = input.by_ref().take(chunk_bytes as u64).read_to_end(&mut chunk)?;
+        if read == 0 {
+            return Ok((!chunk.is_empty()).then_some(chunk));
+        }
+        if chunk.len() >= chunk_bytes {
+            if let Some(end) = chunk.iter().rposition(|b| *b == b'\n') {
+                *carry = chunk.split_off(end + 1);
+                return Ok(Some(chunk));
+            }
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn mapping(rules: &str) -> ChartMapping {
+        ChartMapping::from_json(format!("{{\"rules\": [{rules}]}}").as_bytes()).unwrap()
+    }
+
+    #[test]
+    fn ranges_compile_to_prefixes_and_the_longest_rule_wins() {
+        let mut prefixes = Vec::new();
+        range_prefixes(b"1234", b"1301", &mut Vec::new(), &mut prefixes);
+        assert_eq!(prefixes, ["1234", "1235", "1236", "1237", "1238", "1239", "124", "125", "126", "127", "128", "129", "1300", "1301"]);
+
+        let chart = mapping(
+            r#"{"accounts": "15", "position": "45"},
+               {"accounts": "1510..1529", "position": "39"},
+               {"accounts": "15.20.01", "position": "39.NCA"},
+               {"accounts": "6", "ignore": true}"#,
+        );
+        assert_eq!(chart.position_of("1530"), Some(pos(45)));
+        assert_eq!(chart.position_of("15.19/007"), Some(pos(39)));
+        assert_eq!(chart.position_of("152001"), Some(pos_nca(39)));
+        assert_eq!(chart.resolve(b"6100"), Some(Target::Ignored));
+        assert_eq!(chart.resolve(b"7"), None);
+
+        let overlap = ChartMapping::from_json(br#"{"rules": [{"accounts": "151", "position": "39"}, {"accounts": "1500..1519", "position": "45"}]}"#);
+        assert!(matches!(overlap, Err(MappingError::Overlap { first: 1, second: 2, .. })));
+        let reversed = ChartMapping::from_json(br#"{"rules": [{"accounts": "20..10", "position": "39"}]}"#);
+        assert!(matches!(reversed, Err(MappingError::InvalidPattern { rule: 1, .. })));
+    }
+
+    #[test]
+    fn full_level_ranges_match_every_account() {
+        let chart = mapping(r#"{"accounts": "0..9", "position": "45"}"#);
+        assert_eq!(chart.position_of("1530"), Some(pos(45)));
+        assert_eq!(chart.position_of("9"), Some(pos(45)));
+
+        let chart = mapping(r#"{"accounts": "00..99", "ignore": true}, {"accounts": "1801", "position": "49"}"#);
+        assert_eq!(chart.resolve(b"7100"), Some(Target::Ignored));
+        assert_eq!(chart.position_of("18.01"), Some(pos(49)));
+
+        let twice = ChartMapping::from_json(br#"{"rules": [{"accounts": "0..9", "ignore": true}, {"accounts": "00..99", "ignore": true}]}"#);
+        assert!(matches!(twice, Err(MappingError::Overlap { first: 1, second: 2, .. })));
+    }
+
+    #[test]
+    fn aggregates_a_trial_balance_into_positions() {
+        let chart = mapping(
+            r#"{"accounts": "1501..1599", "position": "39"},
+               {"accounts": "1801", "position": "49"},
+               {"accounts": "2401", "position": "80"},
+               {"accounts": "2801", "position": "52"},
+               {"accounts": "2901", "position": "66"},
+               {"accounts": "6", "ignore": true}"#,
+        );
+        let ledger = "\u{feff}Conto;Descrizione;Dare;Avere;Oltre 12 mesi\r\n\
+            15.01.001;\"Clienti; Italia\";12.000,00;2.000,00;3.000\r\n\
+            1801;Banca;5000;;\n\
+            2401;Mutuo;;10.000;4.000\n\
+            2801;Capitale;;10.000\n\
+            2901;Azioni proprie;500;\n\
+            6101;Costi;700;\n\
+            1999;Sospeso;100;\n\
+            1999;Sospeso;;40\n\
+            1801;Banca;abc;\n\
+            ;Totale;;\n";
+        let report = chart.aggregate(ledger.as_bytes(), "bilancio.csv").unwrap();
+
+        assert_eq!(report.positions.get(pos(39)), 7000.0);
+        assert_eq!(report.positions.get(pos_nca(39)), 3000.0);
+        assert_eq!(report.positions.get(pos(49)), 5000.0);
+        // 4.000 of the 10.000 loan is due beyond 12 months.
+        assert_eq!(report.positions.get(pos(80)), 6000.0);
+        assert_eq!(report.positions.get(pos(73)), 4000.0);
+        assert_eq!(report.positions.get(pos(52)), 10000.0);
+        // Treasury shares (a debit balance) reduce equity.
+        assert_eq!(report.positions.get(pos(66)), -500.0);
+        assert_eq!((report.lines, report.mapped_lines, report.ignored_lines), (9, 5, 1));
+        assert_eq!(report.unmapped, [UnmappedAccount { account: "1999".to_string(), lines: 2, balance: 60.0 }]);
+        assert_eq!(report.error_lines, 1);
+        assert_eq!(report.errors[0].row, 10);
+
+        // Any chunking gives the same result.
+        for chunk_bytes in [1, 7, 64] {
+            assert_eq!(chart.aggregate_chunks(ledger.as_bytes(), "bilancio.csv", chunk_bytes).unwrap(), report);
+        }
+
+        let signed = "Conto,Saldo,Segno\n1801,\"1234,5\",D\n2801,\"10.000,00\",A\n";
+        let report = chart.aggregate(signed.as_bytes(), "saldi.csv").unwrap();
+        assert_eq!(report.positions.get(pos(49)), 1234.5);
+        assert_eq!(report.positions.get(pos(52)), 10000.0);
+        assert!(matches!(chart.aggregate("Voce;Importo\n".as_bytes(), "x.csv"), Err(MappingError::MissingAccountColumn)));
+    }
+}
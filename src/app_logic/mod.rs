@@ -1,7 +1,19 @@
 pub mod balance_sheet_config;
+pub mod batch;
 pub mod calculator;
+pub mod columnar;
 pub mod constants;
+pub mod importer;
+pub mod incremental;
 pub mod kpi_config;
+pub mod kpi_plan;
 pub mod kpi_requirements_logic;
 pub mod mappings_config;
+pub mod peers;
+pub mod positions;
+pub mod screening;
+pub mod sensitivity;
+pub mod sessions;
+pub mod stress;
 pub mod validators;
+pub mod workers;
@@ -0,0 +1,558 @@
+use std::collections::HashMap;
+use std::thread;
+
+use serde::{Deserialize, Serialize};
+
+use crate::app_logic::batch::{calculate_kpis_batch, PositionMatrix};
+use crate::app_logic::kpi_config::{PositionGroup, KPI_DEFINITIONS};
+use crate::app_logic::positions::BalanceSheet;
+use crate::app_logic::workers::Workers;
+
+// ln(γ) for γ = (1 + α) / (1 - α) with α = 1%: every value is represented
+// by its bucket's midpoint with at most 1% relative error.
+const LOG_GAMMA: f64 = 0.020_000_666_706_669_435;
+// Buckets per sign; beyond that the smallest magnitudes are merged, so the
+// upper quantiles keep their accuracy. 2048 buckets span 18 decades.
+const MAX_BUCKETS: usize = 2048;
+// Magnitudes below this are counted as zero.
+const MIN_MAGNITUDE: f64 = 1e-9;
+// Fewest values a peer group needs before its percentiles are reported;
+// smaller groups fall back to a broader one.
+pub const MIN_PEERS: u64 = 30;
+// Filings scored per worker when an index is built from a batch.
+const FILINGS_PER_CHUNK: usize = 16_384;
+
+// Counts of consecutive log-spaced buckets starting at index `offset`.
+#[derive(Debug, Clone, Default, PartialEq)]
+struct Buckets {
+    offset: i32,
+    counts: Vec<u64>,
+}
+
+impl Buckets {
+    fn high(&self) -> i32 {
+        self.offset + self.counts.len() as i32 - 1
+    }
+
+    fn add(&mut self, index: i32, count: u64) {
+        if let Some(slot) = self.counts.get_mut(index.wrapping_sub(self.offset) as u32 as usize) {
+            *slot += count;
+            return;
+        }
+        let (low, high) = if self.counts.is_empty() {
+            (index, index)
+        } else {
+            (self.offset.min(index), self.high().max(index))
+        };
+        let low = low.max(high - (MAX_BUCKETS as i32 - 1));
+        if self.counts.is_empty() || low != self.offset || high != self.high() {
+            self.resize(low, high);
+        }
+        self.counts[(index.max(low) - low) as usize] += count;
+    }
+
+    fn resize(&mut self, low: i32, high: i32) {
+        let mut counts = vec![0; (high - low + 1) as usize];
+        for (i, count) in self.counts.iter().enumerate() {
+            let index = self.offset + i as i32;
+            counts[(index.max(low) - low) as usize] += count;
+        }
+        self.offset = low;
+        self.counts = counts;
+    }
+
+    fn merge(&mut self, other: &Buckets) {
+        if other.counts.is_empty() {
+            return;
+        }
+        // Widen once for the whole range, then add in place.
+        self.add(other.offset, 0);
+        self.add(other.high(), 0);
+        for (i, count) in other.counts.iter().enumerate().filter(|(_, count)| **count > 0) {
+            self.add(other.offset + i as i32, *count);
+        }
+    }
+
+    // Values in buckets below `index`, and in bucket `index` itself.
+    fn count_around(&self, index: i32) -> (u64, u64) {
+        let end = (index - self.offset).clamp(0, self.counts.len() as i32) as usize;
+        let below = self.counts[..end].iter().sum();
+        (below, self.counts.get(end).filter(|_| index >= self.offset).copied().unwrap_or(0))
+    }
+
+    // (index, count) pairs from the lowest bucket up.
+    fn iter(&self) -> impl DoubleEndedIterator<Item = (i32, u64)> + '_ {
+        self.counts.iter().enumerate().map(|(i, count)| (self.offset + i as i32, *count))
+    }
+}
+
+fn bucket_index(magnitude: f64) -> i32 {
+    (magnitude.ln() / LOG_GAMMA).ceil() as i32
+}
+
+// A value resolved to its bucket once, so it can be added to the sketches
+// of several peer groups without recomputing the logarithm.
+#[derive(Debug, Clone, Copy)]
+struct Slot {
+    value: f64,
+    bucket: Bucket,
+}
+
+#[derive(Debug, Clone, Copy)]
+enum Bucket {
+    Undefined,
+    Zero,
+    Positive(i32),
+    Negative(i32),
+}
+
+impl Slot {
+    fn of(value: f64) -> Slot {
+        let bucket = if !value.is_finite() {
+            Bucket::Undefined
+        } else if value.abs() < MIN_MAGNITUDE {
+            Bucket::Zero
+        } else if value > 0.0 {
+            Bucket::Positive(bucket_index(value))
+        } else {
+            Bucket::Negative(bucket_index(-value))
+        };
+        Slot { value, bucket }
+    }
+}
+
+// Midpoint of the bucket, relative to its bounds γ^(i-1) and γ^i.
+fn bucket_value(index: i32) -> f64 {
+    let gamma = LOG_GAMMA.exp();
+    2.0 * (f64::from(index) * LOG_GAMMA).exp() / (gamma + 1.0)
+}
+
+// Streaming quantile sketch with relative accuracy (DDSketch): values fall
+// into logarithmic buckets per sign, so memory depends on the range of the
+// values and not on how many there are, two sketches merge by adding their
+// bucket counts, and a rank is one pass over at most 2 x 2048 counters.
+#[derive(Debug, Clone, PartialEq)]
+pub struct QuantileSketch {
+    positive: Buckets,
+    // Indexed by magnitude: the most negative values are in the highest buckets.
+    negative: Buckets,
+    zeros: u64,
+    count: u64,
+    min: f64,
+    max: f64,
+}
+
+impl Default for QuantileSketch {
+    fn default() -> Self {
+        QuantileSketch {
+            positive: Buckets::default(),
+            negative: Buckets::default(),
+            zeros: 0,
+            count: 0,
+            min: f64::INFINITY,
+            max: f64::NEG_INFINITY,
+        }
+    }
+}
+
+impl QuantileSketch {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    pub fn count(&self) -> u64 {
+        self.count
+    }
+
+    // NaN and infinities (undefined KPIs) are ignored.
+    pub fn add(&mut self, value: f64) {
+        self.add_slot(Slot::of(value));
+    }
+
+    fn add_slot(&mut self, Slot { value, bucket }: Slot) {
+        match bucket {
+            Bucket::Undefined => return,
+            Bucket::Zero => self.zeros += 1,
+            Bucket::Positive(index) => self.positive.add(index, 1),
+            Bucket::Negative(index) => self.negative.add(index, 1),
+        }
+        self.count += 1;
+        self.min = self.min.min(value);
+        self.max = self.max.max(value);
+    }
+
+    pub fn merge(&mut self, other: &QuantileSketch) {
+        self.positive.merge(&other.positive);
+        self.negative.merge(&other.negative);
+        self.zeros += other.zeros;
+        self.count += other.count;
+        self.min = self.min.min(other.min);
+        self.max = self.max.max(other.max);
+    }
+
+    // Share of the values below `value`, counting the values in its bucket
+    // as half below: 0.0 under the minimum, 1.0 over the maximum.
+    pub fn rank(&self, value: f64) -> Option<f64> {
+        if self.count == 0 || value.is_nan() {
+            return None;
+        }
+        if value < self.min {
+            return Some(0.0);
+        }
+        if value > self.max {
+            return Some(1.0);
+        }
+        let negatives: u64 = self.negative.counts.iter().sum();
+        let (below, at) = if value.abs() < MIN_MAGNITUDE {
+            (negatives, self.zeros)
+        } else if value > 0.0 {
+            let (below, at) = self.positive.count_around(bucket_index(value));
+            (negatives + self.zeros + below, at)
+        } else {
+            let (smaller, at) = self.negative.count_around(bucket_index(-value));
+            (negatives - smaller - at, at)
+        };
+        Some((below as f64 + at as f64 / 2.0) / self.count as f64)
+    }
+
+    // Value at quantile `q` in [0, 1], within 1% of a true value at that rank.
+    pub fn quantile(&self, q: f64) -> Option<f64> {
+        if self.count == 0 || !(0.0..=1.0).contains(&q) {
+            return None;
+        }
+        let target = (q * (self.count - 1) as f64).round() as u64;
+        let mut seen = 0;
+        let buckets = self
+            .negative
+            .iter()
+            .rev()
+            .map(|(index, count)| (-bucket_value(index), count))
+            .chain(std::iter::once((0.0, self.zeros)))
+            .chain(self.positive.iter().map(|(index, count)| (bucket_value(index), count)));
+        for (value, count) in buckets {
+            seen += count;
+            if seen > target {
+                return Some(value.clamp(self.min, self.max));
+            }
+        }
+        Some(self.max)
+    }
+}
+
+// Size classes by balance-sheet total, with the thresholds of Directive
+// 2013/34/EU as updated in 2023 (the other two criteria need turnover and
+// headcount, which a balance sheet does not carry).
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Hash, Serialize, Deserialize)]
+#[serde(rename_all = "lowercase")]
+pub enum SizeClass {
+    Micro,
+    Small,
+    Medium,
+    Large,
+}
+
+impl SizeClass {
+    pub fn from_total_assets(total_assets: f64) -> Self {
+        match total_assets {
+            total if total <= 450_000.0 => SizeClass::Micro,
+            total if total <= 7_500_000.0 => SizeClass::Small,
+            total if total <= 25_000_000.0 => SizeClass::Medium,
+            _ => SizeClass::Large,
+        }
+    }
+
+    pub fn of(sheet: &BalanceSheet) -> Self {
+        SizeClass::from_total_assets(sheet.sum(PositionGroup::TotalAssets.positions()))
+    }
+}
+
+// Sectors are free-form codes (an ATECO section such as "C" or division such
+// as "C25"), compared case-insensitively.
+pub fn normalize_sector(sector: &str) -> Option<String> {
+    let sector = sector.trim();
+    (!sector.is_empty()).then(|| sector.to_uppercase())
+}
+
+// One filing of the peer corpus. Without `size_class` it is derived from
+// the total assets.
+#[derive(Debug, Clone, Deserialize)]
+pub struct Filing {
+    pub sector: String,
+    #[serde(default)]
+    pub size_class: Option<SizeClass>,
+    pub positions: BalanceSheet,
+}
+
+// Filings of one peer group and a sketch per KPI of `KPI_DEFINITIONS`.
+#[derive(Debug, Clone)]
+pub struct PeerGroup {
+    filings: u64,
+    sketches: Vec<QuantileSketch>,
+}
+
+impl Default for PeerGroup {
+    fn default() -> Self {
+        PeerGroup { filings: 0, sketches: vec![QuantileSketch::new(); KPI_DEFINITIONS.len()] }
+    }
+}
+
+impl PeerGroup {
+    pub fn filings(&self) -> u64 {
+        self.filings
+    }
+
+    pub fn sketch(&self, kpi: usize) -> &QuantileSketch {
+        &self.sketches[kpi]
+    }
+
+    fn add(&mut self, slots: &[Slot]) {
+        self.filings += 1;
+        for (sketch, slot) in self.sketches.iter_mut().zip(slots) {
+            sketch.add_slot(*slot);
+        }
+    }
+
+    fn merge(&mut self, other: &PeerGroup) {
+        self.filings += other.filings;
+        for (sketch, other) in self.sketches.iter_mut().zip(&other.sketches) {
+            sketch.merge(other);
+        }
+    }
+}
+
+// The groups of one sector, or of all sectors together.
+#[derive(Debug, Clone, Default)]
+struct SectorPeers {
+    by_size: [PeerGroup; 4],
+    all: PeerGroup,
+}
+
+impl SectorPeers {
+    fn group(&self, size_class: Option<SizeClass>) -> &PeerGroup {
+        size_class.map_or(&self.all, |size| &self.by_size[size as usize])
+    }
+
+    fn add(&mut self, size_class: SizeClass, slots: &[Slot]) {
+        self.by_size[size_class as usize].add(slots);
+        self.all.add(slots);
+    }
+
+    fn merge(&mut self, other: &SectorPeers) {
+        for (group, other) in self.by_size.iter_mut().zip(&other.by_size) {
+            group.merge(other);
+        }
+        self.all.merge(&other.all);
+    }
+}
+
+// Where a value stands among its peers.
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct PeerRank {
+    // 0-100: share of the peers with a lower value.
+    pub percentile: f64,
+    // Peers with a defined value for this KPI.
+    pub peers: u64,
+    // The group ranked against; None where it spans all sectors / sizes.
+    pub sector: Option<String>,
+    pub size_class: Option<SizeClass>,
+}
+
+// KPI distributions of a corpus of filings per sector and size class, and
+// across all sectors and sizes, kept as quantile sketches that are updated
+// one filing at a time. Ranking a value reads one sketch, whatever the size
+// of the corpus, and indexes built separately (e.g. on several threads)
+// merge exactly.
+#[derive(Debug, Clone, Default)]
+pub struct PeerIndex {
+    sectors: HashMap<String, SectorPeers>,
+    everyone: SectorPeers,
+}
+
+impl PeerIndex {
+    pub fn new() -> Self {
+        Self::default()
+    }
+
+    pub fn filings(&self) -> u64 {
+        self.everyone.all.filings
+    }
+
+    pub fn sectors(&self) -> impl Iterator<Item = &str> {
+        self.sectors.keys().map(String::as_str)
+    }
+
+    // `values` holds the filing's KPIs in `KPI_DEFINITIONS` order, NaN where
+    // undefined; `sector` as returned by `normalize_sector`.
+    pub fn add(&mut self, sector: &str, size_class: SizeClass, values: &[f64]) {
+        assert_eq!(values.len(), KPI_DEFINITIONS.len(), "one value per KPI definition");
+        let slots: Vec<Slot> = values.iter().map(|value| Slot::of(*value)).collect();
+        self.add_slots(sector, size_class, &slots);
+    }
+
+    fn add_slots(&mut self, sector: &str, size_class: SizeClass, slots: &[Slot]) {
+        self.everyone.add(size_class, slots);
+        match self.sectors.get_mut(sector) {
+            Some(peers) => peers.add(size_class, slots),
+            None => self.sectors.entry(sector.to_string()).or_default().add(size_class, slots),
+        }
+    }
+
+    // Scores the filings with the batch engine, in chunks on the shared worker
+    // threads (`workers.rs`), and merges the partial indexes. Filings without
+    // a usable sector are skipped; returns how many were added.
+    pub fn add_filings(&mut self, filings: &[Filing]) -> usize {
+        let chunks: Vec<&[Filing]> = filings.chunks(FILINGS_PER_CHUNK).collect();
+        let threads = Workers::acquire(chunks.len());
+        let workers = threads.count();
+        let partials: Vec<(PeerIndex, usize)> = thread::scope(|scope| {
+            let handles: Vec<_> = (0..workers)
+                .map(|worker| {
+                    let chunks = &chunks;
+                    scope.spawn(move || {
+                        let mut index = PeerIndex::new();
+                        let added = chunks.iter().skip(worker).step_by(workers).map(|chunk| index.add_chunk(chunk)).sum();
+                        (index, added)
+                    })
+                })
+                .collect();
+            handles.into_iter().map(|handle| handle.join().expect("peer index worker panicked")).collect()
+        });
+
+        let mut added = 0;
+        for (partial, count) in partials {
+            self.merge(&partial);
+            added += count;
+        }
+        added
+    }
+
+    fn add_chunk(&mut self, filings: &[Filing]) -> usize {
+        let filings: Vec<(String, &Filing)> = filings
+            .iter()
+            .filter_map(|filing| Some((normalize_sector(&filing.sector)?, filing)))
+            .collect();
+        let matrix = PositionMatrix::from_sheets(filings.iter().map(|(_, filing)| &filing.positions));
+        let keys: Vec<String> = KPI_DEFINITIONS.iter().map(|definition| definition.key.to_string()).collect();
+        let result = calculate_kpis_batch(&matrix, &keys);
+
+        let mut slots = vec![Slot::of(f64::NAN); keys.len()];
+        for (row, (sector, filing)) in filings.iter().enumerate() {
+            for (kpi, slot) in slots.iter_mut().enumerate() {
+                *slot = Slot::of(result.values_column(kpi)[row]);
+            }
+            let size_class = filing.size_class.unwrap_or_else(|| SizeClass::of(&filing.positions));
+            self.add_slots(sector, size_class, &slots);
+        }
+        filings.len()
+    }
+
+    pub fn merge(&mut self, other: &PeerIndex) {
+        self.everyone.merge(&other.everyone);
+        for (sector, peers) in &other.sectors {
+            self.sectors.entry(sector.clone()).or_default().merge(peers);
+        }
+    }
+
+    // None for a sector not in the index.
+    pub fn group(&self, sector: Option<&str>, size_class: Option<SizeClass>) -> Option<&PeerGroup> {
+        match sector {
+            Some(sector) => self.sectors.get(sector).map(|peers| peers.group(size_class)),
+            None => Some(self.everyone.group(size_class)),
+        }
+    }
+
+    // Percentile of `value` for the KPI at `kpi` in `KPI_DEFINITIONS`, among
+    // the narrowest group with at least MIN_PEERS values: same sector and
+    // size, same sector, same size, then everyone.
+    pub fn rank(&self, sector: &str, size_class: SizeClass, kpi: usize, value: f64) -> Option<PeerRank> {
+        let candidates = [(true, Some(size_class)), (true, None), (false, Some(size_class)), (false, None)];
+        let (in_sector, size, sketch) = candidates.into_iter().find_map(|(in_sector, size)| {
+            let peers = if in_sector { self.sectors.get(sector)? } else { &self.everyone };
+            let sketch = peers.group(size).sketch(kpi);
+            (sketch.count() >= MIN_PEERS).then_some((in_sector, size, sketch))
+        })?;
+        Some(PeerRank {
+            percentile: sketch.rank(value)? * 100.0,
+            peers: sketch.count(),
+            sector: in_sector.then(|| sector.to_string()),
+            size_class: size,
+        })
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::positions::pos;
+
+    #[test]
+    fn sketch_ranks_and_quantiles_within_relative_accuracy() {
+        let values: Vec<f64> = (0..10_000).map(|i| f64::from(i - 2_000) * 0.37).collect();
+        let mut whole = QuantileSketch::new();
+        let mut halves = [QuantileSketch::new(), QuantileSketch::new()];
+        for (i, value) in values.iter().enumerate() {
+            whole.add(*value);
+            halves[i % 2].add(*value);
+        }
+        halves[0].add(f64::NAN);
+        let [mut merged, other] = halves;
+        merged.merge(&other);
+        assert_eq!(merged, whole);
+
+        for q in [0.05, 0.25, 0.5, 0.9, 0.99] {
+            let exact = values[(q * (values.len() - 1) as f64).round() as usize];
+            let estimate = whole.quantile(q).unwrap();
+            assert!((estimate - exact).abs() <= 0.01 * exact.abs() + 1e-9, "q{q}: {estimate} vs {exact}");
+        }
+        for value in [-500.0, 0.0, 12.5, 2_000.0] {
+            let exact = values.iter().filter(|v| **v < value).count() as f64 / values.len() as f64;
+            let rank = whole.rank(value).unwrap();
+            assert!((rank - exact).abs() < 0.01, "rank({value}): {rank} vs {exact}");
+        }
+        assert_eq!(whole.rank(-1e6), Some(0.0));
+        assert_eq!(whole.rank(1e6), Some(1.0));
+        assert_eq!(QuantileSketch::new().rank(1.0), None);
+    }
+
+    #[test]
+    fn sketch_collapses_the_smallest_magnitudes() {
+        let mut sketch = QuantileSketch::new();
+        for exponent in -8..300 {
+            sketch.add(10f64.powi(exponent));
+        }
+        assert!(sketch.positive.counts.len() <= MAX_BUCKETS);
+        let top = sketch.quantile(1.0).unwrap();
+        assert!((top / 1e299 - 1.0).abs() < 0.01);
+    }
+
+    #[test]
+    fn ranks_against_the_narrowest_group_with_enough_peers() {
+        let current_ratio = KPI_DEFINITIONS.iter().position(|d| d.key == "current_ratio").unwrap();
+        let filing = |sector: &str, current_assets: f64| {
+            let mut positions = BalanceSheet::new();
+            positions.set(pos(35), current_assets);
+            positions.set(pos(80), 100.0);
+            Filing { sector: sector.to_string(), size_class: None, positions }
+        };
+        // Manufacturing: current ratios 0.01 to 1.00; services 1.01 to 2.00.
+        let filings: Vec<Filing> =
+            (1..=100).map(|i| filing("c", f64::from(i))).chain((101..=200).map(|i| filing("I", f64::from(i)))).collect();
+
+        let mut index = PeerIndex::new();
+        assert_eq!(index.add_filings(&filings[..150]), 150);
+        index.add_filings(&filings[150..]);
+        assert_eq!(index.filings(), 200);
+
+        let rank = index.rank("C", SizeClass::Micro, current_ratio, 0.75).unwrap();
+        assert_eq!((rank.peers, rank.sector.as_deref(), rank.size_class), (100, Some("C"), Some(SizeClass::Micro)));
+        assert!((rank.percentile - 74.5).abs() < 1.0, "{}", rank.percentile);
+
+        // Unknown sector: everyone of the same size.
+        let rank = index.rank("F", SizeClass::Micro, current_ratio, 0.75).unwrap();
+        assert_eq!((rank.peers, rank.sector), (200, None));
+        assert!((rank.percentile - 37.25).abs() < 1.0, "{}", rank.percentile);
+        // No large companies yet: everyone in the sector.
+        let rank = index.rank("C", SizeClass::Large, current_ratio, 0.75).unwrap();
+        assert_eq!((rank.sector.as_deref(), rank.size_class), (Some("C"), None));
+    }
+}
@@ -0,0 +1,323 @@
+use std::borrow::Cow;
+use std::collections::BTreeMap;
+use std::fmt;
+
+use serde::de::{self, Deserializer, MapAccess, Visitor};
+use serde::ser::{SerializeMap, Serializer};
+use serde::{Deserialize, Serialize};
+
+// Index of a balance sheet position inside the compact layout.
+pub type PositionId = usize;
+
+// CEE positions "1".."100" occupy slots 0..100, the non-current receivables
+// split out of "39".."45" ("39.NCA".."45.NCA") occupy the trailing slots.
+pub const CEE_POSITION_COUNT: usize = 100;
+pub const NCA_FIRST: usize = 39;
+pub const NCA_LAST: usize = 45;
+pub const POSITION_COUNT: usize = CEE_POSITION_COUNT + (NCA_LAST - NCA_FIRST + 1);
+
+pub const POSITION_KEYS: [&str; POSITION_COUNT] = [
+    "1", "2", "3", "4", "5", "6", "7", "8", "9", "10",
+    "11", "12", "13", "14", "15", "16", "17", "18", "19", "20",
+    "21", "22", "23", "24", "25", "26", "27", "28", "29", "30",
+    "31", "32", "33", "34", "35", "36", "37", "38", "39", "40",
+    "41", "42", "43", "44", "45", "46", "47", "48", "49", "50",
+    "51", "52", "53", "54", "55", "56", "57", "58", "59", "60",
+    "61", "62", "63", "64", "65", "66", "67", "68", "69", "70",
+    "71", "72", "73", "74", "75", "76", "77", "78", "79", "80",
+    "81", "82", "83", "84", "85", "86", "87", "88", "89", "90",
+    "91", "92", "93", "94", "95", "96", "97", "98", "99", "100",
+    "39.NCA", "40.NCA", "41.NCA", "42.NCA", "43.NCA", "44.NCA", "45.NCA",
+];
+
+// Slot of CEE position `number` (1..=100).
+pub const fn pos(number: usize) -> PositionId {
+    number - 1
+}
+
+// Slot of the non-current part of receivable `number` (39..=45).
+pub const fn pos_nca(number: usize) -> PositionId {
+    CEE_POSITION_COUNT + number - NCA_FIRST
+}
+
+// Slots of `N` consecutive CEE positions starting at `first`.
+pub const fn span<const N: usize>(first: usize) -> [PositionId; N] {
+    let mut ids = [0; N];
+    let mut i = 0;
+    while i < N {
+        ids[i] = pos(first + i);
+        i += 1;
+    }
+    ids
+}
+
+pub fn position_index(key: &str) -> Option<PositionId> {
+    let (number, nca) = match key.strip_suffix(".NCA") {
+        Some(base) => (base, true),
+        None => (key, false),
+    };
+    if number.is_empty() || number.starts_with('0') || !number.bytes().all(|b| b.is_ascii_digit()) {
+        return None;
+    }
+    let n: usize = number.parse().ok()?;
+    if nca {
+        (NCA_FIRST..=NCA_LAST).contains(&n).then(|| pos_nca(n))
+    } else {
+        (1..=CEE_POSITION_COUNT).contains(&n).then(|| pos(n))
+    }
+}
+
+pub fn position_key(id: PositionId) -> &'static str {
+    POSITION_KEYS[id]
+}
+
+// Fixed-layout balance sheet: one f64 per position, no string keys.
+#[derive(Debug, Clone, PartialEq)]
+pub struct BalanceSheet {
+    values: [f64; POSITION_COUNT],
+}
+
+impl BalanceSheet {
+    pub fn new() -> Self {
+        BalanceSheet { values: [0.0; POSITION_COUNT] }
+    }
+
+    pub fn from_map(data: &BTreeMap<String, f64>) -> Self {
+        let mut sheet = BalanceSheet::new();
+        for (key, value) in data {
+            // Unknown keys (e.g. the validators' `raw_` entries) are not positions.
+            if let Some(id) = position_index(key) {
+                sheet.values[id] = *value;
+            }
+        }
+        sheet
+    }
+
+    pub fn to_map(&self) -> BTreeMap<String, f64> {
+        POSITION_KEYS
+            .iter()
+            .zip(self.values.iter())
+            .map(|(key, value)| (key.to_string(), *value))
+            .collect()
+    }
+
+    #[inline]
+    pub fn get(&self, id: PositionId) -> f64 {
+        self.values[id]
+    }
+
+    #[inline]
+    pub fn set(&mut self, id: PositionId, value: f64) {
+        self.values[id] = value;
+    }
+
+    #[inline]
+    pub fn sum(&self, ids: &[PositionId]) -> f64 {
+        ids.iter().map(|&id| self.values[id]).sum()
+    }
+
+    pub fn values(&self) -> &[f64; POSITION_COUNT] {
+        &self.values
+    }
+}
+
+impl Default for BalanceSheet {
+    fn default() -> Self {
+        BalanceSheet::new()
+    }
+}
+
+impl From<&BTreeMap<String, f64>> for BalanceSheet {
+    fn from(data: &BTreeMap<String, f64>) -> Self {
+        BalanceSheet::from_map(data)
+    }
+}
+
+// Serialized as a `{"position": amount}` map holding the non-zero positions.
+impl Serialize for BalanceSheet {
+    fn serialize<S: Serializer>(&self, serializer: S) -> Result<S::Ok, S::Error> {
+        let non_zero = self.values.iter().filter(|value| **value != 0.0).count();
+        let mut map = serializer.serialize_map(Some(non_zero))?;
+        for (key, value) in POSITION_KEYS.iter().zip(self.values.iter()) {
+            if *value != 0.0 {
+                map.serialize_entry(key, value)?;
+            }
+        }
+        map.end()
+    }
+}
+
+// Keys are resolved straight to slots, so deserializing allocates nothing.
+impl<'de> Deserialize<'de> for BalanceSheet {
+    fn deserialize<D: Deserializer<'de>>(deserializer: D) -> Result<Self, D::Error> {
+        deserializer.deserialize_map(BalanceSheetVisitor)
+    }
+}
+
+struct BalanceSheetVisitor;
+
+impl<'de> Visitor<'de> for BalanceSheetVisitor {
+    type Value = BalanceSheet;
+
+    fn expecting(&self, formatter: &mut fmt::Formatter) -> fmt::Result {
+        formatter.write_str("a map of CEE positions to amounts")
+    }
+
+    fn visit_map<A: MapAccess<'de>>(self, mut access: A) -> Result<BalanceSheet, A::Error> {
+        let mut sheet = BalanceSheet::new();
+        while let Some(PositionKey(id)) = access.next_key()? {
+            let value: f64 = access.next_value()?;
+            if !value.is_finite() {
+                return Err(de::Error::custom(format_args!("importo non valido per la posizione {}", position_key(id))));
+            }
+            sheet.values[id] = value;
+        }
+        Ok(sheet)
+    }
+}
+
+struct PositionKey(PositionId);
+
+impl<'de> Deserialize<'de> for PositionKey {
+    fn deserialize<D: Deserializer<'de>>(deserializer: D) -> Result<Self, D::Error> {
+        struct PositionKeyVisitor;
+
+        impl<'v> Visitor<'v> for PositionKeyVisitor {
+            type Value = PositionKey;
+
+            fn expecting(&self, formatter: &mut fmt::Formatter) -> fmt::Result {
+                formatter.write_str("a CEE position key such as \"39\" or \"39.NCA\"")
+            }
+
+            fn visit_str<E: de::Error>(self, key: &str) -> Result<PositionKey, E> {
+                position_index(key)
+                    .map(PositionKey)
+                    .ok_or_else(|| E::custom(format_args!("posizione sconosciuta: {key}")))
+            }
+        }
+
+        deserializer.deserialize_str(PositionKeyVisitor)
+    }
+}
+
+// Anything the calculator accepts: the legacy string-keyed map or the compact layout.
+pub trait BalanceSheetData {
+    fn as_balance_sheet(&self) -> Cow<'_, BalanceSheet>;
+}
+
+impl BalanceSheetData for BalanceSheet {
+    fn as_balance_sheet(&self) -> Cow<'_, BalanceSheet> {
+        Cow::Borrowed(self)
+    }
+}
+
+impl BalanceSheetData for BTreeMap<String, f64> {
+    fn as_balance_sheet(&self) -> Cow<'_, BalanceSheet> {
+        Cow::Owned(BalanceSheet::from_map(self))
+    }
+}
+
+// Set of positions as a bitset over the compact layout.
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq, Hash)]
+pub struct PositionSet(u128);
+
+const _: () = assert!(POSITION_COUNT <= u128::BITS as usize);
+
+impl PositionSet {
+    pub const fn new() -> Self {
+        PositionSet(0)
+    }
+
+    pub fn all() -> Self {
+        PositionSet(u128::MAX >> (u128::BITS as usize - POSITION_COUNT))
+    }
+
+    #[inline]
+    pub fn insert(&mut self, id: PositionId) {
+        self.0 |= 1 << id;
+    }
+
+    #[inline]
+    pub fn contains(&self, id: PositionId) -> bool {
+        self.0 & (1 << id) != 0
+    }
+
+    #[inline]
+    pub fn remove(&mut self, id: PositionId) {
+        self.0 &= !(1 << id);
+    }
+
+    pub fn union(self, other: PositionSet) -> PositionSet {
+        PositionSet(self.0 | other.0)
+    }
+
+    pub fn difference(self, other: PositionSet) -> PositionSet {
+        PositionSet(self.0 & !other.0)
+    }
+
+    pub fn intersection(self, other: PositionSet) -> PositionSet {
+        PositionSet(self.0 & other.0)
+    }
+
+    pub fn len(&self) -> usize {
+        self.0.count_ones() as usize
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.0 == 0
+    }
+
+    pub fn iter(&self) -> impl Iterator<Item = PositionId> {
+        let mut bits = self.0;
+        std::iter::from_fn(move || {
+            if bits == 0 {
+                return None;
+            }
+            let id = bits.trailing_zeros() as PositionId;
+            bits &= bits - 1;
+            Some(id)
+        })
+    }
+
+    // Position keys in CEE order ("1", "2", ..., "100", "39.NCA", ...).
+    pub fn keys(&self) -> impl Iterator<Item = &'static str> {
+        self.iter().map(position_key)
+    }
+}
+
+impl FromIterator<PositionId> for PositionSet {
+    fn from_iter<I: IntoIterator<Item = PositionId>>(ids: I) -> Self {
+        let mut set = PositionSet::new();
+        for id in ids {
+            set.insert(id);
+        }
+        set
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn position_keys_round_trip() {
+        for (id, key) in POSITION_KEYS.iter().enumerate() {
+            assert_eq!(position_index(key), Some(id));
+        }
+        assert_eq!(position_index("0"), None);
+        assert_eq!(position_index("101"), None);
+        assert_eq!(position_index("046"), None);
+        assert_eq!(position_index("38.NCA"), None);
+    }
+
+    #[test]
+    fn balance_sheet_json_uses_position_keys() {
+        let sheet: BalanceSheet = serde_json::from_str(r#"{"31": 120000, "39.NCA": 5.5}"#).unwrap();
+        assert_eq!(sheet.get(pos(31)), 120000.0);
+        assert_eq!(sheet.get(pos_nca(39)), 5.5);
+        assert_eq!(serde_json::to_string(&sheet).unwrap(), r#"{"31":120000.0,"39.NCA":5.5}"#);
+
+        let err = serde_json::from_str::<BalanceSheet>(r#"{"pos_31": 1}"#).unwrap_err();
+        assert!(err.to_string().contains("posizione sconosciuta: pos_31"));
+    }
+}
@@ -0,0 +1,462 @@
+use std::collections::BTreeMap;
+
+use serde::{Deserialize, Serialize};
+use thiserror::Error;
+
+use crate::app_logic::calculator::KpiResult;
+use crate::app_logic::columnar::{ColumnStore, ColumnStoreError, ColumnView, Zone, BLOCK_ROWS};
+use crate::app_logic::kpi_config::get_kpi_definition;
+use crate::app_logic::kpi_plan::{Expression, KpiPlan, PlannedKpi};
+
+#[derive(Debug, Error)]
+pub enum ScreenError {
+    #[error("unknown KPI: {0}")]
+    UnknownKpi(String),
+    #[error(transparent)]
+    Store(#[from] ColumnStoreError),
+}
+
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Serialize, Deserialize)]
+pub enum Comparison {
+    #[serde(rename = "<")]
+    Less,
+    #[serde(rename = "<=")]
+    LessOrEqual,
+    #[serde(rename = ">")]
+    Greater,
+    #[serde(rename = ">=")]
+    GreaterOrEqual,
+}
+
+impl Comparison {
+    fn holds(self, value: f64, threshold: f64) -> bool {
+        match self {
+            Comparison::Less => value < threshold,
+            Comparison::LessOrEqual => value <= threshold,
+            Comparison::Greater => value > threshold,
+            Comparison::GreaterOrEqual => value >= threshold,
+        }
+    }
+}
+
+// `kpi op value`, e.g. current_ratio < 1. A KPI that is undefined for a
+// filing (zero denominator) fails every predicate on it.
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct Predicate {
+    pub kpi: String,
+    pub op: Comparison,
+    pub value: f64,
+}
+
+// Filings of the archive matching all the predicates, optionally restricted
+// to a sector and a range of fiscal years.
+#[derive(Debug, Clone, Default, Serialize, Deserialize)]
+pub struct Screen {
+    #[serde(rename = "where")]
+    pub predicates: Vec<Predicate>,
+    // KPIs reported for each match on top of the screened ones.
+    #[serde(default)]
+    pub kpis: Vec<String>,
+    #[serde(default)]
+    pub sector: Option<String>,
+    #[serde(default)]
+    pub from_year: Option<i32>,
+    #[serde(default)]
+    pub to_year: Option<i32>,
+    #[serde(default)]
+    pub limit: Option<usize>,
+}
+
+#[derive(Debug, Clone, Serialize)]
+pub struct ScreenMatch {
+    pub row: usize,
+    pub company: String,
+    pub fiscal_year: i32,
+    pub sector: String,
+    pub kpis: BTreeMap<String, KpiResult>,
+}
+
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq, Serialize)]
+pub struct ScreenStats {
+    pub blocks: usize,
+    // Blocks ruled out by their zone maps alone.
+    pub skipped_blocks: usize,
+    // Rows on which at least one predicate was evaluated.
+    pub rows_evaluated: usize,
+    pub matches: usize,
+}
+
+// Closed interval holding every value of a node over one block; NaN bounds
+// (inf - inf, inf / inf) mean nothing is known.
+#[derive(Debug, Clone, Copy)]
+struct Interval {
+    min: f64,
+    max: f64,
+}
+
+impl Interval {
+    fn known(self) -> Option<Interval> {
+        (!self.min.is_nan() && !self.max.is_nan()).then_some(self)
+    }
+}
+
+// What the zone maps say about a predicate over one block. The bounds are
+// computed with the same operations, in the same order, as the row values,
+// and IEEE rounding is monotonic, so they hold exactly.
+#[derive(Debug, Clone, Copy, PartialEq)]
+enum Verdict {
+    Never,
+    Always,
+    Maybe,
+}
+
+fn group_interval(view: &ColumnView, group: &[usize], block: usize) -> Interval {
+    let mut interval = Interval { min: 0.0, max: 0.0 };
+    for &id in group {
+        let zone = view.position_zone(id, block).unwrap_or(Zone::UNKNOWN);
+        interval.min += zone.min;
+        interval.max += zone.max;
+    }
+    interval
+}
+
+fn expression_interval(expression: &Expression, groups: &[Interval]) -> Interval {
+    let mut interval = Interval { min: 0.0, max: 0.0 };
+    for &(coefficient, slot) in expression {
+        let (low, high) = (coefficient * groups[slot].min, coefficient * groups[slot].max);
+        interval.min += low.min(high);
+        interval.max += low.max(high);
+    }
+    interval
+}
+
+fn kpi_interval(kpi: &PlannedKpi, expressions: &[Interval]) -> Option<Interval> {
+    let numerator = expressions[kpi.numerator].known()?;
+    let Some(slot) = kpi.denominator else {
+        return Some(numerator);
+    };
+    let denominator = expressions[slot].known()?;
+    // Rows with a zero denominator are not ruled out by the zone maps.
+    if denominator.min <= 0.0 && denominator.max >= 0.0 {
+        return None;
+    }
+    let corners = [
+        numerator.min / denominator.min,
+        numerator.min / denominator.max,
+        numerator.max / denominator.min,
+        numerator.max / denominator.max,
+    ];
+    let interval = Interval {
+        min: corners.iter().copied().fold(f64::INFINITY, f64::min),
+        max: corners.iter().copied().fold(f64::NEG_INFINITY, f64::max),
+    };
+    // f64::min / max skip NaN, so check the corners themselves.
+    (!corners.iter().any(|corner| corner.is_nan())).then_some(interval)
+}
+
+fn verdict(predicate: &Predicate, interval: Option<Interval>) -> Verdict {
+    let Some(Interval { min, max }) = interval else {
+        return Verdict::Maybe;
+    };
+    if predicate.op.holds(min, predicate.value) && predicate.op.holds(max, predicate.value) {
+        Verdict::Always
+    } else if !predicate.op.holds(min, predicate.value) && !predicate.op.holds(max, predicate.value) {
+        // Every comparison is monotonic in the value, so failing at both
+        // ends means failing in between.
+        Verdict::Never
+    } else {
+        Verdict::Maybe
+    }
+}
+
+// Per-block values of the plan's nodes, computed only for the rows still
+// selected and only once the first predicate needing them runs.
+struct BlockColumns {
+    start: usize,
+    groups: Vec<Option<Vec<f64>>>,
+    expressions: Vec<Option<Vec<f64>>>,
+}
+
+impl BlockColumns {
+    fn new(plan: &KpiPlan, start: usize) -> Self {
+        BlockColumns {
+            start,
+            groups: vec![None; plan.groups().len()],
+            expressions: vec![None; plan.expressions().len()],
+        }
+    }
+
+    fn group(&mut self, view: &ColumnView, plan: &KpiPlan, slot: usize, selected: &[u32]) {
+        if self.groups[slot].is_some() {
+            return;
+        }
+        let mut values = vec![0.0; BLOCK_ROWS];
+        for &id in plan.groups()[slot].positions() {
+            let column = &view.position(id).expect("screened positions are mapped")[self.start..];
+            for &row in selected {
+                values[row as usize] += column[row as usize];
+            }
+        }
+        self.groups[slot] = Some(values);
+    }
+
+    fn expression(&mut self, view: &ColumnView, plan: &KpiPlan, slot: usize, selected: &[u32]) {
+        if self.expressions[slot].is_some() {
+            return;
+        }
+        let expression = &plan.expressions()[slot];
+        for &(_, group) in expression {
+            self.group(view, plan, group, selected);
+        }
+        let mut values = vec![0.0; BLOCK_ROWS];
+        for &(coefficient, group) in expression {
+            let group = self.groups[group].as_ref().expect("group computed above");
+            for &row in selected {
+                values[row as usize] += coefficient * group[row as usize];
+            }
+        }
+        self.expressions[slot] = Some(values);
+    }
+
+    // Keeps the selected rows on which the predicate holds.
+    fn filter(&mut self, view: &ColumnView, plan: &KpiPlan, kpi: &PlannedKpi, predicate: &Predicate, selected: &mut Vec<u32>) {
+        for slot in std::iter::once(kpi.numerator).chain(kpi.denominator) {
+            self.expression(view, plan, slot, selected);
+        }
+        let numerator = self.expressions[kpi.numerator].as_deref().expect("expression computed above");
+        match kpi.denominator {
+            None => selected.retain(|&row| predicate.op.holds(numerator[row as usize], predicate.value)),
+            Some(slot) => {
+                let denominator = self.expressions[slot].as_deref().expect("expression computed above");
+                selected.retain(|&row| {
+                    let d = denominator[row as usize];
+                    d != 0.0 && predicate.op.holds(numerator[row as usize] / d, predicate.value)
+                });
+            }
+        }
+    }
+}
+
+// Screens the archive block by block, handing each match to `on_match` as
+// soon as it is found; returning false from it stops the scan. Only the
+// aggregates the predicates need are computed, the zone maps rule out whole
+// blocks (or predicates over them) without reading their values, and each
+// row is dropped at the first predicate it fails, cheapest predicates first.
+pub fn screen<F>(store: &ColumnStore, screen: &Screen, mut on_match: F) -> Result<ScreenStats, ScreenError>
+where
+    F: FnMut(ScreenMatch) -> bool,
+{
+    for key in screen.predicates.iter().map(|predicate| &predicate.kpi).chain(&screen.kpis) {
+        if get_kpi_definition(key).is_none() {
+            return Err(ScreenError::UnknownKpi(key.clone()));
+        }
+    }
+    let screened: Vec<&str> = screen.predicates.iter().map(|predicate| predicate.kpi.as_str()).collect();
+    let plan = KpiPlan::compile(&screened);
+    let mut reported: Vec<&str> = Vec::new();
+    for key in screened.iter().copied().chain(screen.kpis.iter().map(String::as_str)) {
+        if !reported.contains(&key) {
+            reported.push(key);
+        }
+    }
+    let report = KpiPlan::compile(&reported);
+    let view = store.view(report.required_positions())?;
+
+    let mut stats = ScreenStats { blocks: view.blocks(), ..ScreenStats::default() };
+    // The limit is checked after a match; a limit of zero allows none.
+    if screen.limit == Some(0) {
+        return Ok(ScreenStats { skipped_blocks: stats.blocks, ..stats });
+    }
+    let sector = match &screen.sector {
+        Some(sector) => match view.sector_code(sector.trim()) {
+            Some(code) => Some(code),
+            None => return Ok(ScreenStats { skipped_blocks: stats.blocks, ..stats }),
+        },
+        None => None,
+    };
+    let years = Interval {
+        min: screen.from_year.map_or(f64::NEG_INFINITY, f64::from),
+        max: screen.to_year.map_or(f64::INFINITY, f64::from),
+    };
+
+    // Cheapest predicates first: the fewer positions a KPI reads, the less
+    // it costs to evaluate on the rows that reach it.
+    let mut order: Vec<usize> = (0..screen.predicates.len()).collect();
+    let cost = |index: usize| {
+        let kpi = &plan.kpis()[index];
+        let expression_cost = |slot: usize| -> usize {
+            plan.expressions()[slot].iter().map(|&(_, group)| plan.groups()[group].positions().len()).sum()
+        };
+        expression_cost(kpi.numerator) + kpi.denominator.map_or(0, expression_cost)
+    };
+    order.sort_by_key(|&index| cost(index));
+
+    let mut selected = Vec::with_capacity(BLOCK_ROWS);
+    let mut pending = Vec::with_capacity(order.len());
+    for block in 0..stats.blocks {
+        let start = block * BLOCK_ROWS;
+        let end = (start + BLOCK_ROWS).min(view.rows());
+
+        let year_zone = view.fiscal_year_zone(block);
+        if year_zone.max < years.min || year_zone.min > years.max {
+            stats.skipped_blocks += 1;
+            continue;
+        }
+        let groups: Vec<Interval> = plan
+            .groups()
+            .iter()
+            .map(|group| group_interval(&view, group.positions(), block))
+            .collect();
+        let expressions: Vec<Interval> = plan
+            .expressions()
+            .iter()
+            .map(|expression| expression_interval(expression, &groups))
+            .collect();
+        pending.clear();
+        let mut never = false;
+        for &index in &order {
+            match verdict(&screen.predicates[index], kpi_interval(&plan.kpis()[index], &expressions)) {
+                Verdict::Never => never = true,
+                Verdict::Always => {}
+                Verdict::Maybe => pending.push(index),
+            }
+        }
+        if never {
+            stats.skipped_blocks += 1;
+            continue;
+        }
+
+        selected.clear();
+        let fiscal_years = &view.fiscal_years()[start..end];
+        let sector_codes = &view.sector_codes()[start..end];
+        for row in 0..end - start {
+            let year = f64::from(fiscal_years[row]);
+            if year >= years.min && year <= years.max && sector.map_or(true, |code| sector_codes[row] == code) {
+                selected.push(row as u32);
+            }
+        }
+        if !pending.is_empty() {
+            stats.rows_evaluated += selected.len();
+        }
+        let mut columns = BlockColumns::new(&plan, start);
+        for &index in &pending {
+            if selected.is_empty() {
+                break;
+            }
+            columns.filter(&view, &plan, &plan.kpis()[index], &screen.predicates[index], &mut selected);
+        }
+
+        for &row in &selected {
+            let row = start + row as usize;
+            let results = report.evaluate(&view.sheet(row));
+            let found = ScreenMatch {
+                row,
+                company: view.company(row).to_string(),
+                fiscal_year: view.fiscal_years()[row],
+                sector: view.sector(row).to_string(),
+                kpis: reported.iter().map(|key| key.to_string()).zip(results).collect(),
+            };
+            stats.matches += 1;
+            if !on_match(found) || screen.limit.is_some_and(|limit| stats.matches >= limit) {
+                return Ok(stats);
+            }
+        }
+    }
+    Ok(stats)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::calculator::calculate_selected_kpis;
+    use crate::app_logic::columnar::ArchivedFiling;
+    use crate::app_logic::positions::{pos, BalanceSheet};
+    use std::fs;
+
+    // Current ratio 2 in the first block, 0.5 in the second one except for
+    // every 100th row, whose current liabilities are zero.
+    fn archive(name: &str) -> ColumnStore {
+        let dir = std::env::temp_dir().join(format!("kpi-screen-{name}-{}", std::process::id()));
+        let _ = fs::remove_dir_all(&dir);
+        let mut store = ColumnStore::open(&dir).unwrap();
+        let filings: Vec<ArchivedFiling> = (0..2 * BLOCK_ROWS)
+            .map(|i| {
+                let mut positions = BalanceSheet::new();
+                positions.set(pos(35), if i < BLOCK_ROWS { 2000.0 } else { 500.0 } + (i % 100) as f64);
+                positions.set(pos(80), if i >= BLOCK_ROWS && i % 100 == 0 { 0.0 } else { 1000.0 });
+                positions.set(pos(52), 100.0 + (i % 7) as f64 * 100.0);
+                ArchivedFiling {
+                    company: format!("Azienda {i}"),
+                    fiscal_year: 2020 + (i % 4) as i32,
+                    sector: if i % 2 == 0 { "C" } else { "F" }.to_string(),
+                    positions,
+                }
+            })
+            .collect();
+        store.append(&filings).unwrap();
+        store
+    }
+
+    fn predicate(kpi: &str, op: Comparison, value: f64) -> Predicate {
+        Predicate { kpi: kpi.to_string(), op, value }
+    }
+
+    #[test]
+    fn matches_the_filings_a_full_scan_would() {
+        let store = archive("full-scan");
+        let query = Screen {
+            predicates: vec![
+                predicate("current_ratio", Comparison::Less, 1.0),
+                predicate("debt_to_equity", Comparison::GreaterOrEqual, 2.0),
+            ],
+            kpis: vec!["working_capital".to_string()],
+            sector: Some("C".to_string()),
+            from_year: Some(2021),
+            ..Screen::default()
+        };
+        let mut found = Vec::new();
+        let stats = screen(&store, &query, |m| {
+            found.push(m);
+            true
+        })
+        .unwrap();
+
+        let view = store.view(crate::app_logic::positions::PositionSet::all()).unwrap();
+        let keys = ["current_ratio".to_string(), "debt_to_equity".to_string()];
+        let expected: Vec<usize> = (0..view.rows())
+            .filter(|&row| view.sector(row) == "C" && view.fiscal_years()[row] >= 2021)
+            .filter(|&row| {
+                let results = calculate_selected_kpis(&view.sheet(row), &keys);
+                results["current_ratio"].value.is_some_and(|v| v < 1.0)
+                    && results["debt_to_equity"].value.is_some_and(|v| v >= 2.0)
+            })
+            .collect();
+        assert!(!expected.is_empty());
+        assert_eq!(found.iter().map(|m| m.row).collect::<Vec<_>>(), expected);
+        assert_eq!(found[0].kpis.len(), 3);
+        assert!(found[0].kpis["working_capital"].value.is_some_and(|v| v < 0.0));
+        // The first block cannot hold a current ratio below 1.
+        assert_eq!(stats, ScreenStats { blocks: 2, skipped_blocks: 1, rows_evaluated: BLOCK_ROWS / 4, matches: expected.len() });
+    }
+
+    #[test]
+    fn stops_at_the_limit_and_rejects_unknown_kpis() {
+        let store = archive("limit");
+        let query = Screen { predicates: vec![predicate("current_ratio", Comparison::Greater, 1.0)], limit: Some(3), ..Screen::default() };
+        let mut rows = Vec::new();
+        let stats = screen(&store, &query, |m| {
+            rows.push(m.row);
+            true
+        })
+        .unwrap();
+        assert_eq!(rows, [0, 1, 2]);
+        // Every row of the first block passes, so no predicate is evaluated.
+        assert_eq!(stats.rows_evaluated, 0);
+
+        let none = Screen { limit: Some(0), ..query };
+        assert_eq!(screen(&store, &none, |_| panic!("no match expected")).unwrap().matches, 0);
+
+        let unknown = Screen { predicates: vec![predicate("roe", Comparison::Greater, 0.1)], ..Screen::default() };
+        assert!(matches!(screen(&store, &unknown, |_| true), Err(ScreenError::UnknownKpi(key)) if key == "roe"));
+    }
+}
@@ -0,0 +1,360 @@
+use serde::{Deserialize, Serialize};
+use thiserror::Error;
+
+use crate::app_logic::calculator::{KpiResult, KpiStatus};
+use crate::app_logic::kpi_config::{get_kpi_definition, KpiDefinition, Term};
+use crate::app_logic::positions::{position_key, BalanceSheet, PositionId, POSITION_COUNT};
+
+// Every KPI is `a·x` or `(a·x) / (b·x)` over the position vector `x`, with
+// `a` and `b` the per-position coefficients of numerator and denominator.
+// Gradients, scenario sweeps and breakeven points then follow in closed form
+// instead of re-running the calculator per point.
+#[derive(Debug, Clone)]
+pub struct LinearKpi {
+    pub definition: &'static KpiDefinition,
+    numerator: [f64; POSITION_COUNT],
+    denominator: Option<[f64; POSITION_COUNT]>,
+}
+
+fn coefficients(terms: &[Term]) -> [f64; POSITION_COUNT] {
+    let mut coefficients = [0.0; POSITION_COUNT];
+    for term in terms {
+        for id in term.group.positions() {
+            coefficients[*id] += term.coefficient;
+        }
+    }
+    coefficients
+}
+
+fn dot(coefficients: &[f64; POSITION_COUNT], values: &[f64; POSITION_COUNT]) -> f64 {
+    coefficients.iter().zip(values).map(|(c, x)| c * x).sum()
+}
+
+impl LinearKpi {
+    pub fn new(definition: &'static KpiDefinition) -> Self {
+        LinearKpi {
+            definition,
+            numerator: coefficients(definition.numerator),
+            denominator: definition.denominator.map(coefficients),
+        }
+    }
+
+    pub fn get(key: &str) -> Option<Self> {
+        get_kpi_definition(key).map(LinearKpi::new)
+    }
+
+    // Per-position coefficients of numerator and denominator.
+    pub fn coefficients(&self) -> (&[f64; POSITION_COUNT], Option<&[f64; POSITION_COUNT]>) {
+        (&self.numerator, self.denominator.as_ref())
+    }
+
+    // (numerator, denominator) at `values`.
+    fn parts(&self, values: &[f64; POSITION_COUNT]) -> (f64, Option<f64>) {
+        (dot(&self.numerator, values), self.denominator.as_ref().map(|b| dot(b, values)))
+    }
+
+    // Numerator and denominator change per unit of `t` along `direction`.
+    fn slopes(&self, direction: &[f64; POSITION_COUNT]) -> (f64, Option<f64>) {
+        self.parts(direction)
+    }
+
+    pub fn evaluate(&self, sheet: &BalanceSheet) -> KpiResult {
+        ratio(self.parts(sheet.values()), self.definition.zero_status)
+    }
+
+    // Partial derivative with respect to every position the KPI reads:
+    // a_p for absolute values, (a_p·D - N·b_p) / D² for ratios.
+    // `Err` carries the status when the denominator is zero.
+    pub fn gradient(&self, sheet: &BalanceSheet) -> Result<Vec<(PositionId, f64)>, KpiStatus> {
+        let (numerator, denominator) = self.parts(sheet.values());
+        let zero = [0.0; POSITION_COUNT];
+        let b = self.denominator.as_ref().unwrap_or(&zero);
+        if denominator == Some(0.0) {
+            return Err(self.definition.zero_status);
+        }
+        let denominator = denominator.unwrap_or(1.0);
+
+        Ok((0..POSITION_COUNT)
+            .filter(|&id| self.numerator[id] != 0.0 || b[id] != 0.0)
+            .map(|id| (id, (self.numerator[id] * denominator - numerator * b[id]) / (denominator * denominator)))
+            .collect())
+    }
+
+    // Value of position `id` at which the KPI equals `target`, everything
+    // else unchanged. `None` when the KPI does not depend on `id` in a way
+    // that can reach `target`.
+    pub fn breakeven(&self, sheet: &BalanceSheet, id: PositionId, target: f64) -> Option<f64> {
+        let mut direction = [0.0; POSITION_COUNT];
+        direction[id] = 1.0;
+        self.solve(sheet, &direction, target).map(|t| sheet.get(id) + t)
+    }
+
+    // Step `t` along `direction` (x + t·d) at which the KPI equals `target`:
+    // (N + t·n) / (D + t·d) = T  =>  t = (T·D - N) / (n - T·d).
+    pub fn solve(&self, sheet: &BalanceSheet, direction: &[f64; POSITION_COUNT], target: f64) -> Option<f64> {
+        let (numerator, denominator) = self.parts(sheet.values());
+        let (numerator_slope, denominator_slope) = self.slopes(direction);
+        let (denominator, denominator_slope) = (denominator.unwrap_or(1.0), denominator_slope.unwrap_or(0.0));
+
+        let slope = numerator_slope - target * denominator_slope;
+        if slope == 0.0 {
+            return None;
+        }
+        let t = (target * denominator - numerator) / slope;
+        // The ratio is undefined where the denominator vanishes.
+        (t.is_finite() && denominator + t * denominator_slope != 0.0).then_some(t)
+    }
+}
+
+fn ratio((numerator, denominator): (f64, Option<f64>), zero_status: KpiStatus) -> KpiResult {
+    match denominator {
+        None => KpiResult::ok(numerator),
+        Some(denominator) if denominator != 0.0 => KpiResult::ok(numerator / denominator),
+        Some(_) => KpiResult::failed(zero_status),
+    }
+}
+
+// Position value needed to bring a KPI to one bound of its optimal range.
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct Breakeven {
+    pub position: &'static str,
+    pub threshold: f64,
+    pub value: f64,
+}
+
+// For every position the KPI reads and every bound of its optimal range, the
+// position value at which the KPI crosses that bound.
+pub fn optimal_range_breakevens(kpi: &LinearKpi, sheet: &BalanceSheet) -> Vec<Breakeven> {
+    let Ok(gradient) = kpi.gradient(sheet) else { return Vec::new() };
+    let mut breakevens = Vec::new();
+    for threshold in kpi.definition.optimal_range.bounds() {
+        for (id, _) in gradient.iter().filter(|(_, derivative)| *derivative != 0.0) {
+            if let Some(value) = kpi.breakeven(sheet, *id, threshold) {
+                breakevens.push(Breakeven { position: position_key(*id), threshold, value });
+            }
+        }
+    }
+    breakevens
+}
+
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq, Serialize, Deserialize)]
+#[serde(rename_all = "snake_case")]
+pub enum Shift {
+    // Each position scaled by (1 + step).
+    #[default]
+    Relative,
+    // `step` added to each position.
+    Absolute,
+}
+
+#[derive(Debug, Error, PartialEq)]
+pub enum ScenarioError {
+    #[error("scenario range needs finite bounds and a positive finite step (from {from}, to {to}, step {step})")]
+    InvalidRange { from: f64, to: f64, step: f64 },
+    #[error("scenario range has more than {limit} steps")]
+    TooManySteps { limit: usize },
+}
+
+// One dimension of a what-if grid: the positions moved together and the steps tried.
+#[derive(Debug, Clone, PartialEq)]
+pub struct ScenarioAxis {
+    pub positions: Vec<PositionId>,
+    pub shift: Shift,
+    pub steps: Vec<f64>,
+}
+
+impl ScenarioAxis {
+    // Steps `from`, `from + step`, ..., `to` (e.g. -0.30..=0.30 by 0.01), at
+    // most `max_steps` of them. The count is checked before anything is
+    // allocated, so a tiny step cannot ask for an unbounded grid.
+    pub fn range(
+        positions: Vec<PositionId>,
+        shift: Shift,
+        from: f64,
+        to: f64,
+        step: f64,
+        max_steps: usize,
+    ) -> Result<Self, ScenarioError> {
+        if !(from.is_finite() && to.is_finite() && step.is_finite() && step > 0.0) {
+            return Err(ScenarioError::InvalidRange { from, to, step });
+        }
+        // Infinite when `to - from` overflows; the comparison also rules
+        // out anything the cast to usize would saturate.
+        let intervals = if to >= from { ((to - from) / step + 1e-9).floor() } else { 0.0 };
+        if !(intervals < max_steps as f64) {
+            return Err(ScenarioError::TooManySteps { limit: max_steps });
+        }
+        let steps = (0..intervals as usize + 1).map(|i| from + i as f64 * step).collect();
+        Ok(ScenarioAxis { positions, shift, steps })
+    }
+
+    fn direction(&self, sheet: &BalanceSheet) -> [f64; POSITION_COUNT] {
+        let mut direction = [0.0; POSITION_COUNT];
+        for &id in &self.positions {
+            direction[id] = match self.shift {
+                Shift::Relative => sheet.get(id),
+                Shift::Absolute => 1.0,
+            };
+        }
+        direction
+    }
+}
+
+// Results over the cartesian product of the axes' steps, last axis fastest.
+// `values[k * points + p]` is KPI `k` at point `p`; NaN where the KPI is
+// undefined, with the reason in `status`.
+#[derive(Debug, Clone, PartialEq)]
+pub struct ScenarioGrid {
+    pub shape: Vec<usize>,
+    pub points: usize,
+    pub kpi_keys: Vec<String>,
+    pub values: Vec<f64>,
+    pub status: Vec<KpiStatus>,
+}
+
+impl ScenarioGrid {
+    pub fn values_column(&self, kpi: usize) -> &[f64] {
+        &self.values[kpi * self.points..(kpi + 1) * self.points]
+    }
+
+    pub fn status_column(&self, kpi: usize) -> &[KpiStatus] {
+        &self.status[kpi * self.points..(kpi + 1) * self.points]
+    }
+}
+
+// Each KPI's numerator and denominator are linear along every axis, so the
+// sheet is read once per KPI and axis; every grid point then costs one
+// addition per axis plus a division.
+pub fn evaluate_scenarios<K: AsRef<str>>(sheet: &BalanceSheet, kpi_keys: &[K], axes: &[ScenarioAxis]) -> ScenarioGrid {
+    let shape: Vec<usize> = axes.iter().map(|axis| axis.steps.len()).collect();
+    let points: usize = shape.iter().product();
+    let directions: Vec<[f64; POSITION_COUNT]> = axes.iter().map(|axis| axis.direction(sheet)).collect();
+
+    let mut values = Vec::with_capacity(kpi_keys.len() * points);
+    let mut status = Vec::with_capacity(kpi_keys.len() * points);
+    for key in kpi_keys {
+        let Some(kpi) = LinearKpi::get(key.as_ref()) else {
+            values.extend(std::iter::repeat(f64::NAN).take(points));
+            status.extend(std::iter::repeat(KpiStatus::UndefinedKpi).take(points));
+            continue;
+        };
+        let (numerator, denominator) = kpi.parts(sheet.values());
+        // Per axis and step: (numerator shift, denominator shift).
+        let shifts: Vec<Vec<(f64, f64)>> = axes
+            .iter()
+            .zip(&directions)
+            .map(|(axis, direction)| {
+                let (n, d) = kpi.slopes(direction);
+                axis.steps.iter().map(|t| (t * n, t * d.unwrap_or(0.0))).collect()
+            })
+            .collect();
+
+        let mut index = vec![0; axes.len()];
+        for _ in 0..points {
+            let (mut n, mut d) = (numerator, denominator);
+            for (axis, &i) in index.iter().enumerate() {
+                let (dn, dd) = shifts[axis][i];
+                n += dn;
+                d = d.map(|d| d + dd);
+            }
+            let result = ratio((n, d), kpi.definition.zero_status);
+            values.push(result.value.unwrap_or(f64::NAN));
+            status.push(result.status);
+
+            for axis in (0..axes.len()).rev() {
+                index[axis] += 1;
+                if index[axis] < shape[axis] {
+                    break;
+                }
+                index[axis] = 0;
+            }
+        }
+    }
+
+    ScenarioGrid {
+        shape,
+        points,
+        kpi_keys: kpi_keys.iter().map(|key| key.as_ref().to_string()).collect(),
+        values,
+        status,
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::kpi_config::KPI_DEFINITIONS;
+    use crate::app_logic::kpi_plan::KpiPlan;
+    use crate::app_logic::positions::pos;
+
+    fn sample_sheet() -> BalanceSheet {
+        let mut sheet = BalanceSheet::new();
+        for (number, value) in [(1, 50.0), (12, 400.0), (31, 200.0), (39, 300.0), (49, 80.0), (52, 350.0), (73, 250.0), (80, 300.0), (86, 30.0), (100, 100.0)] {
+            sheet.set(pos(number), value);
+        }
+        sheet
+    }
+
+    #[test]
+    fn gradient_matches_finite_differences() {
+        let sheet = sample_sheet();
+        for definition in KPI_DEFINITIONS.iter() {
+            let kpi = LinearKpi::new(definition);
+            let base = kpi.evaluate(&sheet).value.unwrap();
+            for (id, derivative) in kpi.gradient(&sheet).unwrap() {
+                let mut moved = sheet.clone();
+                moved.set(id, sheet.get(id) + 1e-3);
+                let numeric = (kpi.evaluate(&moved).value.unwrap() - base) / 1e-3;
+                assert!((numeric - derivative).abs() < 1e-6, "{} / {}", definition.key, position_key(id));
+            }
+        }
+    }
+
+    #[test]
+    fn scenario_grid_matches_calculator() {
+        let sheet = sample_sheet();
+        let keys = ["current_ratio", "debt_ratio", "working_capital"];
+        let bank_debt = ScenarioAxis::range(vec![pos(73), pos(80)], Shift::Relative, -0.3, 0.3, 0.01, 100).unwrap();
+        let cash = ScenarioAxis::range(vec![pos(49)], Shift::Absolute, 0.0, 100.0, 50.0, 100).unwrap();
+        let grid = evaluate_scenarios(&sheet, &keys, &[bank_debt.clone(), cash.clone()]);
+        assert_eq!(grid.shape, [61, 3]);
+
+        let plan = KpiPlan::compile(&keys);
+        let point = 10 * 3 + 2;
+        let mut moved = sheet.clone();
+        for id in [pos(73), pos(80)] {
+            moved.set(id, sheet.get(id) * (1.0 + bank_debt.steps[10]));
+        }
+        moved.set(pos(49), sheet.get(pos(49)) + cash.steps[2]);
+        for (k, expected) in plan.evaluate(&moved).iter().enumerate() {
+            assert!((grid.values_column(k)[point] - expected.value.unwrap()).abs() < 1e-9);
+        }
+    }
+
+    #[test]
+    fn breakeven_reaches_the_threshold() {
+        let sheet = sample_sheet();
+        let kpi = LinearKpi::get("current_ratio").unwrap();
+        let value = kpi.breakeven(&sheet, pos(80), 1.2).unwrap();
+        let mut moved = sheet.clone();
+        moved.set(pos(80), value);
+        assert!((kpi.evaluate(&moved).value.unwrap() - 1.2).abs() < 1e-12);
+
+        // Equity does not enter the current ratio.
+        assert_eq!(kpi.breakeven(&sheet, pos(52), 1.2), None);
+        assert!(optimal_range_breakevens(&kpi, &sheet).iter().any(|b| b.position == "80" && b.threshold == 2.0));
+    }
+
+    #[test]
+    fn scenario_range_is_bounded_before_allocating() {
+        let axis = |from: f64, to: f64, step: f64| ScenarioAxis::range(vec![pos(49)], Shift::Absolute, from, to, step, 61);
+        assert_eq!(axis(-0.3, 0.3, 0.01).unwrap().steps.len(), 61);
+        assert_eq!(axis(1.0, 0.0, 0.5).unwrap().steps, [1.0]);
+        assert_eq!(axis(-0.3, 0.31, 0.01), Err(ScenarioError::TooManySteps { limit: 61 }));
+        assert_eq!(axis(0.0, 1.0, 1e-300), Err(ScenarioError::TooManySteps { limit: 61 }));
+        assert_eq!(axis(-f64::MAX, f64::MAX, 1.0), Err(ScenarioError::TooManySteps { limit: 61 }));
+        for (from, to, step) in [(0.0, 1.0, 0.0), (0.0, 1.0, -0.1), (0.0, 1.0, f64::NAN), (f64::NEG_INFINITY, 1.0, 0.1), (0.0, f64::NAN, 0.1)] {
+            assert!(matches!(axis(from, to, step), Err(ScenarioError::InvalidRange { .. })), "{from} {to} {step}");
+        }
+    }
+}
@@ -0,0 +1,420 @@
+use std::collections::{BTreeMap, BTreeSet, HashMap};
+use std::fs::{self, File, OpenOptions};
+use std::io::{self, BufRead, BufReader, BufWriter, Write};
+use std::mem::size_of;
+use std::path::{Path, PathBuf};
+use std::sync::{mpsc, Arc, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::{Duration, Instant, SystemTime, UNIX_EPOCH};
+
+use serde::{Deserialize, Serialize};
+use thiserror::Error;
+
+use crate::app_logic::calculator::{BalanceCheck, KpiResult};
+use crate::app_logic::positions::BalanceSheet;
+
+// Power of two, so a (random) session id picks its shard with a mask.
+const SHARDS: usize = 16;
+
+#[derive(Debug, Error)]
+pub enum SessionError {
+    #[error("session log error: {0}")]
+    Io(#[from] io::Error),
+    #[error("cannot serialize session: {0}")]
+    Serialize(#[from] serde_json::Error),
+}
+
+// Random 128-bit id, carried in the session cookie as 32 hex digits.
+pub type SessionId = u128;
+
+pub fn new_session_id() -> SessionId {
+    rand::random()
+}
+
+pub fn format_session_id(id: SessionId) -> String {
+    format!("{id:032x}")
+}
+
+pub fn parse_session_id(text: &str) -> Option<SessionId> {
+    if text.len() != 32 {
+        return None;
+    }
+    SessionId::from_str_radix(text, 16).ok()
+}
+
+// What one submission of the input form produced: enough to show the
+// results page again or refill the form without recomputing anything.
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct Session {
+    pub kpi_keys: Vec<String>,
+    pub positions: BalanceSheet,
+    pub results: BTreeMap<String, KpiResult>,
+    // None when the submission did not carry every position on both sides
+    pub balance_check: Option<BalanceCheck>,
+}
+
+impl Session {
+    // Rough heap + inline footprint, used for the memory bound.
+    fn approx_bytes(&self) -> usize {
+        let keys: usize = self.kpi_keys.iter().map(|key| size_of::<String>() + key.len()).sum();
+        // BTreeMap nodes add roughly a pointer per entry on top of the pair.
+        let results: usize = self
+            .results
+            .keys()
+            .map(|key| size_of::<String>() + key.len() + size_of::<KpiResult>() + size_of::<usize>())
+            .sum();
+        size_of::<Session>() + keys + results
+    }
+}
+
+#[derive(Debug, Clone, Copy)]
+pub struct SessionConfig {
+    // Sessions expire this long after they were last read or written.
+    pub ttl: Duration,
+    // Approximate bound on the memory held by all sessions; the least
+    // recently used ones are dropped beyond it.
+    pub max_bytes: usize,
+}
+
+impl Default for SessionConfig {
+    fn default() -> Self {
+        SessionConfig { ttl: Duration::from_secs(2 * 60 * 60), max_bytes: 64 * 1024 * 1024 }
+    }
+}
+
+// The log is rewritten with only the live sessions once it holds at least
+// this many records and more than half of them are dead.
+const COMPACT_MIN_RECORDS: usize = 1024;
+
+struct Entry {
+    session: Arc<Session>,
+    last_used: Instant,
+    bytes: usize,
+}
+
+// `order` holds (last_used, id) for every entry, oldest first: the next
+// session to expire and the least recently used one are both its first key.
+#[derive(Default)]
+struct Shard {
+    entries: HashMap<SessionId, Entry>,
+    order: BTreeSet<(Instant, SessionId)>,
+    bytes: usize,
+}
+
+impl Shard {
+    fn remove(&mut self, id: SessionId) {
+        if let Some(entry) = self.entries.remove(&id) {
+            self.order.remove(&(entry.last_used, id));
+            self.bytes -= entry.bytes;
+        }
+    }
+
+    fn insert(&mut self, id: SessionId, session: Arc<Session>, last_used: Instant, budget: usize) {
+        self.remove(id);
+        let bytes = session.approx_bytes();
+        while self.bytes + bytes > budget {
+            let Some(&(_, oldest)) = self.order.first() else { break };
+            self.remove(oldest);
+        }
+        self.bytes += bytes;
+        self.order.insert((last_used, id));
+        self.entries.insert(id, Entry { session, last_used, bytes });
+    }
+
+    fn touch(&mut self, id: SessionId, now: Instant) -> Option<Arc<Session>> {
+        let entry = self.entries.get_mut(&id)?;
+        self.order.remove(&(entry.last_used, id));
+        self.order.insert((now, id));
+        entry.last_used = now;
+        Some(Arc::clone(&entry.session))
+    }
+
+    // Drops every session idle for `ttl` or longer.
+    fn sweep(&mut self, now: Instant, ttl: Duration) {
+        while let Some(&(last_used, id)) = self.order.first() {
+            if now.saturating_duration_since(last_used) < ttl {
+                break;
+            }
+            self.remove(id);
+        }
+    }
+}
+
+type Shards = Arc<Vec<Mutex<Shard>>>;
+
+// One line of the append-only log. Later lines for the same id replace
+// earlier ones; `at` is when the session was written, in Unix seconds.
+#[derive(Serialize, Deserialize)]
+struct LogRecord<S> {
+    id: String,
+    at: u64,
+    session: S,
+}
+
+// Appends log lines on its own thread, so requests only serialize the
+// record and queue it. An I/O error stops the thread and is returned by
+// every later insert.
+struct LogWriter {
+    lines: Option<mpsc::Sender<Vec<u8>>>,
+    thread: Option<JoinHandle<()>>,
+    error: Arc<Mutex<Option<io::Error>>>,
+}
+
+impl Drop for LogWriter {
+    // Closing the channel lets the thread write what is queued and exit.
+    fn drop(&mut self) {
+        self.lines.take();
+        if let Some(thread) = self.thread.take() {
+            let _ = thread.join();
+        }
+    }
+}
+
+// The log file as seen by the writer thread.
+struct LogFile {
+    path: PathBuf,
+    file: BufWriter<File>,
+    records: usize,
+    shards: Shards,
+    ttl: Duration,
+}
+
+impl LogFile {
+    // Writes `lines`, flushes, and compacts once most records are dead.
+    fn append(&mut self, lines: impl Iterator<Item = Vec<u8>>) -> io::Result<()> {
+        for line in lines {
+            self.file.write_all(&line)?;
+            self.records += 1;
+        }
+        self.file.flush()?;
+        let live: usize = self.shards.iter().map(|shard| shard.lock().unwrap().entries.len()).sum();
+        if self.records >= COMPACT_MIN_RECORDS && self.records > 2 * live {
+            (self.file, self.records) = compact(&self.path, &self.shards, self.ttl)?;
+        }
+        Ok(())
+    }
+}
+
+// Server-side sessions, bounded by TTL and memory with LRU eviction. The
+// map is split into shards behind their own locks, so concurrent requests
+// rarely wait on each other. With a log file every write is also appended
+// as one JSON line by a background thread; the log is replayed on startup
+// and rewritten with only the live sessions then and whenever most of its
+// records are dead, so sessions survive restarts and the file stays small.
+// Reads are not logged: after a restart a session's TTL counts from its
+// last write.
+pub struct SessionStore {
+    config: SessionConfig,
+    shards: Shards,
+    log: Option<LogWriter>,
+}
+
+impl SessionStore {
+    pub fn new(config: SessionConfig) -> Self {
+        SessionStore { config, shards: Arc::new((0..SHARDS).map(|_| Mutex::default()).collect()), log: None }
+    }
+
+    // Replays and compacts the log at `path` (created if missing), then
+    // appends to it. Unreadable lines, such as one cut short by a crash,
+    // are skipped.
+    pub fn open(config: SessionConfig, path: impl AsRef<Path>) -> Result<Self, SessionError> {
+        let path = path.as_ref().to_path_buf();
+        let mut store = SessionStore::new(config);
+        let now = (Instant::now(), unix_time());
+
+        match File::open(&path) {
+            Ok(file) => {
+                for line in BufReader::new(file).lines() {
+                    let Ok(record) = serde_json::from_str::<LogRecord<Session>>(&line?) else {
+                        continue;
+                    };
+                    let Some(id) = parse_session_id(&record.id) else {
+                        continue;
+                    };
+                    let age = Duration::from_secs(now.1.saturating_sub(record.at));
+                    let shard = &mut *store.shards[shard_index(id)].lock().unwrap();
+                    match now.0.checked_sub(age).filter(|_| age < config.ttl) {
+                        Some(last_used) => shard.insert(id, Arc::new(record.session), last_used, store.shard_budget()),
+                        None => shard.remove(id),
+                    }
+                }
+            }
+            Err(error) if error.kind() == io::ErrorKind::NotFound => {}
+            Err(error) => return Err(error.into()),
+        }
+
+        let (file, records) = compact(&path, &store.shards, config.ttl)?;
+        let log = LogFile { path, file, records, shards: Arc::clone(&store.shards), ttl: config.ttl };
+        let (lines, received) = mpsc::channel();
+        let error = Arc::new(Mutex::new(None));
+        let thread = {
+            let error = Arc::clone(&error);
+            thread::Builder::new().name("session-log".to_string()).spawn(move || write_log(log, received, error))?
+        };
+        store.log = Some(LogWriter { lines: Some(lines), thread: Some(thread), error });
+        Ok(store)
+    }
+
+    fn shard_budget(&self) -> usize {
+        self.config.max_bytes / SHARDS
+    }
+
+    pub fn get(&self, id: SessionId) -> Option<Arc<Session>> {
+        let now = Instant::now();
+        let mut shard = self.shards[shard_index(id)].lock().unwrap();
+        shard.sweep(now, self.config.ttl);
+        shard.touch(id, now)
+    }
+
+    // Stores `session` under `id`, replacing any previous one, and queues
+    // it for the log. The session is kept in memory even if logging fails.
+    pub fn insert(&self, id: SessionId, session: Session) -> Result<(), SessionError> {
+        let session = Arc::new(session);
+        let now = Instant::now();
+        {
+            let mut shard = self.shards[shard_index(id)].lock().unwrap();
+            shard.sweep(now, self.config.ttl);
+            shard.insert(id, Arc::clone(&session), now, self.shard_budget());
+        }
+
+        if let Some(log) = &self.log {
+            if let Some(error) = &*log.error.lock().unwrap() {
+                return Err(io::Error::new(error.kind(), error.to_string()).into());
+            }
+            let record = LogRecord { id: format_session_id(id), at: unix_time(), session: &*session };
+            let mut line = serde_json::to_vec(&record)?;
+            line.push(b'\n');
+            if let Some(lines) = &log.lines {
+                // Only fails once the writer thread has stopped on an error.
+                let _ = lines.send(line);
+            }
+        }
+        Ok(())
+    }
+
+    pub fn len(&self) -> usize {
+        self.shards.iter().map(|shard| shard.lock().unwrap().entries.len()).sum()
+    }
+}
+
+// The log writer thread: takes every line queued so far, then flushes.
+fn write_log(mut log: LogFile, lines: mpsc::Receiver<Vec<u8>>, error: Arc<Mutex<Option<io::Error>>>) {
+    while let Ok(line) = lines.recv() {
+        if let Err(failure) = log.append(std::iter::once(line).chain(lines.try_iter())) {
+            *error.lock().unwrap() = Some(failure);
+            return;
+        }
+    }
+}
+
+// Rewrites the log at `path` with only the live sessions (expired ones are
+// swept first) and reopens it for appending; returns the number of records.
+// Lines queued while this runs are appended afterwards, so the log never
+// misses a write.
+fn compact(path: &Path, shards: &[Mutex<Shard>], ttl: Duration) -> io::Result<(BufWriter<File>, usize)> {
+    let (now, now_unix) = (Instant::now(), unix_time());
+    let compacted = path.with_extension("compact");
+    let mut out = BufWriter::new(File::create(&compacted)?);
+    let mut records = 0;
+    for shard in shards {
+        // Serialize outside the lock; the sessions themselves are shared.
+        let live: Vec<(SessionId, Instant, Arc<Session>)> = {
+            let mut shard = shard.lock().unwrap();
+            shard.sweep(now, ttl);
+            shard.entries.iter().map(|(id, entry)| (*id, entry.last_used, Arc::clone(&entry.session))).collect()
+        };
+        for (id, last_used, session) in live {
+            let age = now.saturating_duration_since(last_used).as_secs();
+            let record = LogRecord { id: format_session_id(id), at: now_unix - age, session: &*session };
+            serde_json::to_writer(&mut out, &record)?;
+            out.write_all(b"\n")?;
+            records += 1;
+        }
+    }
+    out.into_inner().map_err(io::IntoInnerError::into_error)?.sync_all()?;
+    fs::rename(&compacted, path)?;
+    let file = OpenOptions::new().append(true).open(path)?;
+    Ok((BufWriter::new(file), records))
+}
+
+fn shard_index(id: SessionId) -> usize {
+    id as usize & (SHARDS - 1)
+}
+
+fn unix_time() -> u64 {
+    SystemTime::now().duration_since(UNIX_EPOCH).map_or(0, |elapsed| elapsed.as_secs())
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::calculator::{calculate_selected_kpis, validate_balance_sheet};
+    use crate::app_logic::positions::pos;
+
+    fn session(current_assets: f64) -> Session {
+        let mut positions = BalanceSheet::new();
+        positions.set(pos(35), current_assets);
+        positions.set(pos(80), 500.0);
+        let kpi_keys = vec!["current_ratio".to_string()];
+        Session {
+            results: calculate_selected_kpis(&positions, &kpi_keys),
+            balance_check: Some(validate_balance_sheet(&positions)),
+            kpi_keys,
+            positions,
+        }
+    }
+
+    #[test]
+    fn evicts_least_recently_used_and_expired_sessions() {
+        let one = session(1000.0).approx_bytes();
+        // Room for two sessions per shard; ids 1, 17 and 33 share shard 1.
+        let config = SessionConfig { ttl: Duration::from_secs(60), max_bytes: 2 * one * SHARDS };
+        let store = SessionStore::new(config);
+        store.insert(1, session(1.0)).unwrap();
+        store.insert(17, session(17.0)).unwrap();
+        assert!(store.get(1).is_some());
+        store.insert(33, session(33.0)).unwrap();
+        assert!(store.get(17).is_none());
+        assert_eq!(store.get(1).unwrap().positions.get(pos(35)), 1.0);
+        assert!(store.get(33).is_some());
+
+        // Expired sessions are swept from a shard whenever it is used.
+        let expiring = SessionStore::new(SessionConfig { ttl: Duration::ZERO, ..config });
+        expiring.insert(1, session(1.0)).unwrap();
+        expiring.insert(17, session(17.0)).unwrap();
+        assert_eq!(expiring.len(), 1);
+        assert!(expiring.get(17).is_none());
+        assert_eq!(expiring.len(), 0);
+    }
+
+    #[test]
+    fn sessions_survive_a_restart_through_the_log() {
+        let path = std::env::temp_dir().join(format!("kpi-sessions-{}.jsonl", format_session_id(new_session_id())));
+        let id = new_session_id();
+        {
+            let store = SessionStore::open(SessionConfig::default(), &path).unwrap();
+            store.insert(id, session(1000.0)).unwrap();
+            store.insert(id, session(2000.0)).unwrap();
+            store.insert(new_session_id(), session(3000.0)).unwrap();
+        }
+        // A crash may leave half a line behind.
+        OpenOptions::new().append(true).open(&path).unwrap().write_all(b"{\"id\":\"0\",").unwrap();
+
+        let store = SessionStore::open(SessionConfig::default(), &path).unwrap();
+        assert_eq!(store.len(), 2);
+        let restored = store.get(id).unwrap();
+        assert_eq!(restored.positions.get(pos(35)), 2000.0);
+        assert_eq!(restored.results["current_ratio"].value, Some(4.0));
+        assert_eq!(fs::read_to_string(&path).unwrap().lines().count(), 2);
+
+        // Rewriting one session over and over compacts the log as it runs.
+        for i in 0..2 * COMPACT_MIN_RECORDS {
+            store.insert(id, session(i as f64)).unwrap();
+        }
+        drop(store);
+        assert!(fs::read_to_string(&path).unwrap().lines().count() <= COMPACT_MIN_RECORDS);
+        let store = SessionStore::open(SessionConfig::default(), &path).unwrap();
+        assert_eq!(store.get(id).unwrap().positions.get(pos(35)), (2 * COMPACT_MIN_RECORDS - 1) as f64);
+        fs::remove_file(&path).unwrap();
+    }
+}
@@ -0,0 +1,556 @@
+use std::collections::BTreeMap;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
+use std::thread;
+
+use rand::{Rng, SeedableRng};
+use rand_chacha::ChaCha8Rng;
+use serde::{Deserialize, Serialize};
+use thiserror::Error;
+
+use crate::app_logic::kpi_config::CrisisThreshold;
+use crate::app_logic::positions::{BalanceSheet, PositionId};
+use crate::app_logic::sensitivity::LinearKpi;
+use crate::app_logic::workers::Workers;
+
+// Samples drawn from one RNG stream. Chunk `i` always uses stream `i` of the
+// seed, so results do not depend on how many threads run the chunks.
+const CHUNK_SAMPLES: usize = 1 << 16;
+// Resolution of the internal histograms percentiles are read from.
+const FINE_BINS: usize = 4096;
+pub const PERCENTILES: [f64; 9] = [1.0, 5.0, 10.0, 25.0, 50.0, 75.0, 90.0, 95.0, 99.0];
+
+#[derive(Debug, Error, PartialEq)]
+pub enum StressError {
+    #[error("invalid distribution: {0}")]
+    InvalidDistribution(String),
+    #[error("correlation must be between 0 and 1, got {0}")]
+    InvalidCorrelation(f64),
+}
+
+// Relative change applied to a position: value = base * (1 + draw).
+#[derive(Debug, Clone, Copy, PartialEq, Serialize, Deserialize)]
+#[serde(tag = "type", rename_all = "snake_case")]
+pub enum Distribution {
+    Normal { mean: f64, std_dev: f64 },
+    Triangular { min: f64, mode: f64, max: f64 },
+}
+
+impl Distribution {
+    fn validate(&self) -> Result<(), StressError> {
+        match *self {
+            Distribution::Normal { mean, std_dev } if mean.is_finite() && std_dev.is_finite() && std_dev >= 0.0 => Ok(()),
+            Distribution::Triangular { min, mode, max } if min.is_finite() && max.is_finite() && min <= mode && mode <= max => Ok(()),
+            other => Err(StressError::InvalidDistribution(format!("{:?}", other))),
+        }
+    }
+
+    // Draw from a standard normal `z`, so correlated groups can share part of it.
+    fn from_standard_normal(&self, z: f64) -> f64 {
+        match *self {
+            Distribution::Normal { mean, std_dev } => mean + std_dev * z,
+            Distribution::Triangular { .. } => self.from_uniform(normal_cdf(z)),
+        }
+    }
+
+    fn from_uniform(&self, u: f64) -> f64 {
+        match *self {
+            Distribution::Normal { .. } => unreachable!("normal draws go through from_standard_normal"),
+            Distribution::Triangular { min, mode, max } => {
+                let width = max - min;
+                if width == 0.0 {
+                    return min;
+                }
+                if u * width < mode - min {
+                    min + (u * width * (mode - min)).sqrt()
+                } else {
+                    max - ((1.0 - u) * width * (max - mode)).sqrt()
+                }
+            }
+        }
+    }
+}
+
+// A shock shared by a group of positions (e.g. receivables 39-45). With
+// `correlation` ρ each position's draw uses z = √ρ·Z + √(1-ρ)·ε, one common
+// factor Z per sample (a Gaussian copula for triangular shocks): 0 makes the
+// positions independent, 1 moves them together.
+#[derive(Debug, Clone, PartialEq)]
+pub struct Shock {
+    pub positions: Vec<PositionId>,
+    pub distribution: Distribution,
+    pub correlation: f64,
+}
+
+#[derive(Debug, Clone, PartialEq)]
+pub struct StressConfig {
+    pub samples: usize,
+    pub seed: u64,
+    pub shocks: Vec<Shock>,
+    pub histogram_bins: usize,
+}
+
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct Histogram {
+    pub min: f64,
+    pub max: f64,
+    pub counts: Vec<u64>,
+}
+
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct CrisisRisk {
+    pub threshold: CrisisThreshold,
+    pub probability: f64,
+}
+
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct KpiDistribution {
+    pub key: String,
+    pub mean: Option<f64>,
+    pub std_dev: Option<f64>,
+    pub min: Option<f64>,
+    pub max: Option<f64>,
+    // (percentile, value), for each entry of `PERCENTILES`.
+    pub percentiles: Vec<(f64, f64)>,
+    pub histogram: Option<Histogram>,
+    // Share of samples where the KPI was undefined (zero denominator).
+    pub undefined: f64,
+    pub crisis: Option<CrisisRisk>,
+}
+
+#[derive(Debug, Clone, PartialEq, Serialize)]
+pub struct StressResult {
+    pub samples: usize,
+    pub kpis: Vec<KpiDistribution>,
+}
+
+// Each KPI restricted to the shocked positions: numerator and denominator at
+// the base sheet plus one coefficient per shocked position (coefficient x base
+// value), so a sample costs one multiply-add per shocked position and KPI.
+struct CompiledKpi {
+    key: String,
+    numerator: f64,
+    denominator: Option<f64>,
+    numerator_shocks: Vec<f64>,
+    denominator_shocks: Vec<f64>,
+    crisis_threshold: Option<CrisisThreshold>,
+    defined: bool,
+}
+
+impl CompiledKpi {
+    fn new(key: &str, sheet: &BalanceSheet, shocked: &[PositionId]) -> Self {
+        let Some(kpi) = LinearKpi::get(key) else {
+            return CompiledKpi {
+                key: key.to_string(),
+                numerator: f64::NAN,
+                denominator: None,
+                numerator_shocks: vec![0.0; shocked.len()],
+                denominator_shocks: vec![0.0; shocked.len()],
+                crisis_threshold: None,
+                defined: false,
+            };
+        };
+        let (a, b) = kpi.coefficients();
+        let dot = |c: &[f64]| c.iter().zip(sheet.values()).map(|(c, x)| c * x).sum::<f64>();
+        CompiledKpi {
+            key: key.to_string(),
+            numerator: dot(a),
+            denominator: b.map(|b| dot(b)),
+            numerator_shocks: shocked.iter().map(|&id| a[id] * sheet.get(id)).collect(),
+            denominator_shocks: shocked.iter().map(|&id| b.map_or(0.0, |b| b[id]) * sheet.get(id)).collect(),
+            crisis_threshold: kpi.definition.crisis_threshold,
+            defined: true,
+        }
+    }
+
+    fn sample(&self, draws: &[f64]) -> Option<f64> {
+        if !self.defined {
+            return None;
+        }
+        let numerator = self.numerator + self.numerator_shocks.iter().zip(draws).map(|(c, d)| c * d).sum::<f64>();
+        match self.denominator {
+            None => Some(numerator),
+            Some(denominator) => {
+                let denominator = denominator + self.denominator_shocks.iter().zip(draws).map(|(c, d)| c * d).sum::<f64>();
+                (denominator != 0.0).then(|| numerator / denominator)
+            }
+        }
+    }
+}
+
+// Draws for every shocked position (one slot per position of every shock, in order).
+struct Sampler<'a> {
+    shocks: &'a [Shock],
+    spare_normal: Option<f64>,
+}
+
+impl<'a> Sampler<'a> {
+    fn standard_normal(&mut self, rng: &mut ChaCha8Rng) -> f64 {
+        if let Some(z) = self.spare_normal.take() {
+            return z;
+        }
+        // Marsaglia polar method; keeps the second variate for the next call.
+        loop {
+            let u = 2.0 * rng.random::<f64>() - 1.0;
+            let v = 2.0 * rng.random::<f64>() - 1.0;
+            let s = u * u + v * v;
+            if s > 0.0 && s < 1.0 {
+                let factor = (-2.0 * s.ln() / s).sqrt();
+                self.spare_normal = Some(v * factor);
+                return u * factor;
+            }
+        }
+    }
+
+    fn fill(&mut self, rng: &mut ChaCha8Rng, draws: &mut [f64]) {
+        let mut slot = 0;
+        for shock in self.shocks {
+            let correlation = shock.correlation;
+            let common = if correlation > 0.0 { self.standard_normal(rng) } else { 0.0 };
+            for _ in &shock.positions {
+                draws[slot] = match shock.distribution {
+                    Distribution::Triangular { .. } if correlation == 0.0 => shock.distribution.from_uniform(rng.random()),
+                    distribution => {
+                        let own = if correlation < 1.0 { self.standard_normal(rng) } else { 0.0 };
+                        let z = correlation.sqrt() * common + (1.0 - correlation).sqrt() * own;
+                        distribution.from_standard_normal(z)
+                    }
+                };
+                slot += 1;
+            }
+        }
+    }
+}
+
+// Φ(z) from the complementary error function (Numerical Recipes `erfcc`,
+// fractional error below 1.2e-7, ample for shaping triangular draws).
+fn normal_cdf(z: f64) -> f64 {
+    let x = -z / std::f64::consts::SQRT_2;
+    let t = 1.0 / (1.0 + 0.5 * x.abs());
+    let poly = -x * x - 1.26551223
+        + t * (1.00002368
+            + t * (0.37409196
+                + t * (0.09678418
+                    + t * (-0.18628806
+                        + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))));
+    let erfc = t * poly.exp();
+    0.5 * if x >= 0.0 { erfc } else { 2.0 - erfc }
+}
+
+// Draws chunk `chunk` (stream `chunk` of the seed) and hands every sample's
+// draws to `on_sample`.
+fn draw_chunk(config: &StressConfig, slots: usize, chunk: usize, mut on_sample: impl FnMut(&[f64])) {
+    let mut rng = ChaCha8Rng::seed_from_u64(config.seed);
+    rng.set_stream(chunk as u64);
+    let mut sampler = Sampler { shocks: &config.shocks, spare_normal: None };
+    let mut draws = vec![0.0; slots];
+    for _ in 0..CHUNK_SAMPLES.min(config.samples - chunk * CHUNK_SAMPLES) {
+        sampler.fill(&mut rng, &mut draws);
+        on_sample(&draws);
+    }
+}
+
+// Per-KPI accumulator over a fixed value range, mergeable across chunks.
+#[derive(Debug, Clone)]
+struct Accumulator {
+    low: f64,
+    high: f64,
+    counts: Vec<u64>,
+    below: u64,
+    above: u64,
+    undefined: u64,
+    breaches: u64,
+    sum: f64,
+    sum_squares: f64,
+    min: f64,
+    max: f64,
+}
+
+impl Accumulator {
+    fn new(low: f64, high: f64) -> Self {
+        Accumulator {
+            low,
+            high,
+            counts: vec![0; FINE_BINS],
+            below: 0,
+            above: 0,
+            undefined: 0,
+            breaches: 0,
+            sum: 0.0,
+            sum_squares: 0.0,
+            min: f64::INFINITY,
+            max: f64::NEG_INFINITY,
+        }
+    }
+
+    fn push(&mut self, value: Option<f64>, crisis: Option<CrisisThreshold>) {
+        let Some(value) = value else {
+            self.undefined += 1;
+            return;
+        };
+        if crisis.is_some_and(|threshold| threshold.is_breached(value)) {
+            self.breaches += 1;
+        }
+        self.sum += value;
+        self.sum_squares += value * value;
+        self.min = self.min.min(value);
+        self.max = self.max.max(value);
+        if value < self.low {
+            self.below += 1;
+        } else if value >= self.high {
+            self.above += 1;
+        } else {
+            let bin = ((value - self.low) / (self.high - self.low) * FINE_BINS as f64) as usize;
+            self.counts[bin.min(FINE_BINS - 1)] += 1;
+        }
+    }
+
+    fn merge(&mut self, other: &Accumulator) {
+        for (count, other) in self.counts.iter_mut().zip(&other.counts) {
+            *count += other;
+        }
+        self.below += other.below;
+        self.above += other.above;
+        self.undefined += other.undefined;
+        self.breaches += other.breaches;
+        self.sum += other.sum;
+        self.sum_squares += other.sum_squares;
+        self.min = self.min.min(other.min);
+        self.max = self.max.max(other.max);
+    }
+
+    fn defined(&self) -> u64 {
+        self.counts.iter().sum::<u64>() + self.below + self.above
+    }
+
+    // Interpolated within the fine bin holding the rank; tails outside the
+    // pilot range fall back to the observed min / max.
+    fn percentile(&self, percentile: f64) -> f64 {
+        let defined = self.defined();
+        let rank = (percentile / 100.0 * defined as f64).min(defined as f64);
+        if rank <= self.below as f64 {
+            return self.min;
+        }
+        let mut seen = self.below as f64;
+        let width = (self.high - self.low) / FINE_BINS as f64;
+        for (bin, &count) in self.counts.iter().enumerate() {
+            if count > 0 && seen + count as f64 >= rank {
+                let inside = (rank - seen) / count as f64;
+                return (self.low + (bin as f64 + inside) * width).clamp(self.min, self.max);
+            }
+            seen += count as f64;
+        }
+        self.max
+    }
+
+    // The fine histogram regrouped into `bins` equal bins over [min, max].
+    fn histogram(&self, bins: usize) -> Histogram {
+        let (min, max) = (self.min, self.max);
+        let bins = bins.max(1);
+        let mut counts = vec![0; bins];
+        let scale = if max > min { bins as f64 / (max - min) } else { 0.0 };
+        let bin_of = |value: f64| (((value - min) * scale) as usize).min(bins - 1);
+        let width = (self.high - self.low) / FINE_BINS as f64;
+        let (below_bin, above_bin) = (bin_of(min), bin_of(max));
+        counts[below_bin] += self.below;
+        counts[above_bin] += self.above;
+        for (bin, &count) in self.counts.iter().enumerate() {
+            if count > 0 {
+                let centre = (self.low + (bin as f64 + 0.5) * width).clamp(min, max);
+                counts[bin_of(centre)] += count;
+            }
+        }
+        Histogram { min, max, counts }
+    }
+
+    fn summary(&self, key: &str, samples: usize, bins: usize, crisis: Option<CrisisThreshold>) -> KpiDistribution {
+        let defined = self.defined();
+        let described = defined > 0;
+        let mean = self.sum / defined as f64;
+        let variance = (self.sum_squares / defined as f64 - mean * mean).max(0.0);
+        KpiDistribution {
+            key: key.to_string(),
+            mean: described.then_some(mean),
+            std_dev: described.then(|| variance.sqrt()),
+            min: described.then_some(self.min),
+            max: described.then_some(self.max),
+            percentiles: if described { PERCENTILES.iter().map(|&p| (p, self.percentile(p))).collect() } else { Vec::new() },
+            histogram: described.then(|| self.histogram(bins)),
+            undefined: self.undefined as f64 / samples as f64,
+            crisis: crisis.map(|threshold| CrisisRisk { threshold, probability: self.breaches as f64 / samples as f64 }),
+        }
+    }
+}
+
+// Running totals plus the chunks that finished ahead of their turn.
+struct InOrder {
+    totals: Vec<Accumulator>,
+    next: usize,
+    pending: BTreeMap<usize, Vec<Accumulator>>,
+}
+
+impl InOrder {
+    fn finish(&mut self, chunk: usize, accumulators: Vec<Accumulator>) {
+        if chunk != self.next {
+            self.pending.insert(chunk, accumulators);
+            return;
+        }
+        let mut ready = Some(accumulators);
+        while let Some(accumulators) = ready {
+            for (total, accumulator) in self.totals.iter_mut().zip(&accumulators) {
+                total.merge(accumulator);
+            }
+            self.next += 1;
+            ready = self.pending.remove(&self.next);
+        }
+    }
+}
+
+// Runs `config.samples` draws of the shocked sheet and summarizes every KPI.
+// A pilot chunk fixes each KPI's histogram range; the other chunks then run
+// on the shared worker threads and their accumulators are merged in chunk order, so a given
+// seed always gives the same result.
+pub fn run_stress_test<K: AsRef<str>>(
+    sheet: &BalanceSheet,
+    kpi_keys: &[K],
+    config: &StressConfig,
+) -> Result<StressResult, StressError> {
+    for shock in &config.shocks {
+        shock.distribution.validate()?;
+        if !(0.0..=1.0).contains(&shock.correlation) {
+            return Err(StressError::InvalidCorrelation(shock.correlation));
+        }
+    }
+    let shocked: Vec<PositionId> = config.shocks.iter().flat_map(|shock| shock.positions.iter().copied()).collect();
+    let kpis: Vec<CompiledKpi> = kpi_keys.iter().map(|key| CompiledKpi::new(key.as_ref(), sheet, &shocked)).collect();
+
+    let run_chunk = |chunk: usize, ranges: &[(f64, f64)]| -> Vec<Accumulator> {
+        let mut accumulators: Vec<Accumulator> = ranges.iter().map(|&(low, high)| Accumulator::new(low, high)).collect();
+        draw_chunk(config, shocked.len(), chunk, |draws| {
+            for (kpi, accumulator) in kpis.iter().zip(accumulators.iter_mut()) {
+                accumulator.push(kpi.sample(draws), kpi.crisis_threshold);
+            }
+        });
+        accumulators
+    };
+
+    let chunks = config.samples.div_ceil(CHUNK_SAMPLES);
+    // Pilot: the first chunk's values (NaN where undefined) fix each KPI's
+    // range and are then binned into the totals, so chunk 0 is drawn once.
+    let mut pilot: Vec<Vec<f64>> = kpis.iter().map(|_| Vec::new()).collect();
+    if chunks > 0 {
+        draw_chunk(config, shocked.len(), 0, |draws| {
+            for (kpi, values) in kpis.iter().zip(pilot.iter_mut()) {
+                values.push(kpi.sample(draws).unwrap_or(f64::NAN));
+            }
+        });
+    }
+    let ranges: Vec<(f64, f64)> = pilot
+        .iter()
+        .map(|values| {
+            let defined = values.iter().filter(|v| !v.is_nan());
+            let (min, max) = defined.fold((f64::INFINITY, f64::NEG_INFINITY), |(min, max), &v| (min.min(v), max.max(v)));
+            if min > max {
+                return (0.0, 1.0);
+            }
+            let margin = ((max - min) * 0.25).max(max.abs() * 1e-9).max(1e-12);
+            (min - margin, max + margin)
+        })
+        .collect();
+    let mut totals: Vec<Accumulator> = ranges.iter().map(|&(low, high)| Accumulator::new(low, high)).collect();
+    for ((total, kpi), values) in totals.iter_mut().zip(&kpis).zip(pilot) {
+        for value in values {
+            total.push((!value.is_nan()).then_some(value), kpi.crisis_threshold);
+        }
+    }
+
+    // Finished chunks are folded into the totals in chunk order as soon as
+    // their predecessors are in; only chunks that finish early wait.
+    let next = AtomicUsize::new(1);
+    let merged = Mutex::new(InOrder { totals, next: 1, pending: BTreeMap::new() });
+    let workers = Workers::acquire(chunks.saturating_sub(1));
+    thread::scope(|scope| {
+        for _ in 0..workers.count() {
+            scope.spawn(|| loop {
+                let chunk = next.fetch_add(1, Ordering::Relaxed);
+                if chunk >= chunks {
+                    break;
+                }
+                let accumulators = run_chunk(chunk, &ranges);
+                merged.lock().unwrap().finish(chunk, accumulators);
+            });
+        }
+    });
+    let totals = merged.into_inner().unwrap().totals;
+
+    Ok(StressResult {
+        samples: config.samples,
+        kpis: kpis
+            .iter()
+            .zip(&totals)
+            .map(|(kpi, total)| total.summary(&kpi.key, config.samples.max(1), config.histogram_bins, kpi.crisis_threshold))
+            .collect(),
+    })
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::positions::pos;
+
+    fn sample_sheet() -> BalanceSheet {
+        let mut sheet = BalanceSheet::new();
+        for (number, value) in [(12, 500.0), (39, 300.0), (49, 100.0), (52, 250.0), (80, 300.0), (86, 40.0), (100, 60.0)] {
+            sheet.set(pos(number), value);
+        }
+        sheet
+    }
+
+    fn config(samples: usize, shocks: Vec<Shock>) -> StressConfig {
+        StressConfig { samples, seed: 7, shocks, histogram_bins: 20 }
+    }
+
+    #[test]
+    fn seeded_runs_are_reproducible() {
+        let shocks = vec![Shock {
+            positions: vec![pos(39), pos(80)],
+            distribution: Distribution::Normal { mean: 0.0, std_dev: 0.2 },
+            correlation: 0.5,
+        }];
+        let keys = ["current_ratio", "debt_to_equity"];
+        let first = run_stress_test(&sample_sheet(), &keys, &config(150_000, shocks.clone())).unwrap();
+        let second = run_stress_test(&sample_sheet(), &keys, &config(150_000, shocks)).unwrap();
+        assert_eq!(first, second);
+        assert_eq!(first.kpis[1].histogram.as_ref().unwrap().counts.iter().sum::<u64>(), 150_000);
+    }
+
+    #[test]
+    fn crisis_probability_matches_the_shock() {
+        // debt_to_equity = (300 + 40 + 60) / (250 * (1 + s)) > 2.0  <=>  s < -0.2.
+        let shocks = vec![Shock {
+            positions: vec![pos(52)],
+            distribution: Distribution::Triangular { min: -0.4, mode: 0.0, max: 0.4 },
+            correlation: 0.0,
+        }];
+        let result = run_stress_test(&sample_sheet(), &["debt_to_equity"], &config(200_000, shocks)).unwrap();
+        let crisis = result.kpis[0].crisis.as_ref().unwrap();
+        // P(s < -0.2) for a symmetric triangle on [-0.4, 0.4] is 0.125.
+        assert!((crisis.probability - 0.125).abs() < 0.005, "{}", crisis.probability);
+
+        let median = result.kpis[0].percentiles.iter().find(|(p, _)| *p == 50.0).unwrap().1;
+        assert!((median - 400.0 / 250.0).abs() < 0.01, "{}", median);
+    }
+
+    #[test]
+    fn rejects_invalid_distributions() {
+        let shocks = vec![Shock {
+            positions: vec![pos(49)],
+            distribution: Distribution::Triangular { min: 0.1, mode: 0.0, max: 0.2 },
+            correlation: 0.0,
+        }];
+        assert!(matches!(
+            run_stress_test(&sample_sheet(), &["cash_ratio"], &config(10, shocks)),
+            Err(StressError::InvalidDistribution(_))
+        ));
+    }
+}
@@ -1,5 +1,13 @@
 use std::collections::BTreeMap;
 
+use crate::app_logic::calculator::{validate_balance_sheet, BalanceCheck};
+use crate::app_logic::positions::{position_index, BalanceSheet, PositionSet};
+
+const INVALID_AMOUNT: &str = "Valore non valido. Inserire un numero (es. 1.234,56)";
+// Longest amount (or form field name) read into a stack buffer; anything
+// longer is not a balance sheet amount.
+const MAX_FIELD_LEN: usize = 64;
+
 pub fn validate_financial_data(
     form_data: &BTreeMap<String, String>,
     required_positions: &[String],
@@ -7,24 +15,21 @@ pub fn validate_financial_data(
     let mut validated_data = BTreeMap::new();
     let mut errors = BTreeMap::new();
 
+    // One buffer for every "pos_<key>" lookup.
+    let mut field_name = String::from("pos_");
     for pos in required_positions {
-        let pos_str = pos.as_str();
-        let field_name = format!("pos_{}", pos_str);
-
-        let zero = "0".to_string();
-        let value_str = form_data.get(&field_name).unwrap_or(&zero);
-
-        // Replace comma with dot (European numeric format)
-        let value_str_clean = value_str.replace(',', ".");
+        field_name.truncate("pos_".len());
+        field_name.push_str(pos);
 
-        match value_str_clean.parse::<f64>() {
-            Ok(value) => {
-                validated_data.insert(pos_str.to_string(), value);
+        // A missing or blank field counts as zero.
+        let value = form_data.get(field_name.as_str()).map_or(Some(0.0), |raw| parse_form_amount(raw));
+        match value {
+            Some(value) => {
+                validated_data.insert(pos.clone(), value);
             }
-            Err(_) => {
-                validated_data.insert(pos_str.to_string(), 0.0);
-                validated_data.insert(format!("raw_{}", pos_str), value_str.parse().unwrap_or(0.0));
-                errors.insert(field_name, "Valore non valido. Inserire un numero (es. 1234,56)".to_string());
+            None => {
+                validated_data.insert(pos.clone(), 0.0);
+                errors.insert(field_name.clone(), INVALID_AMOUNT.to_string());
             }
         }
     }
@@ -32,6 +37,222 @@ pub fn validate_financial_data(
     (validated_data, errors)
 }
 
+fn parse_form_amount(raw: &str) -> Option<f64> {
+    if raw.trim().is_empty() {
+        Some(0.0)
+    } else {
+        parse_italian_amount(raw)
+    }
+}
+
+// Reads an amount written the Italian way: "1.234.567,89", "-1.234,5",
+// "(1.234,56)" for a negative, an optional "€" before or after, spaces or
+// apostrophes as thousands separators. Without a decimal comma a single dot
+// is a thousands separator only where it groups digits correctly ("1.234" is
+// 1234, "1.5" and "0.125" are decimals), so machine-formatted "1234.56" is
+// still read as before.
+pub fn parse_italian_amount(raw: &str) -> Option<f64> {
+    let mut text = raw.trim();
+    let mut negative = false;
+    if let Some(inner) = text.strip_prefix('(').and_then(|t| t.strip_suffix(')')) {
+        negative = true;
+        text = inner.trim();
+    }
+    text = strip_euro(text);
+    if let Some(rest) = text.strip_prefix('-') {
+        if negative {
+            return None;
+        }
+        negative = true;
+        text = strip_euro(rest.trim_start());
+    } else if let Some(rest) = text.strip_prefix('+') {
+        text = strip_euro(rest.trim_start());
+    }
+
+    let (integer, fraction) = match text.split_once(',') {
+        Some((integer, fraction)) => (integer, Some(fraction)),
+        None => match text.split_once('.') {
+            // "1234.56": one dot that does not group thousands is the decimal point.
+            Some((integer, fraction)) if !fraction.contains('.') && !is_grouped(text) => (integer, Some(fraction)),
+            _ => (text, None),
+        },
+    };
+
+    if !(integer.bytes().all(|b| b.is_ascii_digit()) || is_grouped(integer)) {
+        return None;
+    }
+    // "12," has a separator but no fraction digits.
+    let fraction = fraction.unwrap_or_default();
+    if (fraction.is_empty() && text.len() > integer.len()) || !fraction.bytes().all(|b| b.is_ascii_digit()) {
+        return None;
+    }
+
+    // Up to 15 significant digits the mantissa and the power of ten are both
+    // exact in an f64, so one division gives the correctly rounded value.
+    let mut mantissa: u64 = 0;
+    let mut digits = 0;
+    for byte in integer.bytes().chain(fraction.bytes()).filter(u8::is_ascii_digit) {
+        mantissa = mantissa.wrapping_mul(10).wrapping_add(u64::from(byte - b'0'));
+        digits += 1;
+    }
+    if digits == 0 {
+        return None;
+    }
+    let value = if digits <= 15 && fraction.len() < POWERS_OF_TEN.len() {
+        mantissa as f64 / POWERS_OF_TEN[fraction.len()]
+    } else {
+        parse_digits(integer, fraction)?
+    };
+    value.is_finite().then_some(if negative { -value } else { value })
+}
+
+const POWERS_OF_TEN: [f64; 23] = [
+    1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20,
+    1e21, 1e22,
+];
+
+// Longer amounts: the digits copied into a stack buffer as "123.45" and
+// handed to the standard parser.
+fn parse_digits(integer: &str, fraction: &str) -> Option<f64> {
+    let mut buffer = [0u8; MAX_FIELD_LEN];
+    let mut len = 0;
+    let digits = integer.bytes().filter(u8::is_ascii_digit).chain(Some(b'.')).chain(fraction.bytes());
+    for byte in digits {
+        *buffer.get_mut(len)? = byte;
+        len += 1;
+    }
+    std::str::from_utf8(&buffer[..len]).ok()?.parse().ok()
+}
+
+fn strip_euro(text: &str) -> &str {
+    let text = text.strip_prefix('€').map_or(text, str::trim_start);
+    text.strip_suffix('€').map_or(text, str::trim_end)
+}
+
+// Digits in groups of three after a first group of one to three digits (not
+// starting with 0), all separated by the same '.', ' ', NBSP or '\''.
+fn is_grouped(integer: &str) -> bool {
+    let Some(separator) = integer.chars().find(|c| !c.is_ascii_digit()) else {
+        return false;
+    };
+    if !matches!(separator, '.' | ' ' | '\u{a0}' | '\u{202f}' | '\'') {
+        return false;
+    }
+    let mut groups = integer.split(separator);
+    let first = groups.next().unwrap_or_default();
+    let first_ok = (1..=3).contains(&first.len()) && !first.starts_with('0') && first.bytes().all(|b| b.is_ascii_digit());
+    first_ok && groups.all(|group| group.len() == 3 && group.bytes().all(|b| b.is_ascii_digit()))
+}
+
+// A submitted input form, read in one pass over the URL-encoded body. Each
+// `pos_*` value is percent-decoded into a stack buffer and parsed straight
+// into its slot of the compact layout; only the `kpi_keys[]` values are
+// allocated. Which positions must be valid depends on the selected KPIs, so
+// invalid fields are only remembered here and reported by `validate`.
+#[derive(Debug, Clone, Default)]
+pub struct PositionForm {
+    pub kpi_keys: Vec<String>,
+    values: BalanceSheet,
+    seen: PositionSet,
+    invalid: PositionSet,
+}
+
+impl PositionForm {
+    pub fn decode(body: &[u8]) -> Self {
+        let mut form = PositionForm::default();
+        let mut key_buffer = [0u8; MAX_FIELD_LEN];
+        let mut value_buffer = [0u8; MAX_FIELD_LEN];
+
+        for pair in body.split(|b| *b == b'&').filter(|pair| !pair.is_empty()) {
+            let (key, value) = match pair.iter().position(|b| *b == b'=') {
+                Some(at) => (&pair[..at], &pair[at + 1..]),
+                None => (pair, &pair[pair.len()..]),
+            };
+            let Some(key) = percent_decode(key, &mut key_buffer) else {
+                continue;
+            };
+            if key == "kpi_keys[]" {
+                // Longer values are no KPI key.
+                if let Some(kpi) = percent_decode(value, &mut value_buffer) {
+                    form.kpi_keys.push(kpi.to_string());
+                }
+            } else if let Some(id) = key.strip_prefix("pos_").and_then(position_index) {
+                // A repeated field replaces the earlier one.
+                form.seen.insert(id);
+                match percent_decode(value, &mut value_buffer).and_then(parse_form_amount) {
+                    Some(amount) => {
+                        form.values.set(id, amount);
+                        form.invalid.remove(id);
+                    }
+                    None => {
+                        form.values.set(id, 0.0);
+                        form.invalid.insert(id);
+                    }
+                }
+            }
+        }
+        form
+    }
+
+    // Positions that had a field in the body.
+    pub fn seen(&self) -> PositionSet {
+        self.seen
+    }
+
+    // The `required` positions as a balance sheet (missing or blank fields
+    // are zero, other positions are left out) and a message per field whose
+    // value is not a valid amount.
+    pub fn validate(&self, required: PositionSet) -> (BalanceSheet, BTreeMap<String, String>) {
+        let mut sheet = BalanceSheet::new();
+        for id in required.intersection(self.seen).iter() {
+            sheet.set(id, self.values.get(id));
+        }
+        let errors = required
+            .intersection(self.invalid)
+            .keys()
+            .map(|key| (format!("pos_{}", key), INVALID_AMOUNT.to_string()))
+            .collect();
+        (sheet, errors)
+    }
+
+    // The balance check over every submitted value; None unless the body
+    // carried a valid amount for each of `inputs` (the fields the input page
+    // has on both sides, blank ones counting as zero), since a partial sheet
+    // would always look unbalanced.
+    pub fn balance_check(&self, inputs: PositionSet) -> Option<BalanceCheck> {
+        let submitted = self.seen.difference(self.invalid);
+        inputs.difference(submitted).is_empty().then(|| validate_balance_sheet(&self.values))
+    }
+}
+
+// application/x-www-form-urlencoded decoding ('+' is a space, "%XX" a byte)
+// into `buffer`; None when the result does not fit or is not UTF-8.
+fn percent_decode<'b>(input: &[u8], buffer: &'b mut [u8]) -> Option<&'b str> {
+    let mut len = 0;
+    let mut i = 0;
+    while i < input.len() {
+        let byte = match input[i] {
+            b'+' => b' ',
+            b'%' => match (input.get(i + 1).and_then(hex), input.get(i + 2).and_then(hex)) {
+                (Some(high), Some(low)) => {
+                    i += 2;
+                    high * 16 + low
+                }
+                _ => b'%',
+            },
+            byte => byte,
+        };
+        *buffer.get_mut(len)? = byte;
+        len += 1;
+        i += 1;
+    }
+    std::str::from_utf8(&buffer[..len]).ok()
+}
+
+fn hex(digit: &u8) -> Option<u8> {
+    (*digit as char).to_digit(16).map(|d| d as u8)
+}
+
 #[allow(dead_code)]
 pub fn validate_kpi_selection(
     selected_kpi_keys: &[String],
@@ -52,3 +273,92 @@ pub fn validate_kpi_selection(
 
     (true, None)
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::app_logic::constants::AppState;
+    use crate::app_logic::positions::{pos, pos_nca, position_key, PositionId};
+
+    #[test]
+    fn parses_italian_amounts() {
+        let cases = [
+            ("1234,56", Some(1234.56)),
+            ("1.234.567,89", Some(1_234_567.89)),
+            ("1.234", Some(1234.0)),
+            ("1234.56", Some(1234.56)),
+            ("0.125", Some(0.125)),
+            ("-1.234,5", Some(-1234.5)),
+            ("(1.234,56)", Some(-1234.56)),
+            ("€ 1.234,56", Some(1234.56)),
+            ("-€ 12,00", Some(-12.0)),
+            ("1 234 567,8 €", Some(1_234_567.8)),
+            ("1'234,5", Some(1234.5)),
+            ("12345678901234567,891", Some(12_345_678_901_234_567.891)),
+            ("1.23.456", None),
+            ("12,34,5", None),
+            ("1.234 567", None),
+            ("(-5)", None),
+            ("abc", None),
+            ("12,", None),
+            ("", None),
+        ];
+        for (raw, expected) in cases {
+            assert_eq!(parse_italian_amount(raw), expected, "{raw:?}");
+        }
+    }
+
+    #[test]
+    fn invalid_values_are_reported_without_extra_keys() {
+        let form: BTreeMap<String, String> =
+            [("pos_31", "1.500,00"), ("pos_49", "dieci"), ("pos_50", "")].map(|(k, v)| (k.to_string(), v.to_string())).into();
+        let required = ["31", "49", "50", "52"].map(String::from);
+        let (data, errors) = validate_financial_data(&form, &required);
+
+        assert_eq!(data.len(), 4);
+        assert_eq!(data["31"], 1500.0);
+        assert_eq!(data["49"], 0.0);
+        assert_eq!(data["50"], 0.0);
+        assert_eq!(errors.keys().collect::<Vec<_>>(), ["pos_49"]);
+    }
+
+    #[test]
+    fn decodes_the_form_in_one_pass() {
+        let body = b"kpi_keys%5B%5D=current_ratio&pos_31=1.234%2C56&pos_39.NCA=%E2%82%AC+10&pos_49=x&pos_80=&kpi_keys[]=cash_ratio&other=1";
+        let form = PositionForm::decode(body);
+        assert_eq!(form.kpi_keys, ["current_ratio", "cash_ratio"]);
+
+        let required: PositionSet = [pos(31), pos_nca(39), pos(49), pos(79)].into_iter().collect();
+        let (sheet, errors) = form.validate(required);
+        assert_eq!(sheet.get(pos(31)), 1234.56);
+        assert_eq!(sheet.get(pos_nca(39)), 10.0);
+        assert_eq!(sheet.get(pos(80)), 0.0);
+        assert_eq!(errors.keys().collect::<Vec<_>>(), ["pos_49"]);
+        assert!(form.seen().contains(pos(80)) && !form.seen().contains(pos(79)));
+        assert_eq!(form.balance_check(AppState::new().balance_inputs), None);
+    }
+
+    #[test]
+    fn checks_the_balance_when_every_field_of_the_input_page_was_submitted() {
+        // Exactly the fields the input page renders for one KPI.
+        let app = AppState::new();
+        let fields = app.input_fields(&["current_ratio"]);
+        let ids: Vec<PositionId> = fields.assets.iter().chain(&fields.liabilities_equity).map(|(id, _)| *id).collect();
+        assert!(ids.contains(&pos(51)) && ids.contains(&pos_nca(39)) && ids.contains(&pos(100)));
+        assert!(fields.assets.iter().any(|(id, read)| *id == pos(1) && !read));
+
+        let mut body: Vec<String> = vec!["kpi_keys%5B%5D=current_ratio".to_string()];
+        body.extend(ids.iter().map(|id| format!("pos_{}=", position_key(*id))));
+        body.push("pos_31=100".to_string());
+        body.push("pos_80=100".to_string());
+        let check = PositionForm::decode(body.join("&").as_bytes()).balance_check(app.balance_inputs);
+        assert_eq!(check.map(|check| check.valid), Some(true));
+
+        body.pop();
+        let check = PositionForm::decode(body.join("&").as_bytes()).balance_check(app.balance_inputs);
+        assert_eq!(check.map(|check| check.valid), Some(false));
+
+        body.retain(|pair| pair != "pos_100=");
+        assert_eq!(PositionForm::decode(body.join("&").as_bytes()).balance_check(app.balance_inputs), None);
+    }
+}
@@ -0,0 +1,86 @@
+use std::sync::{Condvar, Mutex};
+use std::thread;
+
+// Worker threads the parallel jobs (stress tests, peer index builds, XLSX
+// imports, ledger aggregation) are running between them. Each job takes its
+// threads from one budget of `available_parallelism`, so concurrent requests
+// share the cores instead of each starting a thread per core.
+static BUSY: Mutex<usize> = Mutex::new(0);
+static RELEASED: Condvar = Condvar::new();
+
+// Threads granted to one job, given back to the budget when dropped.
+#[derive(Debug)]
+pub struct Workers {
+    count: usize,
+}
+
+impl Workers {
+    // Up to `wanted` threads: at least one, waiting while the whole budget is
+    // taken, and no more than are free. Nothing is granted for no work.
+    pub fn acquire(wanted: usize) -> Self {
+        if wanted == 0 {
+            return Self { count: 0 };
+        }
+        let budget = thread::available_parallelism().map_or(1, |n| n.get());
+        let mut busy = BUSY.lock().unwrap();
+        while *busy >= budget {
+            busy = RELEASED.wait(busy).unwrap();
+        }
+        let count = wanted.min(budget - *busy);
+        *busy += count;
+        Self { count }
+    }
+
+    // One more thread if the budget has one free, without waiting.
+    pub fn try_grow(&mut self) -> bool {
+        let budget = thread::available_parallelism().map_or(1, |n| n.get());
+        let mut busy = BUSY.lock().unwrap();
+        if *busy >= budget {
+            return false;
+        }
+        *busy += 1;
+        self.count += 1;
+        true
+    }
+
+    pub fn count(&self) -> usize {
+        self.count
+    }
+}
+
+impl Drop for Workers {
+    fn drop(&mut self) {
+        if self.count > 0 {
+            *BUSY.lock().unwrap() -= self.count;
+            RELEASED.notify_all();
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn jobs_share_one_budget() {
+        let budget = thread::available_parallelism().map_or(1, |n| n.get());
+        assert_eq!(Workers::acquire(0).count(), 0);
+
+        let first = Workers::acquire(budget + 3);
+        assert!(first.count() >= 1 && first.count() <= budget);
+        let (sender, receiver) = std::sync::mpsc::channel();
+        let waiting = thread::spawn(move || sender.send(Workers::acquire(2).count()).unwrap());
+        if first.count() == budget {
+            // Every thread is taken: the second job waits for the first.
+            assert!(receiver.recv_timeout(std::time::Duration::from_millis(50)).is_err());
+        }
+        drop(first);
+        let second = receiver.recv().unwrap();
+        assert!(second >= 1 && second <= 2.min(budget));
+        waiting.join().unwrap();
+
+        let mut job = Workers::acquire(1);
+        while job.try_grow() {}
+        assert!(job.count() >= 1 && job.count() <= budget);
+    }
+}
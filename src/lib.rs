@@ -0,0 +1,426 @@
+pub mod api;
+pub mod app_logic;
+mod live;
+mod metrics;
+mod page_cache;
+
+use axum::{
+    extract::{DefaultBodyLimit, Form, Query, RawForm, State},
+    http::{header, HeaderMap, HeaderValue},
+    response::{Html, IntoResponse, Redirect, Response},
+    routing::{get, post},
+    Router,
+};
+use askama::Template;
+use serde::Deserialize;
+use std::collections::BTreeMap;
+use std::sync::{Arc, RwLock};
+use tower_http::services::ServeDir;
+
+use app_logic::{
+    calculator::{calculate_selected_kpis, BalanceCheck, KpiResult},
+    columnar::ColumnStore,
+    kpi_config::KpiDetails,
+    kpi_requirements_logic::get_required_positions,
+    mappings_config::{ChartMapping, MappingError},
+    peers::PeerIndex,
+    positions::{position_key, BalanceSheet, PositionId},
+    sessions::{format_session_id, new_session_id, parse_session_id, Session, SessionConfig, SessionId, SessionStore},
+    validators::PositionForm,
+};
+use metrics::{Metrics, Stage};
+use page_cache::{CachedPage, PageLru};
+
+// Distinct KPI selections whose rendered input page is kept in memory.
+const INPUT_PAGE_CACHE_CAPACITY: usize = 256;
+const SESSION_COOKIE: &str = "kpi_session";
+// Append-only file that keeps sessions across restarts; memory only when unset.
+const SESSION_LOG_ENV: &str = "KPI_SESSION_LOG";
+// Directory of the column store screened by /api/v1/screen; no archive when unset.
+const ARCHIVE_ENV: &str = "KPI_ARCHIVE";
+// JSON chart of accounts mapping used by /api/v1/ledger; disabled when unset.
+const CHART_MAPPING_ENV: &str = "KPI_CHART_MAPPING";
+
+// Everything handlers share: metadata tables built once at startup, the
+// rendered pages built from them, the sessions of the results pages, the
+// peer index the API ranks results against, the archive it screens, the
+// chart of accounts mapping for ledger uploads and the counters behind
+// /metrics.
+pub struct WebState {
+    app: app_logic::constants::AppState,
+    select_kpi_page: CachedPage,
+    input_pages: PageLru,
+    sessions: SessionStore,
+    peers: RwLock<PeerIndex>,
+    archive: Option<RwLock<ColumnStore>>,
+    chart_mapping: Option<ChartMapping>,
+    metrics: Metrics,
+}
+
+pub type AppState = Arc<WebState>;
+
+impl WebState {
+    fn new() -> Self {
+        let app = app_logic::constants::AppState::new();
+        let select_kpi_page = CachedPage::new(render_select_kpi_page(&app.available_kpis));
+        WebState {
+            app,
+            select_kpi_page,
+            input_pages: PageLru::new(INPUT_PAGE_CACHE_CAPACITY),
+            sessions: open_session_store(),
+            peers: RwLock::new(PeerIndex::new()),
+            archive: open_archive(),
+            chart_mapping: load_chart_mapping(),
+            metrics: Metrics::new(),
+        }
+    }
+
+    // The session named by the request's cookie, if it is still stored.
+    fn session(&self, headers: &HeaderMap) -> Option<(SessionId, Arc<Session>)> {
+        let id = session_cookie(headers)?;
+        let session = self.sessions.get(id);
+        self.metrics.record_session(session.is_some());
+        session.map(|session| (id, session))
+    }
+}
+
+fn open_session_store() -> SessionStore {
+    let config = SessionConfig::default();
+    let Some(path) = std::env::var_os(SESSION_LOG_ENV) else {
+        return SessionStore::new(config);
+    };
+    SessionStore::open(config, &path).unwrap_or_else(|error| {
+        tracing::warn!("{}: {error}; sessions are kept in memory only", path.to_string_lossy());
+        SessionStore::new(config)
+    })
+}
+
+fn open_archive() -> Option<RwLock<ColumnStore>> {
+    let path = std::env::var_os(ARCHIVE_ENV)?;
+    match ColumnStore::open(&path) {
+        Ok(store) => Some(RwLock::new(store)),
+        Err(error) => {
+            tracing::warn!("{}: {error}; screening is disabled", path.to_string_lossy());
+            None
+        }
+    }
+}
+
+fn load_chart_mapping() -> Option<ChartMapping> {
+    let path = std::env::var_os(CHART_MAPPING_ENV)?;
+    let mapping = std::fs::read(&path).map_err(MappingError::from).and_then(|json| ChartMapping::from_json(&json));
+    match mapping {
+        Ok(mapping) => Some(mapping),
+        Err(error) => {
+            tracing::warn!("{}: {error}; ledger uploads are disabled", path.to_string_lossy());
+            None
+        }
+    }
+}
+
+fn session_cookie(headers: &HeaderMap) -> Option<SessionId> {
+    headers
+        .get_all(header::COOKIE)
+        .iter()
+        .filter_map(|value| value.to_str().ok())
+        .flat_map(|cookies| cookies.split(';'))
+        .find_map(|cookie| cookie.trim().strip_prefix(SESSION_COOKIE)?.strip_prefix('='))
+        .and_then(parse_session_id)
+}
+
+#[derive(Template)]
+#[template(path = "select_kpi.html")]
+struct SelectKpiTemplate<'a> {
+    categories: Vec<KpiCategory<'a>>,
+}
+
+struct KpiCategory<'a> {
+    name: &'a str,
+    kpis: Vec<KpiItem<'a>>,
+}
+
+struct KpiItem<'a> {
+    key: &'a str,
+    name: &'a str,
+    description: &'a str,
+}
+
+#[derive(Template)]
+#[template(path = "input.html")]
+struct InputTemplate<'a> {
+    assets: Vec<PositionInput<'a>>,
+    // Fields only the balance check reads, shown collapsed
+    other_assets: Vec<PositionInput<'a>>,
+    liabilities_equity: Vec<PositionInput<'a>>,
+    other_liabilities_equity: Vec<PositionInput<'a>>,
+    selected_kpis: &'a [String],
+}
+
+struct PositionInput<'a> {
+    pos: &'a str,
+    name: &'a str,
+    value: String,
+}
+
+#[derive(Template)]
+#[template(path = "results.html")]
+struct ResultsTemplate<'a> {
+    results: Vec<KpiResultDisplay<'a>>,
+    // False when not every position was submitted and the check does not apply
+    balance_checked: bool,
+    balance_check_valid: bool,
+    balance_assets: f64,
+    balance_liabilities_equity: f64,
+}
+
+struct KpiResultDisplay<'a> {
+    name: &'a str,
+    value: String,
+    status: &'static str,
+    message: &'static str,
+    is_ratio: bool,
+    description: &'a str,
+}
+
+// The application's routes over freshly built shared state; `main` serves
+// it, the load benchmark drives it on an ephemeral port.
+pub fn router() -> Router {
+    let state = Arc::new(WebState::new());
+
+    Router::new()
+        .route("/", get(index))
+        .route("/input", get(input_page).post(process_kpi_selection))
+        .route("/calculate", get(show_results).post(calculate_kpis))
+        .route("/live", get(live::live_updates))
+        .route("/api/v1/kpis", post(api::calculate_kpis))
+        .route("/api/v1/kpis/stream", post(api::calculate_kpis_stream))
+        .route("/api/v1/sensitivity", post(api::sensitivity))
+        .route("/api/v1/stress", post(api::stress_test))
+        .route("/api/v1/peers", get(api::peer_group))
+        .route(
+            "/api/v1/peers/filings",
+            post(api::add_peer_filings).layer(DefaultBodyLimit::max(api::MAX_IMPORT_BYTES)),
+        )
+        .route("/api/v1/screen", post(api::screen_archive))
+        .route("/api/v1/ledger", post(api::import_ledger))
+        .route(
+            "/api/v1/archive/filings",
+            post(api::add_archived_filings).layer(DefaultBodyLimit::max(api::MAX_IMPORT_BYTES)),
+        )
+        .route(
+            "/api/v1/import",
+            post(api::import_balance_sheets).layer(DefaultBodyLimit::max(api::MAX_IMPORT_BYTES)),
+        )
+        .route("/metrics", get(metrics::metrics))
+        .nest_service("/static", ServeDir::new("static"))
+        .with_state(state)
+}
+
+async fn index(State(state): State<AppState>, headers: HeaderMap) -> Response {
+    let response = state.select_kpi_page.respond(&headers);
+    state.metrics.record_response(&response);
+    response
+}
+
+fn render_select_kpi_page(available_kpis: &BTreeMap<String, KpiDetails>) -> String {
+    let mut categories: BTreeMap<&str, Vec<KpiItem>> = BTreeMap::new();
+
+    for (key, details) in available_kpis {
+        let category = categories.entry(details.category_display.as_str()).or_insert_with(Vec::new);
+        category.push(KpiItem {
+            key,
+            name: &details.name_display,
+            description: &details.description_short,
+        });
+    }
+
+    let template = SelectKpiTemplate {
+        categories: categories.into_iter().map(|(name, kpis)| KpiCategory { name, kpis }).collect(),
+    };
+
+    template.render().unwrap()
+}
+
+async fn input_page(
+    State(state): State<AppState>,
+    Query(query): Query<BTreeMap<String, String>>,
+    headers: HeaderMap,
+) -> Response {
+    // Get selected KPIs from query params, normalized so equivalent
+    // selections share one cache entry
+    let mut selected_kpis: Vec<String> = query.get("kpis")
+        .map(|s| {
+            s.split(',')
+                .map(str::trim)
+                .filter(|k| state.app.available_kpis.contains_key(*k))
+                .map(str::to_string)
+                .collect()
+        })
+        .unwrap_or_default();
+    selected_kpis.sort();
+    selected_kpis.dedup();
+
+    // "Modifica Dati" on the results page: the form of the last
+    // calculation, filled in with its values.
+    if selected_kpis.is_empty() {
+        if let Some((_, session)) = state.session(&headers) {
+            let page = render_input_page(&state.app, &session.kpi_keys, Some(&session.positions));
+            return ([(header::CACHE_CONTROL, "no-store")], Html(page)).into_response();
+        }
+    }
+
+    let mut hit = true;
+    let page = state.input_pages.get_or_insert_with(&selected_kpis.join(","), || {
+        hit = false;
+        CachedPage::new(render_input_page(&state.app, &selected_kpis, None))
+    });
+    state.metrics.record_input_page(hit);
+    let response = page.respond(&headers);
+    state.metrics.record_response(&response);
+    response
+}
+
+fn render_input_page(
+    app: &app_logic::constants::AppState,
+    selected_kpis: &[String],
+    values: Option<&BalanceSheet>,
+) -> String {
+    let fields = app.input_fields(selected_kpis);
+    let field = |&(id, _): &(PositionId, bool)| {
+        let key = position_key(id);
+        app.position_names.get(key).map(|name| PositionInput {
+            pos: key,
+            name,
+            value: values.map_or_else(String::new, |values| form_value(values.get(id))),
+        })
+    };
+    // The positions the selected KPIs read, then the rest of the side for
+    // the balance check.
+    let split = |side: &[(PositionId, bool)]| -> (Vec<_>, Vec<_>) {
+        let (read, rest): (Vec<_>, Vec<_>) = side.iter().partition(|(_, read)| *read);
+        (read.into_iter().filter_map(field).collect(), rest.into_iter().filter_map(field).collect())
+    };
+    let (assets, other_assets) = split(&fields.assets);
+    let (liabilities_equity, other_liabilities_equity) = split(&fields.liabilities_equity);
+
+    let template = InputTemplate {
+        assets,
+        other_assets,
+        liabilities_equity,
+        other_liabilities_equity,
+        selected_kpis,
+    };
+    template.render().unwrap()
+}
+
+async fn process_kpi_selection(RawForm(body): RawForm) -> Redirect {
+    let kpi_keys: Vec<String> = url::form_urlencoded::parse(&body)
+        .filter(|(k, _)| k == "kpi_keys")
+        .map(|(_, v)| v.into_owned())
+        .collect();
+    let kpi_list = kpi_keys.join(",");
+    Redirect::to(&format!("/input?kpis={}", kpi_list))
+}
+
+// Zero stays blank; otherwise a decimal comma, which the form parser never
+// mistakes for a thousands separator.
+fn form_value(amount: f64) -> String {
+    if amount == 0.0 {
+        String::new()
+    } else {
+        amount.to_string().replace('.', ",")
+    }
+}
+
+// Reloading the results page shows the stored results again; without a
+// session there is nothing to show, so start over.
+async fn show_results(State(state): State<AppState>, headers: HeaderMap) -> Response {
+    match state.session(&headers) {
+        Some((_, session)) => {
+            let page = render_results_page(&state.app.available_kpis, &session.results, session.balance_check.as_ref());
+            ([(header::CACHE_CONTROL, "no-store")], Html(page)).into_response()
+        }
+        None => Redirect::to("/").into_response(),
+    }
+}
+
+async fn calculate_kpis(State(state): State<AppState>, headers: HeaderMap, RawForm(body): RawForm) -> Response {
+    let available_kpis = &state.app.available_kpis;
+    let metrics = &state.metrics;
+    let _span = tracing::debug_span!("calculate_kpis", bytes = body.len()).entered();
+    
+    // One pass over the body: kpi_keys[] (repeated) and pos_xxx parsed
+    // straight into the compact layout
+    let form = metrics.time(Stage::FormDecode, || PositionForm::decode(&body));
+    
+    if form.kpi_keys.is_empty() {
+        return Html("<html><body><h1>Error</h1><p>Nessun KPI selezionato.</p></body></html>".to_string()).into_response();
+    }
+    let selected_kpis = &form.kpi_keys;
+    
+    // Validate the positions the selected KPIs read and the other fields of
+    // the page, which the balance check reads
+    let required_positions = get_required_positions(selected_kpis).union(state.app.balance_inputs);
+    let (sheet, errors) = metrics.time(Stage::Validation, || form.validate(required_positions));
+    
+    if !errors.is_empty() {
+        metrics.record_validation_errors(errors.keys());
+        return Html("<html><body><h1>Error</h1><p>Validation failed</p></body></html>".to_string()).into_response();
+    }
+    
+    // Calculate KPIs on the compact layout
+    let (results, elapsed) = metrics.timed(Stage::Calculation, || calculate_selected_kpis(&sheet, selected_kpis));
+    metrics.record_kpis(&results, elapsed);
+    let balance_check = form.balance_check(state.app.balance_inputs);
+    let page = metrics.time(Stage::Rendering, || render_results_page(available_kpis, &results, balance_check.as_ref()));
+    
+    // Keep inputs and results for reloads and "Modifica Dati"; a known
+    // session is overwritten, anything else gets a fresh id
+    let id = session_cookie(&headers)
+        .filter(|id| state.sessions.get(*id).is_some())
+        .unwrap_or_else(new_session_id);
+    let session = Session { kpi_keys: form.kpi_keys, positions: sheet, results, balance_check };
+    if let Err(error) = state.sessions.insert(id, session) {
+        tracing::warn!("{error}");
+    }
+    let cookie = format!("{SESSION_COOKIE}={}; Path=/; HttpOnly; SameSite=Lax", format_session_id(id));
+    let cookie = HeaderValue::from_str(&cookie).expect("hex session id is a valid header value");
+    ([(header::SET_COOKIE, cookie)], Html(page)).into_response()
+}
+
+pub fn render_results_page(
+    available_kpis: &BTreeMap<String, KpiDetails>,
+    results: &BTreeMap<String, KpiResult>,
+    balance_check: Option<&BalanceCheck>,
+) -> String {
+    // Convert to display format
+    let mut display_results = Vec::new();
+    for (key, result) in results {
+        if let Some(kpi_details) = available_kpis.get(key) {
+            let value_str = result.value.map_or("".to_string(), |v| format!("{:.2}", v));
+            display_results.push(KpiResultDisplay {
+                name: &kpi_details.name_display,
+                value: value_str,
+                status: result.status.as_str(),
+                message: result.message(),
+                is_ratio: kpi_details.is_ratio,
+                description: &kpi_details.description_short,
+            });
+        }
+    }
+    
+    let template = ResultsTemplate {
+        results: display_results,
+        balance_checked: balance_check.is_some(),
+        balance_check_valid: balance_check.is_some_and(|check| check.valid),
+        balance_assets: balance_check.map_or(0.0, |check| check.assets),
+        balance_liabilities_equity: balance_check.map_or(0.0, |check| check.liabilities_equity),
+    };
+    
+    template.render().unwrap()
+}
+
+#[derive(Debug, Deserialize)]
+pub struct KpiSelectionForm {
+    kpi_keys: Vec<String>,
+}
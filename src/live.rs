@@ -0,0 +1,136 @@
+use std::collections::BTreeMap;
+
+use axum::{
+    extract::{
+        ws::{Message, WebSocket, WebSocketUpgrade},
+        Query, State,
+    },
+    response::Response,
+};
+use serde::Serialize;
+
+use crate::api::{default_kpis, KpiResultBody};
+use crate::app_logic::{
+    calculator::BalanceCheck,
+    incremental::LiveSheet,
+    positions::{position_index, position_key, PositionId},
+    validators::validate_financial_data,
+};
+use crate::AppState;
+
+// Pushed after every message: the KPIs whose result changed, the fields that
+// could not be read and the running balance check, null until every field of
+// the input page has been sent.
+#[derive(Serialize)]
+struct LiveUpdate<'a> {
+    kpis: BTreeMap<&'a str, LiveKpi<'a>>,
+    errors: BTreeMap<String, String>,
+    balance_check: Option<BalanceCheck>,
+}
+
+#[derive(Serialize)]
+struct LiveKpi<'a> {
+    name: &'a str,
+    #[serde(flatten)]
+    result: KpiResultBody,
+}
+
+// GET /live?kpis=a,b, upgraded to a WebSocket. The input page sends the form
+// fields it changed as a JSON object ({"pos_31": "1234,56"}); the connection
+// keeps the sheet and its subtotals, so each edit only recomputes the KPIs
+// that read the edited positions.
+pub async fn live_updates(
+    ws: WebSocketUpgrade,
+    State(state): State<AppState>,
+    Query(query): Query<BTreeMap<String, String>>,
+) -> Response {
+    let kpis = default_kpis(&query);
+    ws.on_upgrade(move |socket| run(socket, state, kpis))
+}
+
+async fn run(mut socket: WebSocket, state: AppState, kpis: Vec<String>) {
+    let mut live = LiveSheet::new(&kpis);
+    let all: Vec<usize> = (0..kpis.len()).collect();
+    if send_update(&mut socket, &state, &kpis, &live, &all, BTreeMap::new()).await.is_err() {
+        return;
+    }
+
+    while let Some(Ok(message)) = socket.recv().await {
+        let text = match message {
+            Message::Text(text) => text,
+            Message::Close(_) => break,
+            _ => continue,
+        };
+        let (changed, errors) = match serde_json::from_str::<BTreeMap<String, String>>(&text) {
+            Ok(fields) => apply_fields(&mut live, fields),
+            Err(_) => (Vec::new(), BTreeMap::from([("message".to_string(), "Messaggio non valido.".to_string())])),
+        };
+        if send_update(&mut socket, &state, &kpis, &live, &changed, errors).await.is_err() {
+            break;
+        }
+    }
+}
+
+// Parses the fields exactly like the submitted form (an emptied field counts
+// as zero) and applies the valid ones; returns the changed KPI indices and
+// field errors.
+fn apply_fields(live: &mut LiveSheet, mut fields: BTreeMap<String, String>) -> (Vec<usize>, BTreeMap<String, String>) {
+    let mut errors = BTreeMap::new();
+    let mut ids: Vec<PositionId> = Vec::with_capacity(fields.len());
+    fields.retain(|field, _| match field.strip_prefix("pos_").and_then(position_index) {
+        Some(id) => {
+            ids.push(id);
+            true
+        }
+        None => {
+            errors.insert(field.clone(), "Posizione sconosciuta.".to_string());
+            false
+        }
+    });
+
+    let keys: Vec<String> = ids.iter().map(|id| position_key(*id).to_string()).collect();
+    let (values, field_errors) = validate_financial_data(&fields, &keys);
+
+    // A field that does not parse keeps its previous value (the form parser
+    // would zero it); the client gets the error instead.
+    let mut changed = Vec::new();
+    for (id, key) in ids.iter().zip(&keys) {
+        if field_errors.contains_key(&format!("pos_{key}")) {
+            continue;
+        }
+        if let Some(value) = values.get(key) {
+            for index in live.set(*id, *value) {
+                if !changed.contains(&index) {
+                    changed.push(index);
+                }
+            }
+        }
+    }
+    changed.sort_unstable();
+    errors.extend(field_errors);
+    (changed, errors)
+}
+
+async fn send_update(
+    socket: &mut WebSocket,
+    state: &AppState,
+    kpis: &[String],
+    live: &LiveSheet,
+    changed: &[usize],
+    errors: BTreeMap<String, String>,
+) -> Result<(), axum::Error> {
+    let update = LiveUpdate {
+        kpis: changed
+            .iter()
+            .map(|&index| {
+                let key = kpis[index].as_str();
+                let name = state.app.available_kpis.get(key).map_or(key, |details| details.name_display.as_str());
+                (key, LiveKpi { name, result: KpiResultBody::from(&live.results()[index]) })
+            })
+            .collect(),
+        errors,
+        balance_check: live.balance_check(state.app.balance_inputs),
+    };
+    let json = serde_json::to_string(&update).expect("live update serializes to JSON");
+    socket.send(Message::Text(json)).await
+}
@@ -0,0 +1,229 @@
+use std::fmt::Write;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::time::{Duration, Instant};
+
+use axum::{
+    extract::State,
+    http::{header, StatusCode},
+    response::{IntoResponse, Response},
+};
+
+use crate::app_logic::{
+    calculator::KpiResult,
+    kpi_config::KPI_DEFINITIONS,
+    positions::{position_index, position_key, POSITION_COUNT},
+};
+use crate::AppState;
+
+// Upper bounds (seconds) of the latency buckets, from 5 µs to 1 s.
+const BUCKETS: [f64; 16] = [
+    0.000_005, 0.000_01, 0.000_025, 0.000_05, 0.000_1, 0.000_25, 0.000_5, 0.001, 0.002_5, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 1.0,
+];
+
+// Stages of POST /calculate, each with its own latency histogram.
+#[derive(Debug, Clone, Copy)]
+pub enum Stage {
+    FormDecode,
+    Validation,
+    Calculation,
+    Rendering,
+}
+
+impl Stage {
+    const ALL: [Stage; 4] = [Stage::FormDecode, Stage::Validation, Stage::Calculation, Stage::Rendering];
+
+    pub fn as_str(self) -> &'static str {
+        match self {
+            Stage::FormDecode => "form_decode",
+            Stage::Validation => "validation",
+            Stage::Calculation => "calculate_selected_kpis",
+            Stage::Rendering => "render_results",
+        }
+    }
+}
+
+// Prometheus-style histogram on relaxed atomics: recording is a bucket
+// search over 16 bounds and three increments, no lock and no allocation.
+struct Histogram {
+    counts: [AtomicU64; BUCKETS.len() + 1],
+    sum_nanos: AtomicU64,
+}
+
+impl Histogram {
+    fn new() -> Self {
+        Histogram { counts: std::array::from_fn(|_| AtomicU64::new(0)), sum_nanos: AtomicU64::new(0) }
+    }
+
+    fn observe(&self, elapsed: Duration) {
+        let seconds = elapsed.as_secs_f64();
+        let bucket = BUCKETS.iter().position(|bound| seconds <= *bound).unwrap_or(BUCKETS.len());
+        self.counts[bucket].fetch_add(1, Ordering::Relaxed);
+        self.sum_nanos.fetch_add(elapsed.as_nanos() as u64, Ordering::Relaxed);
+    }
+
+    fn write(&self, out: &mut String, name: &str, labels: &str) {
+        let mut cumulative = 0;
+        for (bound, count) in BUCKETS.iter().zip(&self.counts) {
+            cumulative += count.load(Ordering::Relaxed);
+            let _ = writeln!(out, "{name}_bucket{{{labels},le=\"{bound}\"}} {cumulative}");
+        }
+        cumulative += self.counts[BUCKETS.len()].load(Ordering::Relaxed);
+        let _ = writeln!(out, "{name}_bucket{{{labels},le=\"+Inf\"}} {cumulative}");
+        let sum = self.sum_nanos.load(Ordering::Relaxed) as f64 / 1e9;
+        let _ = writeln!(out, "{name}_sum{{{labels}}} {sum}");
+        let _ = writeln!(out, "{name}_count{{{labels}}} {cumulative}");
+    }
+}
+
+// Counters per KPI of `KPI_DEFINITIONS`.
+struct KpiCounters {
+    ok: AtomicU64,
+    failed: AtomicU64,
+    // Calculation-stage time of the requests that asked for this KPI.
+    calculation_nanos: AtomicU64,
+}
+
+// Process-wide counters. Everything is recorded with relaxed atomic adds
+// and only formatted when /metrics is scraped.
+pub struct Metrics {
+    stages: [Histogram; Stage::ALL.len()],
+    kpis: Vec<KpiCounters>,
+    validation_errors: [AtomicU64; POSITION_COUNT],
+    input_page_hits: AtomicU64,
+    input_page_misses: AtomicU64,
+    not_modified: AtomicU64,
+    session_hits: AtomicU64,
+    session_misses: AtomicU64,
+}
+
+impl Metrics {
+    pub fn new() -> Self {
+        Metrics {
+            stages: std::array::from_fn(|_| Histogram::new()),
+            kpis: KPI_DEFINITIONS
+                .iter()
+                .map(|_| KpiCounters {
+                    ok: AtomicU64::new(0),
+                    failed: AtomicU64::new(0),
+                    calculation_nanos: AtomicU64::new(0),
+                })
+                .collect(),
+            validation_errors: std::array::from_fn(|_| AtomicU64::new(0)),
+            input_page_hits: AtomicU64::new(0),
+            input_page_misses: AtomicU64::new(0),
+            not_modified: AtomicU64::new(0),
+            session_hits: AtomicU64::new(0),
+            session_misses: AtomicU64::new(0),
+        }
+    }
+
+    // Runs one stage inside a debug-level tracing span and records its latency.
+    pub fn time<T>(&self, stage: Stage, run: impl FnOnce() -> T) -> T {
+        self.timed(stage, run).0
+    }
+
+    pub fn timed<T>(&self, stage: Stage, run: impl FnOnce() -> T) -> (T, Duration) {
+        let _span = tracing::debug_span!("stage", name = stage.as_str()).entered();
+        let start = Instant::now();
+        let result = run();
+        let elapsed = start.elapsed();
+        self.stages[stage as usize].observe(elapsed);
+        (result, elapsed)
+    }
+
+    pub fn record_kpis<'a>(&self, results: impl IntoIterator<Item = (&'a String, &'a KpiResult)>, elapsed: Duration) {
+        let nanos = elapsed.as_nanos() as u64;
+        for (key, result) in results {
+            let Some(index) = KPI_DEFINITIONS.iter().position(|definition| definition.key == key) else {
+                continue;
+            };
+            let counters = &self.kpis[index];
+            let outcome = if result.status.is_ok() { &counters.ok } else { &counters.failed };
+            outcome.fetch_add(1, Ordering::Relaxed);
+            counters.calculation_nanos.fetch_add(nanos, Ordering::Relaxed);
+        }
+    }
+
+    // `fields` are form field names ("pos_31").
+    pub fn record_validation_errors<'a>(&self, fields: impl IntoIterator<Item = &'a String>) {
+        for field in fields {
+            if let Some(id) = field.strip_prefix("pos_").and_then(position_index) {
+                self.validation_errors[id].fetch_add(1, Ordering::Relaxed);
+            }
+        }
+    }
+
+    pub fn record_input_page(&self, hit: bool) {
+        let counter = if hit { &self.input_page_hits } else { &self.input_page_misses };
+        counter.fetch_add(1, Ordering::Relaxed);
+    }
+
+    pub fn record_session(&self, hit: bool) {
+        let counter = if hit { &self.session_hits } else { &self.session_misses };
+        counter.fetch_add(1, Ordering::Relaxed);
+    }
+
+    pub fn record_response(&self, response: &Response) {
+        if response.status() == StatusCode::NOT_MODIFIED {
+            self.not_modified.fetch_add(1, Ordering::Relaxed);
+        }
+    }
+
+    // Prometheus text exposition format, version 0.0.4.
+    pub fn render(&self) -> String {
+        let mut out = String::with_capacity(16 * 1024);
+
+        out.push_str("# HELP kpi_stage_duration_seconds Time spent in each stage of POST /calculate.\n");
+        out.push_str("# TYPE kpi_stage_duration_seconds histogram\n");
+        for stage in Stage::ALL {
+            let labels = format!("stage=\"{}\"", stage.as_str());
+            self.stages[stage as usize].write(&mut out, "kpi_stage_duration_seconds", &labels);
+        }
+
+        out.push_str("# HELP kpi_evaluations_total KPI results computed by POST /calculate, by outcome.\n");
+        out.push_str("# TYPE kpi_evaluations_total counter\n");
+        for (definition, counters) in KPI_DEFINITIONS.iter().zip(&self.kpis) {
+            let key = definition.key;
+            let _ = writeln!(out, "kpi_evaluations_total{{kpi=\"{key}\",status=\"ok\"}} {}", counters.ok.load(Ordering::Relaxed));
+            let _ = writeln!(out, "kpi_evaluations_total{{kpi=\"{key}\",status=\"error\"}} {}", counters.failed.load(Ordering::Relaxed));
+        }
+        out.push_str("# HELP kpi_calculation_seconds_total Calculation-stage time of the requests that included the KPI.\n");
+        out.push_str("# TYPE kpi_calculation_seconds_total counter\n");
+        for (definition, counters) in KPI_DEFINITIONS.iter().zip(&self.kpis) {
+            let seconds = counters.calculation_nanos.load(Ordering::Relaxed) as f64 / 1e9;
+            let _ = writeln!(out, "kpi_calculation_seconds_total{{kpi=\"{}\"}} {seconds}", definition.key);
+        }
+
+        out.push_str("# HELP kpi_validation_errors_total Form values rejected as invalid amounts, by position.\n");
+        out.push_str("# TYPE kpi_validation_errors_total counter\n");
+        for (id, counter) in self.validation_errors.iter().enumerate() {
+            let count = counter.load(Ordering::Relaxed);
+            if count > 0 {
+                let _ = writeln!(out, "kpi_validation_errors_total{{position=\"{}\"}} {count}", position_key(id));
+            }
+        }
+
+        out.push_str("# HELP kpi_page_cache_requests_total Input page lookups in the rendered-page cache.\n");
+        out.push_str("# TYPE kpi_page_cache_requests_total counter\n");
+        let _ = writeln!(out, "kpi_page_cache_requests_total{{result=\"hit\"}} {}", self.input_page_hits.load(Ordering::Relaxed));
+        let _ = writeln!(out, "kpi_page_cache_requests_total{{result=\"miss\"}} {}", self.input_page_misses.load(Ordering::Relaxed));
+        out.push_str("# HELP kpi_page_not_modified_total Cached pages answered with 304 Not Modified.\n");
+        out.push_str("# TYPE kpi_page_not_modified_total counter\n");
+        let _ = writeln!(out, "kpi_page_not_modified_total {}", self.not_modified.load(Ordering::Relaxed));
+        out.push_str("# HELP kpi_session_lookups_total Results-page sessions looked up by cookie.\n");
+        out.push_str("# TYPE kpi_session_lookups_total counter\n");
+        let _ = writeln!(out, "kpi_session_lookups_total{{result=\"hit\"}} {}", self.session_hits.load(Ordering::Relaxed));
+        let _ = writeln!(out, "kpi_session_lookups_total{{result=\"miss\"}} {}", self.session_misses.load(Ordering::Relaxed));
+        out
+    }
+}
+
+// GET /metrics
+pub async fn metrics(State(state): State<AppState>) -> Response {
+    (
+        [(header::CONTENT_TYPE, "text/plain; version=0.0.4; charset=utf-8")],
+        state.metrics.render(),
+    )
+        .into_response()
+}
@@ -0,0 +1,135 @@
+use std::collections::hash_map::DefaultHasher;
+use std::collections::HashMap;
+use std::hash::{Hash, Hasher};
+use std::io::Write;
+use std::sync::{Arc, Mutex};
+
+use axum::{
+    body::Bytes,
+    http::{header, HeaderMap, HeaderValue, StatusCode},
+    response::{IntoResponse, Response},
+};
+use flate2::{write::GzEncoder, Compression};
+
+// A fully rendered page, stored both plain and gzip-compressed.
+pub struct CachedPage {
+    body: Bytes,
+    gzip: Bytes,
+    etag: HeaderValue,
+}
+
+impl CachedPage {
+    pub fn new(html: String) -> Self {
+        let mut hasher = DefaultHasher::new();
+        html.hash(&mut hasher);
+        let etag = format!("\"{:016x}-{:x}\"", hasher.finish(), html.len());
+
+        let mut encoder = GzEncoder::new(Vec::new(), Compression::best());
+        encoder.write_all(html.as_bytes()).expect("gzip into memory cannot fail");
+        let gzip = encoder.finish().expect("gzip into memory cannot fail");
+
+        CachedPage {
+            body: Bytes::from(html),
+            gzip: Bytes::from(gzip),
+            etag: HeaderValue::from_str(&etag).expect("hex ETag is a valid header value"),
+        }
+    }
+
+    // 304 when the client already has this version, otherwise the body
+    // in the best encoding the client accepts.
+    pub fn respond(&self, request_headers: &HeaderMap) -> Response {
+        let mut headers = HeaderMap::new();
+        headers.insert(header::ETAG, self.etag.clone());
+        headers.insert(header::CACHE_CONTROL, HeaderValue::from_static("no-cache"));
+        headers.insert(header::VARY, HeaderValue::from_static("Accept-Encoding"));
+
+        if etag_matches(request_headers, &self.etag) {
+            return (StatusCode::NOT_MODIFIED, headers).into_response();
+        }
+
+        headers.insert(header::CONTENT_TYPE, HeaderValue::from_static("text/html; charset=utf-8"));
+        if accepts_gzip(request_headers) {
+            headers.insert(header::CONTENT_ENCODING, HeaderValue::from_static("gzip"));
+            (headers, self.gzip.clone()).into_response()
+        } else {
+            (headers, self.body.clone()).into_response()
+        }
+    }
+}
+
+fn etag_matches(request_headers: &HeaderMap, etag: &HeaderValue) -> bool {
+    let Some(if_none_match) = request_headers.get(header::IF_NONE_MATCH).and_then(|v| v.to_str().ok()) else {
+        return false;
+    };
+    let etag = etag.to_str().unwrap_or_default();
+    if_none_match.split(',').map(str::trim).any(|candidate| {
+        candidate == "*" || candidate.strip_prefix("W/").unwrap_or(candidate) == etag
+    })
+}
+
+fn accepts_gzip(request_headers: &HeaderMap) -> bool {
+    let Some(accept_encoding) = request_headers.get(header::ACCEPT_ENCODING).and_then(|v| v.to_str().ok()) else {
+        return false;
+    };
+    accept_encoding.split(',').any(|coding| {
+        let mut parts = coding.split(';').map(str::trim);
+        let name = parts.next().unwrap_or_default();
+        let refused = parts.any(|param| {
+            param.strip_prefix("q=").and_then(|q| q.trim().parse::<f32>().ok()) == Some(0.0)
+        });
+        !refused && (name.eq_ignore_ascii_case("gzip") || name == "*")
+    })
+}
+
+// Bounded least-recently-used map from a normalized key to a rendered page.
+pub struct PageLru {
+    capacity: usize,
+    entries: Mutex<LruEntries>,
+}
+
+#[derive(Default)]
+struct LruEntries {
+    clock: u64,
+    pages: HashMap<String, (Arc<CachedPage>, u64)>,
+}
+
+impl PageLru {
+    pub fn new(capacity: usize) -> Self {
+        PageLru { capacity: capacity.max(1), entries: Mutex::new(LruEntries::default()) }
+    }
+
+    pub fn get(&self, key: &str) -> Option<Arc<CachedPage>> {
+        let mut entries = self.entries.lock().unwrap();
+        entries.clock += 1;
+        let now = entries.clock;
+        entries.pages.get_mut(key).map(|(page, last_used)| {
+            *last_used = now;
+            Arc::clone(page)
+        })
+    }
+
+    // Renders outside the lock; two concurrent misses may both render, the
+    // second insert simply replaces the first.
+    pub fn get_or_insert_with(&self, key: &str, render: impl FnOnce() -> CachedPage) -> Arc<CachedPage> {
+        if let Some(page) = self.get(key) {
+            return page;
+        }
+        let page = Arc::new(render());
+
+        let mut entries = self.entries.lock().unwrap();
+        entries.clock += 1;
+        let now = entries.clock;
+        if entries.pages.len() >= self.capacity && !entries.pages.contains_key(key) {
+            let oldest = entries
+                .pages
+                .iter()
+                .min_by_key(|(_, (_, last_used))| *last_used)
+                .map(|(k, _)| k.clone());
+            if let Some(oldest) = oldest {
+                entries.pages.remove(&oldest);
+            }
+        }
+        entries.pages.insert(key.to_string(), (Arc::clone(&page), now));
+        page
+    }
+}